@@ -0,0 +1,431 @@
+''' Aggregate statistics across all tracks.
+Keeps the totals of the activities by day, ISO week, and month of their
+start time (local time of the track), and by activity type, which is taken
+from the Polar file name, e.g. Walking for
+
+    Kenneth_Evans_2021-12-04_12-01-33_Walking_Kensington.gpx
+
+For each day, week, and month and each activity type the number of
+activities, distance (mi), moving and elapsed time (min), elevation gain
+(m), and the count, sum, sum of squares, and maximum of the hr are kept, so
+sums, averages, and the hr standard deviation of any range are found
+without going back to the tracks.
+
+The statistics of each file are kept along with the size and modification
+time of the GPX file. Adding, changing, or removing a file only adds its
+statistics to, or takes them from, the periods it is in, so the library is
+never read again. All of it is kept in one JSON file. A query goes over
+arrays of the periods, so even ten years of days takes a few ms, e.g.
+
+    python aggregates.py add ~/Documents/GPSLink
+    python aggregates.py query --level month --start 2021-01-01 --activity Walking
+
+watcher.py keeps the aggregates up to date as files arrive with
+--aggregates.
+'''
+
+import argparse
+import datetime
+import json
+import os
+import re
+import sys
+
+import numpy as np
+
+DEFAULT_AGGREGATES_FILE = os.path.join(os.path.expanduser('~'), '.cache', 'py_gps',
+    'aggregates.json')
+# Version of the file format, a file with another version is started again
+FORMAT_VERSION = 1
+LEVELS = ('day', 'week', 'month')
+# Statistics kept for each period, all are sums except hr_max
+STATS = ('count', 'distance', 'moving_time', 'elapsed_time', 'ele_gain', 'hr_n', 'hr_sum',
+    'hr_sum2', 'hr_max')
+HR_MAX = STATS.index('hr_max')
+# Slowest speed counted as moving, mph. It is compared with the filtered
+# speed of speed.process_speed, as the raw speed of GPS points standing still
+# jitters around this and would count much of a stop as moving.
+MOVING_SPEED = 1.
+# Change in elevation needed to count as a climb or descent, m
+ELE_THRESHOLD = 3.
+DEFAULT_ACTIVITY = 'Other'
+# Polar export names: <name>_<date>_<time>_<activity>_<place>.gpx
+ACTIVITY_PATTERN = re.compile(r'_\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2}_([^_.]+)')
+
+def get_aggregates_file():
+    '''Returns the aggregates file, which may be set with
+    PY_GPS_AGGREGATES.'''
+    return os.environ.get('PY_GPS_AGGREGATES', DEFAULT_AGGREGATES_FILE)
+
+def get_activity(file_name):
+    '''Returns the activity type from a Polar file name, or
+    DEFAULT_ACTIVITY.'''
+    match = ACTIVITY_PATTERN.search(os.path.basename(file_name))
+    return match.group(1) if match else DEFAULT_ACTIVITY
+
+def get_periods(date):
+    '''Returns the day, ISO week, and month keys for a date, which sort in
+    time order, e.g. 2021-12-04, 2021-W48, 2021-12.'''
+    if isinstance(date, str):
+        date = datetime.date.fromisoformat(date[:10])
+    year, week, weekday = date.isocalendar()
+    return {'day': date.isoformat(), 'week': f'{year:04d}-W{week:02d}',
+        'month': f'{date.year:04d}-{date.month:02d}'}
+
+def get_ele_gain(ele, seg_offsets=None, threshold=ELE_THRESHOLD):
+    '''Returns the total climb, m, counting only changes of at least
+    threshold from the last turning point, so GPS noise is not added up.
+    Missing (NaN) elevations are skipped and segments are separate.'''
+    ele = np.asarray(ele, dtype=np.float64)
+    if seg_offsets is None:
+        seg_offsets = [0, len(ele)]
+    gain = 0.
+    for start, end in zip(seg_offsets[:-1], seg_offsets[1:]):
+        values = ele[start:end]
+        values = values[~np.isnan(values)].tolist()
+        if not values:
+            continue
+        # Lowest and highest since the last turn, and whether climbing
+        low = high = values[0]
+        climbing = None
+        for value in values:
+            if climbing:
+                if value > high:
+                    high = value
+                elif high - value >= threshold:
+                    gain += high - low
+                    climbing = False
+                    low = value
+            elif climbing is False:
+                if value < low:
+                    low = value
+                elif value - low >= threshold:
+                    climbing = True
+                    high = value
+            else:
+                low = min(low, value)
+                high = max(high, value)
+                if value - low >= threshold:
+                    climbing = True
+                    high = value
+                elif high - value >= threshold:
+                    climbing = False
+                    low = value
+        if climbing:
+            gain += high - low
+    return gain
+
+def get_stats(track):
+    '''Returns the STATS of a Track as a list. The moving time is the time
+    of the steps where the filtered speed, as batch.process_file finds it,
+    is at least MOVING_SPEED.'''
+    import speed as s
+    speed, dist, time_delta = s.get_speed_array(track.lat, track.lon, track.datetime64,
+        track.segment_starts(), track.xy)[:3]
+    filtered = s.process_speed(track, speed, fs=None, uniform=True, zero_phase=True)
+    moving = filtered >= MOVING_SPEED
+    hr = track.hr[track.hr > 0].astype(np.float64)
+    return [1., float(dist.sum()), float(time_delta[moving].sum()) / 60.,
+        float(time_delta.sum()) / 60., get_ele_gain(track.ele, track.seg_offsets),
+        float(len(hr)), float(hr.sum()), float((hr * hr).sum()),
+        float(hr.max()) if len(hr) else 0.]
+
+def load_track(file_name):
+    '''Reads the track for the aggregates.'''
+    import gpx_stream
+    return gpx_stream.read_track(file_name)
+
+def get_entry(file_name, track=None, loader=load_track):
+    '''Returns the entry for the file: its size and modification time, start
+    time, activity type, periods, and stats. The track is read with loader
+    if not given.'''
+    stat = os.stat(file_name)
+    if track is None:
+        track = loader(file_name)
+    if len(track) == 0:
+        raise ValueError('No trackpoints found')
+    start = track[[0]].datetimes()[0]
+    entry = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+        'start_time': start.isoformat(), 'activity': get_activity(file_name)}
+    entry.update(get_periods(start.date()))
+    entry['stats'] = get_stats(track)
+    return entry
+
+class Aggregates:
+    '''Aggregate statistics of a library of tracks, kept in a JSON file if
+    file_name is given. It is also a watcher.FolderWatcher listener, taking
+    the get_entry of each file from the aggregates of its summary. A file
+    whose summary has an error keeps its entry until the file is removed.
+
+        Attributes
+        ----------
+        files : dict
+            The get_entry of each file, by absolute path.
+        buckets : dict
+            For each of LEVELS, the STATS of each (period, activity).
+    '''
+
+    def __init__(self, file_name=None):
+        self.file_name = file_name
+        self.files = {}
+        self.buckets = {level: {} for level in LEVELS}
+        self.changed = False
+        # Query arrays for each level, made when first needed
+        self.tables = {}
+        if file_name:
+            self.load()
+
+    def load(self):
+        try:
+            with open(self.file_name, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data.get('version') != FORMAT_VERSION or data.get('stats') != list(STATS):
+            return
+        self.files = data['files']
+        for level in LEVELS:
+            self.buckets[level] = {(period, activity): values
+                for period, activity, values in data['buckets'][level]}
+        self.tables = {}
+
+    def get_text(self):
+        return json.dumps({'version': FORMAT_VERSION, 'stats': list(STATS),
+            'files': self.files,
+            'buckets': {level: [[period, activity, values]
+                for (period, activity), values in sorted(self.buckets[level].items())]
+                for level in LEVELS}})
+
+    def save(self, text=None):
+        '''Writes the aggregates, or text from get_text, to the JSON file.'''
+        if not self.file_name:
+            return
+        if text is None:
+            text = self.get_text()
+        os.makedirs(os.path.dirname(os.path.abspath(self.file_name)), exist_ok=True)
+        # Write to a temporary file, then rename, so readers never see a
+        # partial file
+        tmp = f'{self.file_name}.{os.getpid()}.tmp'
+        with open(tmp, 'w') as f:
+            f.write(text)
+        os.replace(tmp, self.file_name)
+
+    def is_current(self, file_name):
+        '''Returns whether the file is included and has not changed since.'''
+        entry = self.files.get(os.path.abspath(file_name))
+        if entry is None:
+            return False
+        try:
+            stat = os.stat(file_name)
+        except OSError:
+            return False
+        return entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns
+
+    def add(self, file_name, entry=None, loader=load_track):
+        '''Adds or replaces the file, with entry from get_entry, which is
+        found with loader if not given.'''
+        file_name = os.path.abspath(file_name)
+        if entry is None:
+            entry = get_entry(file_name, loader=loader)
+        self.remove(file_name)
+        self.files[file_name] = entry
+        stats = entry['stats']
+        for level in LEVELS:
+            key = (entry[level], entry['activity'])
+            values = self.buckets[level].get(key)
+            if values is None:
+                self.buckets[level][key] = list(stats)
+                continue
+            for i, value in enumerate(stats):
+                values[i] = max(values[i], value) if i == HR_MAX else values[i] + value
+        self.changed = True
+        self.tables = {}
+
+    def remove(self, file_name):
+        '''Takes the file out if it is there.'''
+        entry = self.files.pop(os.path.abspath(file_name), None)
+        if entry is None:
+            return
+        stats = entry['stats']
+        for level in LEVELS:
+            key = (entry[level], entry['activity'])
+            values = self.buckets[level][key]
+            if values[0] <= stats[0]:
+                # It was the only activity
+                del self.buckets[level][key]
+                continue
+            for i, value in enumerate(stats):
+                if i != HR_MAX:
+                    values[i] -= value
+            if stats[HR_MAX] >= values[HR_MAX]:
+                # The maximum cannot be taken back, so find it again from
+                # the other files in the period
+                values[HR_MAX] = max((other['stats'][HR_MAX] for other in self.files.values()
+                    if other[level] == key[0] and other['activity'] == key[1]), default=0.)
+        self.changed = True
+        self.tables = {}
+
+    def update(self, file_names, loader=load_track, prune=False):
+        '''Adds the files that are new or changed, and saves if anything
+        changed. If prune is True, files that no longer exist are removed.
+        Returns (number added, number removed, errors), where errors is a
+        list of (file_name, message).'''
+        n_added = 0
+        errors = []
+        for file_name in file_names:
+            if self.is_current(file_name):
+                continue
+            try:
+                self.add(file_name, loader=loader)
+                n_added += 1
+            except Exception as ex:
+                errors.append((file_name, f'{type(ex).__name__}: {ex}'))
+        n_removed = 0
+        if prune:
+            for file_name in [name for name in self.files if not os.path.exists(name)]:
+                self.remove(file_name)
+                n_removed += 1
+        if n_added or n_removed:
+            self.save()
+        return n_added, n_removed, errors
+
+    def __call__(self, file_name, summary):
+        if summary is None:
+            self.remove(file_name)
+            return
+        entry = summary.get('aggregates')
+        # A file that could not be read keeps the entry it had
+        if entry is not None:
+            self.add(file_name, entry)
+
+    def get_table(self, level):
+        '''Returns the periods, activities, and STATS array of the level,
+        sorted by period.'''
+        table = self.tables.get(level)
+        if table is None:
+            items = sorted(self.buckets[level].items())
+            periods = np.array([period for (period, activity), values in items], dtype=str)
+            activities = np.array([activity for (period, activity), values in items], dtype=str)
+            values = np.array([values for key, values in items], dtype=np.float64) \
+                .reshape(len(items), len(STATS))
+            table = self.tables[level] = (periods, activities, values)
+        return table
+
+    def get_activities(self):
+        '''Returns the activity types, sorted.'''
+        return sorted({activity for period, activity in self.buckets['month']})
+
+    def query(self, level='month', start=None, end=None, activity=None, by_activity=False):
+        '''Returns the statistics of each period of the level.
+
+            Parameters
+            ----------
+            level : str
+                One of LEVELS.
+                default: 'month'
+            start : datetime.date or str
+                The periods from the one this date is in.
+                default: None, from the first
+            end : datetime.date or str
+                The periods before the one this date is in.
+                default: None, to the last
+            activity : str or list of str
+                Only these activity types.
+                default: None, all
+            by_activity : boolean
+                Whether to give each activity type of each period separately
+                instead of their totals.
+                default: False
+
+            Returns
+            ------
+            return : dict of numpy.ndarray
+                period, activity if by_activity, the sums count, distance
+                (mi), moving_time and elapsed_time (min), and ele_gain (m),
+                hr_max, and avg_speed (mph, over the moving time), hr_avg and
+                hr_std, which are 0 where there is no hr.
+        '''
+        if level not in LEVELS:
+            raise ValueError(f'Unknown level: {level}')
+        periods, activities, values = self.get_table(level)
+        first = np.searchsorted(periods, get_periods(start)[level]) if start else 0
+        last = np.searchsorted(periods, get_periods(end)[level]) if end else len(periods)
+        periods = periods[first:last]
+        activities = activities[first:last]
+        values = values[first:last]
+        if activity is not None:
+            keep = np.isin(activities, [activity] if isinstance(activity, str) else activity)
+            periods = periods[keep]
+            activities = activities[keep]
+            values = values[keep]
+        result = {}
+        if by_activity:
+            result['period'] = periods
+            result['activity'] = activities
+        else:
+            # Rows of the same period are next to each other
+            result['period'], index = np.unique(periods, return_index=True)
+            if len(index):
+                hr_max = np.maximum.reduceat(values[:, HR_MAX], index)
+                values = np.add.reduceat(values, index, axis=0)
+                values[:, HR_MAX] = hr_max
+        for i, name in enumerate(STATS):
+            if name not in ('hr_n', 'hr_sum', 'hr_sum2'):
+                result[name] = values[:, i]
+        hr_n = values[:, STATS.index('hr_n')]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            hr_avg = np.where(hr_n > 0, values[:, STATS.index('hr_sum')] / hr_n, 0.)
+            hr_var = np.where(hr_n > 0, values[:, STATS.index('hr_sum2')] / hr_n - hr_avg**2, 0.)
+            result['avg_speed'] = np.where(result['moving_time'] > 0,
+                result['distance'] / result['moving_time'] * 60, 0.)
+        result['hr_avg'] = hr_avg
+        result['hr_std'] = np.sqrt(np.maximum(hr_var, 0.))
+        result['count'] = result['count'].astype(np.int64)
+        return result
+
+def get_parser():
+    parser = argparse.ArgumentParser(description='Aggregate statistics of GPX tracks.')
+    parser.add_argument('--file', dest='file_name',
+        help='aggregates file (default: PY_GPS_AGGREGATES or ~/.cache/py_gps/aggregates.json)')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    add = subparsers.add_parser('add', help='add new and changed files')
+    add.add_argument('paths', nargs='+',
+        help='GPX files, glob patterns, or directories to search')
+    add.add_argument('--prune', action='store_true',
+        help='remove files that no longer exist')
+    query = subparsers.add_parser('query', help='print the statistics of each period')
+    query.add_argument('--level', choices=LEVELS, default='month',
+        help='period to total over (default: month)')
+    query.add_argument('--start', help='first date, ISO 8601')
+    query.add_argument('--end', help='end date (its period not included), ISO 8601')
+    query.add_argument('--activity', action='append',
+        help='only this activity type, may be given more than once')
+    query.add_argument('--by-activity', action='store_true',
+        help='give each activity type separately')
+    return parser
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    aggregates = Aggregates(args.file_name or get_aggregates_file())
+    if args.command == 'add':
+        from batch import find_files
+        n_added, n_removed, errors = aggregates.update(find_files(args.paths),
+            prune=args.prune)
+        for file_name, error in errors:
+            print(f'{file_name}: ERROR {error}')
+        print(f'Added {n_added} files, removed {n_removed}, '
+            f'{len(aggregates.files)} files in the aggregates')
+        return 1 if errors else 0
+    result = aggregates.query(args.level, args.start, args.end, args.activity,
+        args.by_activity)
+    for i, period in enumerate(result['period']):
+        activity = f' {result["activity"][i]}' if args.by_activity else ''
+        hr = f', hr avg={result["hr_avg"][i]:.0f} max={result["hr_max"][i]:.0f}' \
+            if result['hr_max'][i] else ''
+        print(f'{period}{activity}: {result["count"][i]} activities, '
+            f'{result["distance"][i]:.2f} mi, {result["moving_time"][i]:.1f} min moving, '
+            f'avg_speed={result["avg_speed"][i]:.2f} mph, gain={result["ele_gain"][i]:.0f} m{hr}')
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
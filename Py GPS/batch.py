@@ -0,0 +1,254 @@
+''' Headless batch processing of GPX files.
+Runs get_gpx -> get_gpx_track -> get_speed -> process_speed for each file in a
+process pool and writes the get_track_info fields for each file to JSON
+and/or CSV. Needs no GUI, so it can be run on a server, e.g.
+
+    python batch.py --json summary.json --csv summary.csv "GPSLink/Polar/*.gpx"
+
+Results are written in the order of the files as soon as they are
+available. A file that fails is reported with its error and does not stop
+the batch. With --plots the speed and heart rate plot of each file is also
+written, as PNG or SVG, to the given directory. With --profile the time and memory of each stage are recorded in
+the workers and written to a JSON or Chrome trace file (see instrument.py).
+'''
+
+import argparse
+import concurrent.futures
+import csv
+import glob
+import json
+import math
+import os
+import sys
+
+import instrument
+
+SUMMARY_FIELDS = ['file_name', 'n_points', 'start_lat', 'start_lon',
+    'start_time', 'end_lat', 'end_lon', 'end_time', 'total_dist',
+    'total_time', 'avg_speed', 'max_speed', 'error']
+
+# TrackCache for each cache directory, one set per worker process
+_caches = {}
+
+def find_files(paths):
+    '''Expands the given paths, globs, and directories (searched recursively)
+    into a sorted list of GPX files without duplicates.'''
+    file_names = []
+    for path in paths:
+        if os.path.isdir(path):
+            matches = glob.glob(os.path.join(path, '**', '*.gpx'), recursive=True)
+        else:
+            matches = glob.glob(path, recursive=True)
+            if not matches and os.path.isfile(path):
+                matches = [path]
+        file_names.extend(sorted(matches))
+    seen = set()
+    unique = []
+    for file_name in file_names:
+        key = os.path.abspath(file_name)
+        if key not in seen:
+            seen.add(key)
+            unique.append(file_name)
+    return unique
+
+def get_cache(cache_dir):
+    '''Returns the TrackCache for cache_dir for this process.'''
+    from track_cache import TrackCache
+    cache = _caches.get(cache_dir)
+    if cache is None:
+        cache = _caches[cache_dir] = TrackCache(cache_dir)
+    return cache
+
+def process_file(file_name, reparse=True, cache_dir=None, profile=None, plot_dir=None,
+        plot_format='png', keep_track=False):
+    '''Processes one file and returns its summary dict. Errors are returned
+    in the dict instead of being raised. If cache_dir is given the parsed
+    track is taken from, or stored in, the TrackCache there. If profile is
+    given it is the memory argument for instrument.enable, and the
+    instrument results are returned in the summary as _profile. If plot_dir
+    is given the speed and HR plot is written there in plot_format. If
+    keep_track is True the parsed Track is returned in the summary as
+    _track, so the caller does not have to read the file again.'''
+    if profile is not None:
+        if not instrument.is_enabled():
+            instrument.enable(memory=profile)
+        # Import first so the imports are not counted in the file
+        import py_gps
+        with instrument.file(file_name):
+            summary = process_file(file_name, reparse, cache_dir, None, plot_dir, plot_format,
+                keep_track)
+        summary['_profile'] = instrument.take()
+        return summary
+    import numpy as np
+    import py_gps
+    import resampling
+    import speed as s
+    summary = {'file_name': file_name, 'n_points': 0}
+    try:
+        if cache_dir:
+            track, gpx_info = get_cache(cache_dir).load(file_name)
+        else:
+            gpx = py_gps.get_gpx(file_name, reparse=reparse)
+            track = py_gps.get_gpx_track(gpx)
+        summary['n_points'] = len(track)
+        if keep_track:
+            summary['_track'] = track
+        if len(track) == 0:
+            summary['error'] = 'No trackpoints found'
+            return summary
+        summary.update(py_gps.get_track_summary(track))
+        # As ISO strings now, so the summary can be written even if a later
+        # step fails
+        for key in ('start_time', 'end_time'):
+            # None where the point has no time
+            if summary[key] is not None:
+                summary[key] = summary[key].isoformat()
+        speed, total_dist, total_time, avg_speed = s.get_speed(track)
+        # Filtered as py_gps.main does, so max_speed is the same
+        fs = resampling.get_fs(track)
+        speed_proc = s.process_speed(track, speed, fs=fs, uniform=True, zero_phase=True)
+        # NaN at the points without a time
+        summary['max_speed'] = float(np.nanmax(speed_proc)) \
+            if np.isfinite(speed_proc).any() else None
+        if plot_dir:
+            import render
+            render.use_agg()
+            info = (f'total_dist={total_dist:.2f} mi, total_time={total_time:.1f} min, '
+                f'avg_speed={avg_speed:.2f} mph')
+            with instrument.stage('plot'):
+                py_gps.plot_speed_hr(track, speed_proc, avg_speed=avg_speed,
+                    title=f'Speed and Heart Rate\n{file_name}\n{info}',
+                    file_name=render.get_plot_file_name(plot_dir, file_name, format=plot_format))
+    except Exception as ex:
+        summary['error'] = f'{type(ex).__name__}: {ex}'
+    # JSON has no NaN, e.g. total_time when a point has no time
+    for key, value in summary.items():
+        if isinstance(value, float) and not math.isfinite(value):
+            summary[key] = None
+    return summary
+
+def format_summary(summary):
+    '''Returns the line printed for the summary of a file without an
+    error. Values that could not be found are shown as -.'''
+    def format_value(key, spec):
+        value = summary.get(key)
+        return '-' if value is None else format(value, spec)
+    return (f'{summary["file_name"]}: {summary["n_points"]} points, '
+        f'{format_value("total_dist", ".2f")} mi, {format_value("total_time", ".1f")} min, '
+        f'avg_speed={format_value("avg_speed", ".2f")} mph')
+
+def run_batch(file_names, jobs=None, reparse=True, cache_dir=None, profile=None,
+        plot_dir=None, plot_format='png'):
+    '''Generator that processes the files in a process pool and yields the
+    summaries in the order of file_names as they become available.'''
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    if plot_dir:
+        os.makedirs(plot_dir, exist_ok=True)
+    args = (reparse, cache_dir, profile, plot_dir, plot_format)
+    if jobs <= 1:
+        for file_name in file_names:
+            yield process_file(file_name, *args)
+        return
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(process_file, file_name, *args)
+            for file_name in file_names]
+        for file_name, future in zip(file_names, futures):
+            try:
+                yield future.result()
+            except Exception as ex:
+                # The worker itself failed, e.g. it was killed
+                yield {'file_name': file_name, 'n_points': 0,
+                    'error': f'{type(ex).__name__}: {ex}'}
+
+def get_parser():
+    parser = argparse.ArgumentParser(description='Summarize GPX files without a GUI.')
+    parser.add_argument('paths', nargs='+',
+        help='GPX files, glob patterns, or directories to search')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+        help='number of worker processes (default: number of cores)')
+    parser.add_argument('--json', dest='json_file', help='write the summaries to this JSON file')
+    parser.add_argument('--csv', dest='csv_file', help='write the summaries to this CSV file')
+    parser.add_argument('--no-reparse', dest='reparse', action='store_false',
+        help='read the files directly with gpxpy (see py_gps.get_gpx)')
+    parser.add_argument('--cache', dest='cache_dir', nargs='?', const='', default=None,
+        help='use the parsed track cache, in this directory if given '
+            '(default: PY_GPS_CACHE or ~/.cache/py_gps/tracks)')
+    parser.add_argument('--plots', dest='plot_dir',
+        help='write the speed and HR plot of each file to this directory')
+    parser.add_argument('--plot-format', choices=('png', 'svg'), default='png',
+        help='format of the plots (default: png)')
+    parser.add_argument('--profile', dest='profile_file',
+        help='record the time and memory of each stage and write them to this file '
+            '(default: PY_GPS_PROFILE)')
+    parser.add_argument('--profile-format', choices=instrument.FORMATS,
+        help='json or Chrome trace (default: trace for *.trace and *.trace.json)')
+    parser.add_argument('--no-profile-memory', dest='profile_memory', action='store_false',
+        help='do not record tracemalloc peaks, which slow the processing down')
+    return parser
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    file_names = find_files(args.paths)
+    cache_dir = args.cache_dir
+    if cache_dir == '':
+        from track_cache import get_cache_dir
+        cache_dir = get_cache_dir()
+    if not file_names:
+        print('No GPX files found', file=sys.stderr)
+        return 1
+    profile = None
+    if args.profile_file:
+        instrument.enable(memory=args.profile_memory)
+        profile = args.profile_memory
+    elif instrument.is_enabled():
+        # Enabled with PY_GPS_PROFILE
+        profile = instrument.is_memory_enabled()
+    json_file = open(args.json_file, 'w') if args.json_file else None
+    csv_file = open(args.csv_file, 'w', newline='') if args.csv_file else None
+    writer = None
+    if csv_file:
+        writer = csv.DictWriter(csv_file, fieldnames=SUMMARY_FIELDS)
+        writer.writeheader()
+    n_errors = 0
+    try:
+        if json_file:
+            json_file.write('[\n')
+        for i, summary in enumerate(run_batch(file_names, args.jobs, args.reparse,
+                cache_dir, profile, args.plot_dir, args.plot_format)):
+            results = summary.pop('_profile', None)
+            if results:
+                instrument.merge(results)
+            error = summary.get('error')
+            if error:
+                n_errors += 1
+                print(f'{summary["file_name"]}: ERROR {error}')
+            else:
+                print(format_summary(summary))
+            if json_file:
+                if i > 0:
+                    json_file.write(',\n')
+                # Any value JSON cannot hold is written as a string rather
+                # than stopping the batch
+                json_file.write(json.dumps(summary, default=str))
+                json_file.flush()
+            if writer:
+                writer.writerow(summary)
+                csv_file.flush()
+        if json_file:
+            json_file.write('\n]\n')
+    finally:
+        if json_file:
+            json_file.close()
+        if csv_file:
+            csv_file.close()
+    print(f'Processed {len(file_names)} files, {n_errors} errors')
+    if profile is not None:
+        print(instrument.format_results())
+        if args.profile_file:
+            instrument.dump(args.profile_file, args.profile_format)
+            print(f'Wrote {args.profile_file}')
+    return 1 if n_errors else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,281 @@
+''' Benchmarks for the parsing and speed pipeline.
+Generates synthetic GPX files (see synthetic_gpx.py) and times each stage
+separately: get_gpx with and without reparse, get_gpx_info, get_gpx_data,
+gpx_stream.read_track, py_gps_2.get_dataframe, speed.get_speed, and
+speed.process_speed. For each stage the wall time (best of --repeat runs),
+the tracemalloc peak, and the points per second are recorded. The
+cold-start time of a new Python process importing py_gps, and running
+summary.py, is also recorded as the startup case. The gpxpy stages are
+reported as skipped for a layout get_gpx reads no points of, such as
+GPX/1/0 with reparse, instead of timing an empty track. Results can be
+saved as a JSON baseline and later runs compared against it, e.g.
+
+    python benchmark.py --output baseline.json
+    python benchmark.py --compare baseline.json
+'''
+
+import argparse
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import synthetic_gpx
+
+DEFAULT_SIZES = [1000, 10000, 100000]
+# Cases run for each size: (n_trk, n_seg, hr, namespace)
+VARIANTS = [
+    (1, 1, True, 'default'),
+    (1, 1, False, 'default'),
+    (2, 3, True, 'default'),
+    (1, 1, True, 'gpx10'),
+    (1, 1, True, 'prefixed'),
+]
+DEFAULT_TOLERANCE = .2
+# Modules that summary.py should never load
+HEAVY_MODULES = ('matplotlib', 'scipy', 'pandas')
+
+class Skip(Exception):
+    '''Raised by a stage that cannot be run for the file, e.g. the gpxpy
+    path for a layout it does not read.'''
+
+def count_points(gpx):
+    return sum(len(segment.points) for track in gpx.tracks for segment in track.segments)
+
+def get_stages(file_name):
+    '''Returns a list of (name, function) for the stages. Each function uses
+    the results of the earlier ones, which are kept in a dict. The gpxpy
+    stages raise Skip if get_gpx finds no points where read_track does, as
+    for the GPX/1/0 layout with reparse, so they do not time an empty
+    track.'''
+    import py_gps
+    import gpx_stream
+    import speed as s
+    state = {}
+
+    def get_n_points():
+        if 'n_points' not in state:
+            state['n_points'] = len(gpx_stream.read_track(file_name, timezone=False))
+        return state['n_points']
+
+    def check_gpx(gpx, reparse):
+        if count_points(gpx) == 0 and get_n_points() > 0:
+            raise Skip(f'get_gpx(reparse={reparse}) reads none of the '
+                f'{get_n_points()} points')
+
+    def get_gpx():
+        if 'gpx' not in state:
+            raise Skip('no points from get_gpx')
+        return state['gpx']
+
+    def get_data():
+        if 'data' not in state:
+            raise Skip('no points from get_gpx')
+        return state['data']
+
+    def get_gpx_reparse():
+        gpx = py_gps.get_gpx(file_name, reparse=True)
+        check_gpx(gpx, True)
+        state['gpx'] = gpx
+
+    def get_gpx_direct():
+        check_gpx(py_gps.get_gpx(file_name, reparse=False), False)
+
+    def get_gpx_info():
+        py_gps.get_gpx_info(get_gpx())
+
+    def get_gpx_data():
+        state['data'] = py_gps.get_gpx_data(get_gpx())
+
+    def read_track():
+        state['track'] = gpx_stream.read_track(file_name)
+
+    def get_dataframe():
+        import py_gps_2
+        py_gps_2.get_dataframe(state['track'])
+
+    def get_speed():
+        lat, lon, ele, hr, time = get_data()
+        state['speed'] = s.get_speed(lat, lon, time)[0]
+
+    def process_speed():
+        s.process_speed(get_data()[4], state['speed'])
+
+    return [
+        ('get_gpx(reparse=True)', get_gpx_reparse),
+        ('get_gpx(reparse=False)', get_gpx_direct),
+        ('get_gpx_info', get_gpx_info),
+        ('get_gpx_data', get_gpx_data),
+        ('read_track', read_track),
+        ('get_dataframe', get_dataframe),
+        ('get_speed', get_speed),
+        ('process_speed', process_speed),
+    ]
+
+def run_case(file_name, n_points, repeat=3, memory=True):
+    '''Runs the stages for one file and returns {stage: result dict}.'''
+    results = {}
+    for name, function in get_stages(file_name):
+        times = []
+        for i in range(repeat):
+            gc.collect()
+            start = time.perf_counter()
+            try:
+                function()
+            except Skip as ex:
+                results[name] = {'skipped': str(ex)}
+                break
+            except Exception as ex:
+                results[name] = {'error': f'{type(ex).__name__}: {ex}'}
+                break
+            times.append(time.perf_counter() - start)
+        if name in results:
+            continue
+        result = {'time': min(times)}
+        result['points_per_sec'] = n_points / result['time'] if result['time'] else None
+        if memory:
+            # A separate run, tracemalloc slows the code down a lot
+            gc.collect()
+            tracemalloc.start()
+            function()
+            result['peak_bytes'] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        results[name] = result
+    return results
+
+def get_startup_commands(file_name):
+    '''Returns a list of (name, command) for the cold-start measurements.'''
+    python = sys.executable
+    check = ('import sys; heavy = [m for m in {} if m in sys.modules]; '
+        'assert not heavy, heavy').format(HEAVY_MODULES)
+    return [
+        ('python', [python, '-c', 'pass']),
+        ('import py_gps', [python, '-c', 'import py_gps']),
+        ('import summary', [python, '-c', 'import summary; ' + check]),
+        ('summary.py --utc', [python, 'summary.py', '--utc', file_name]),
+        ('summary.py', [python, 'summary.py', file_name]),
+    ]
+
+def run_startup(file_name, repeat=3):
+    '''Returns {name: result dict} with the best wall time of each startup
+    command, each run in a new process.'''
+    results = {}
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    for name, command in get_startup_commands(file_name):
+        times = []
+        for i in range(repeat):
+            start = time.perf_counter()
+            process = subprocess.run(command, cwd=cwd, capture_output=True, text=True)
+            times.append(time.perf_counter() - start)
+            if process.returncode != 0:
+                lines = process.stderr.strip().splitlines()
+                results[name] = {'error': lines[-1] if lines else f'exit code {process.returncode}'}
+                break
+        else:
+            results[name] = {'time': min(times)}
+    return results
+
+def get_case_name(n_points, n_trk, n_seg, hr, namespace):
+    return f'{n_points} pts {n_trk}x{n_seg} {"hr" if hr else "nohr"} {namespace}'
+
+def run(sizes, data_dir, repeat=3, memory=True, variants=VARIANTS):
+    '''Runs all cases and returns the results dict.'''
+    results = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cases': {},
+    }
+    print('startup:', flush=True)
+    file_name = synthetic_gpx.get_gpx_file(data_dir, 1000)
+    results['cases']['startup'] = run_startup(file_name, repeat)
+    for stage, result in results['cases']['startup'].items():
+        print_result(stage, result)
+    for n_points in sizes:
+        for n_trk, n_seg, hr, namespace in variants:
+            name = get_case_name(n_points, n_trk, n_seg, hr, namespace)
+            file_name = synthetic_gpx.get_gpx_file(data_dir, n_points, n_trk,
+                n_seg, hr, namespace)
+            print(f'{name}:', flush=True)
+            case = run_case(file_name, n_points, repeat, memory)
+            for stage, result in case.items():
+                print_result(stage, result)
+            results['cases'][name] = case
+    return results
+
+def print_result(stage, result):
+    if 'error' in result:
+        print(f'  {stage:<24} ERROR {result["error"]}')
+        return
+    if 'skipped' in result:
+        print(f'  {stage:<24} skipped: {result["skipped"]}')
+        return
+    line = f'  {stage:<24} {result["time"] * 1000:10.1f} ms'
+    if result.get('points_per_sec'):
+        line += f' {result["points_per_sec"]:14,.0f} pts/s'
+    if 'peak_bytes' in result:
+        line += f' {result["peak_bytes"] / 1e6:10.1f} MB peak'
+    print(line)
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    '''Prints the stages that are slower than the baseline by more than
+    tolerance (a fraction) and returns the number of them.'''
+    n_slower = 0
+    for name, case in results['cases'].items():
+        base_case = baseline.get('cases', {}).get(name)
+        if not base_case:
+            continue
+        for stage, result in case.items():
+            base = base_case.get(stage)
+            if base and 'time' in base and 'error' in result:
+                n_slower += 1
+                print(f'FAILED {name} {stage}: {result["error"]}')
+                continue
+            if not base or 'time' not in base or 'time' not in result:
+                continue
+            ratio = result['time'] / base['time'] if base['time'] else 1.
+            if ratio > 1 + tolerance:
+                n_slower += 1
+                print(f'SLOWER {name} {stage}: {base["time"] * 1000:.1f} ms -> '
+                    f'{result["time"] * 1000:.1f} ms ({ratio:.2f}x)')
+            elif ratio < 1 - tolerance:
+                print(f'faster {name} {stage}: {base["time"] * 1000:.1f} ms -> '
+                    f'{result["time"] * 1000:.1f} ms ({ratio:.2f}x)')
+    return n_slower
+
+def get_parser():
+    parser = argparse.ArgumentParser(description='Benchmark the GPX parsing and speed pipeline.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES,
+        help=f'numbers of points (default: {DEFAULT_SIZES}, add 1000000 for the full run)')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per stage, the best is kept')
+    parser.add_argument('--no-memory', dest='memory', action='store_false',
+        help='skip the tracemalloc peak memory runs')
+    parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'py_gps_benchmark'),
+        help='where the synthetic files are kept')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='compare with this JSON baseline')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+        help=f'allowed slowdown as a fraction (default: {DEFAULT_TOLERANCE})')
+    return parser
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    results = run(args.sizes, args.data_dir, args.repeat, args.memory)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f'Wrote {args.output}')
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+        n_slower = compare(results, baseline, args.tolerance)
+        print(f'{n_slower} stages slower than the baseline')
+        return 1 if n_slower else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,125 @@
+''' Decimation of series for plotting.
+A plot can only show about one value per pixel column, so drawing every
+point of a long 1 Hz track wastes time without changing the picture. These
+functions pick the indices of the points to keep so the plot looks the same.
+
+minmax_indices keeps the first, last, min, and max point in each bucket
+(the M4 method), so peaks and the outline of the line are kept exactly.
+lttb_indices uses Largest-Triangle-Three-Buckets, which keeps one point per
+bucket chosen to preserve the visual shape, and also works for paths such as
+lat vs lon where x is not increasing.
+
+Both take time O(n) plus a small cost per bucket and return sorted index
+arrays that can be used on any array of the same length.
+'''
+
+import datetime
+
+import numpy as np
+
+from track import datetime_to_ns
+
+METHODS = ('minmax', 'lttb')
+
+def to_float(x):
+    '''Returns x as a float64 array, with datetime64 and datetimes, e.g. the
+    timezone-aware ones from get_gpx_data, as ns since the epoch.'''
+    x = np.asarray(x)
+    if x.dtype.kind == 'O' and x.size and isinstance(x.flat[0], datetime.datetime):
+        x = np.array([datetime_to_ns(t) for t in x.flat], dtype=np.int64).reshape(x.shape)
+    elif x.dtype.kind == 'M':
+        x = x.astype('datetime64[ns]').view(np.int64)
+    return x.astype(np.float64)
+
+def get_buckets(n, n_buckets, x=None):
+    '''Returns the start index of each bucket and the end. Buckets are equal
+    ranges of x if x is given and increasing, otherwise equal numbers of
+    points.'''
+    if x is not None and n > 1:
+        x = to_float(x)
+        if x[-1] > x[0] and np.all(np.diff(x) >= 0):
+            edges = np.linspace(x[0], x[-1], n_buckets + 1)
+            starts = np.searchsorted(x, edges[:-1], side='left')
+            return np.unique(np.concatenate((starts, [n])))
+    return np.unique(np.linspace(0, n, n_buckets + 1).astype(np.int64))
+
+def minmax_indices(y, n_buckets, x=None):
+    '''Returns the indices of the first, last, min, and max points in each of
+    n_buckets buckets. NaN values are only kept as first or last points.
+
+        Parameters
+        ----------
+        y : array_like
+            The values.
+        n_buckets : int
+            Number of buckets, usually the plot width in pixels.
+        x : array_like
+            The x values, used to make buckets of equal width in x.
+            default: None
+    '''
+    y = to_float(y)
+    n = len(y)
+    if n <= 4 * n_buckets:
+        return np.arange(n)
+    bounds = get_buckets(n, n_buckets, x)
+    starts = bounds[:-1]
+    ends = bounds[1:]
+    counts = ends - starts
+    # NaN is +inf for the min and -inf for the max so it is not picked
+    # unless the bucket is all NaN
+    nan = np.isnan(y)
+    index = np.arange(n)
+    result = [starts, ends - 1]
+    for values, reduce in ((np.where(nan, np.inf, y), np.minimum),
+            (np.where(nan, -np.inf, y), np.maximum)):
+        extreme = np.repeat(reduce.reduceat(values, starts), counts)
+        # The first index in each bucket with the extreme value
+        result.append(np.minimum.reduceat(np.where(values == extreme, index, n), starts))
+    return np.unique(np.concatenate(result))
+
+def lttb_indices(x, y, n_out):
+    '''Returns the indices of n_out points chosen by Largest-Triangle-Three-
+    Buckets. The first and last points are always kept. Buckets are equal
+    numbers of points, so x need not be increasing.'''
+    x = to_float(x)
+    y = to_float(y)
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    bounds = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    indices = np.empty(n_out, dtype=np.int64)
+    indices[0] = 0
+    indices[-1] = n - 1
+    a = 0
+    for i in range(n_out - 2):
+        start, end = bounds[i], bounds[i + 1]
+        # The average of the next bucket, or the last point
+        next_start = end
+        next_end = bounds[i + 2] if i + 2 < len(bounds) else n
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+        # Twice the area of the triangle with the previous point and the average
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a])
+            - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.nanargmax(area)) if np.any(np.isfinite(area)) else start
+        indices[i + 1] = a
+    return indices
+
+def decimate_indices(x, y, n_buckets, method='minmax'):
+    '''Returns the indices to plot for y vs x with about n_buckets pixel
+    columns, using method 'minmax' or 'lttb'. method None keeps all.'''
+    if method is None:
+        return np.arange(len(y))
+    if method == 'minmax':
+        return minmax_indices(y, n_buckets, x)
+    if method == 'lttb':
+        # Two points per column, as minmax keeps up to four
+        return lttb_indices(x, y, 2 * n_buckets)
+    raise ValueError(f'Unknown decimation method: {method}')
+
+def decimate(x, y, n_buckets, method='minmax'):
+    '''Returns x, y decimated with decimate_indices.'''
+    x = np.asarray(x)
+    y = np.asarray(y)
+    index = decimate_indices(x, y, n_buckets, method)
+    return x[index], y[index]
@@ -0,0 +1,200 @@
+''' Local tangent plane (ENU) projection.
+Projects lat/lon onto the plane that touches the earth at an origin, usually
+the centroid of a track, giving x (east) and y (north) in meters. Distances,
+bearings, and curvature are then plain vector arithmetic on x and y, and the
+trigonometry is only done once per point, in forward. Track.xy caches the
+projection of a track alongside its arrays, with each segment projected
+about its own centroid (see get_xy), so a file that merges activities from
+different places still has each of them near its origin.
+
+The projection is the orthographic (tangent plane) projection of the same
+sphere haversine uses, so it is compared with haversine directly. Scale is
+exact across the direction to the origin and is cos(rho / R) along it, where
+rho is the distance from the origin and R the earth radius. So the distance
+between two nearby points at most rho from the origin differs from the
+haversine distance by a fraction of at most get_error_bound(rho), about
+rho**2 / (2 R**2):
+
+    rho     error bound
+    1 km    1.2e-8  (0.01 mm per km)
+    10 km   1.2e-6  (1.2 mm per km)
+    50 km   3.1e-5  (3.1 cm per km)
+    100 km  1.2e-4  (12 cm per km)
+    500 km  3.1e-3  (3.1 m per km)
+
+For typical activities (a few km to a few tens of km across) this is well
+under the GPS error. Bearings are measured from north at the origin, which
+differs from the local north at a point by the meridian convergence, about
+x / R * tan(lat0) rad, e.g. 0.06 deg 10 km east of the origin at 45 deg.
+
+Points more than a quarter of the way around the earth from the origin
+cannot be projected this way, and give NaN. get_step_lengths uses the
+projection only for steps within MAX_RHO of the origin and the great circle
+distance for the others, e.g. a long drive or a glitch far from the rest of
+its segment, so the distances stay within get_error_bound(MAX_RHO) of
+haversine however far the points spread.
+'''
+
+import numpy as np
+
+# Mean earth radius, m, as used by haversine
+EARTH_RADIUS = 6371008.8
+# Farthest a point may be from the origin for the steps to and from it to be
+# taken from the projection, m. See get_step_lengths.
+MAX_RHO = 10000.
+
+def get_origin(lat, lon):
+    '''Returns the lat, lon of the centroid of the points, deg, as the mean of
+    their unit vectors, so it works across the antimeridian.'''
+    lat = np.radians(np.asarray(lat, dtype=np.float64))
+    lon = np.radians(np.asarray(lon, dtype=np.float64))
+    if len(lat) == 0:
+        return 0., 0.
+    cos_lat = np.cos(lat)
+    x = np.mean(cos_lat * np.cos(lon))
+    y = np.mean(cos_lat * np.sin(lon))
+    z = np.mean(np.sin(lat))
+    return (float(np.degrees(np.arctan2(z, np.hypot(x, y)))),
+        float(np.degrees(np.arctan2(y, x))))
+
+def get_origins(lat, lon, offsets):
+    '''Returns the lat, lon arrays of the centroids, deg, as for get_origin,
+    of the runs of points offsets[j]:offsets[j + 1]. Empty runs give 0, 0.'''
+    lat = np.radians(np.asarray(lat, dtype=np.float64))
+    lon = np.radians(np.asarray(lon, dtype=np.float64))
+    counts = np.diff(np.asarray(offsets, dtype=np.int64))
+    ids = np.repeat(np.arange(len(counts)), counts)
+    cos_lat = np.cos(lat)
+    # The sums point the same way as the means
+    x = np.bincount(ids, cos_lat * np.cos(lon), len(counts))
+    y = np.bincount(ids, cos_lat * np.sin(lon), len(counts))
+    z = np.bincount(ids, np.sin(lat), len(counts))
+    return np.degrees(np.arctan2(z, np.hypot(x, y))), np.degrees(np.arctan2(y, x))
+
+def forward(lat, lon, lat0, lon0):
+    '''Returns x (east) and y (north), m, for lat, lon, deg, in the tangent
+    plane about lat0, lon0, deg, which may be scalars or one origin for each
+    point. Points on the far side of the earth give NaN.'''
+    lat = np.radians(np.asarray(lat, dtype=np.float64))
+    dlon = np.radians(np.asarray(lon, dtype=np.float64) - lon0)
+    lat0 = np.radians(lat0)
+    sin_lat0 = np.sin(lat0)
+    cos_lat0 = np.cos(lat0)
+    cos_lat = np.cos(lat)
+    cos_dlon = np.cos(dlon)
+    x = EARTH_RADIUS * cos_lat * np.sin(dlon)
+    y = EARTH_RADIUS * (cos_lat0 * np.sin(lat) - sin_lat0 * cos_lat * cos_dlon)
+    # The far side of the earth would fold onto the near side
+    far = sin_lat0 * np.sin(lat) + cos_lat0 * cos_lat * cos_dlon < 0
+    if np.any(far):
+        x = np.where(far, np.nan, x)
+        y = np.where(far, np.nan, y)
+    return x, y
+
+def get_xy(lat, lon, offsets=None):
+    '''Returns x (east) and y (north), m, with each run of points
+    offsets[j]:offsets[j + 1] projected about its own centroid, e.g. the
+    segments of a Track with its seg_offsets. The steps between runs are
+    not meaningful. offsets None is one run with all the points.'''
+    if offsets is None:
+        return Projection.from_points(lat, lon).forward(lat, lon)
+    lat0, lon0 = get_origins(lat, lon, offsets)
+    counts = np.diff(np.asarray(offsets, dtype=np.int64))
+    return forward(lat, lon, np.repeat(lat0, counts), np.repeat(lon0, counts))
+
+def get_error_bound(rho):
+    '''Returns the largest fractional difference from haversine of the
+    distance between nearby points at most rho m from the origin.'''
+    return 1. - np.cos(np.asarray(rho) / EARTH_RADIUS)
+
+class Projection:
+    '''Tangent plane projection about lat0, lon0, deg.'''
+    __slots__ = ('lat0', 'lon0', '_sin_lat0', '_cos_lat0')
+
+    def __init__(self, lat0, lon0):
+        self.lat0 = float(lat0)
+        self.lon0 = float(lon0)
+        self._sin_lat0 = np.sin(np.radians(self.lat0))
+        self._cos_lat0 = np.cos(np.radians(self.lat0))
+
+    @classmethod
+    def from_points(cls, lat, lon):
+        '''Returns the projection about the centroid of the points.'''
+        return cls(*get_origin(lat, lon))
+
+    def __repr__(self):
+        return f'Projection(lat0={self.lat0!r}, lon0={self.lon0!r})'
+
+    def forward(self, lat, lon):
+        '''Returns x (east) and y (north), m, for lat, lon, deg.'''
+        return forward(lat, lon, self.lat0, self.lon0)
+
+    def inverse(self, x, y):
+        '''Returns lat, lon, deg, for x, y, m.'''
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        rho = np.hypot(x, y)
+        with np.errstate(invalid='ignore'):
+            sin_c = rho / EARTH_RADIUS
+            cos_c = np.sqrt(1. - sin_c * sin_c)
+        lat = np.arcsin(np.clip(cos_c * self._sin_lat0 + y * self._cos_lat0 / EARTH_RADIUS,
+            -1., 1.))
+        lon = self.lon0 + np.degrees(np.arctan2(x * sin_c,
+            rho * cos_c * self._cos_lat0 - y * sin_c * self._sin_lat0))
+        # Keep lon in [-180, 180)
+        lon = (lon + 180.) % 360. - 180.
+        return np.degrees(lat), lon
+
+def get_steps(x, y):
+    '''Returns the distance, m, from each point to the next, one shorter
+    than x.'''
+    return np.hypot(np.diff(x), np.diff(y))
+
+def get_great_circle_steps(lat, lon):
+    '''Returns the haversine distance, m, from each point to the next, one
+    shorter than lat.'''
+    lat = np.radians(np.asarray(lat, dtype=np.float64))
+    lon = np.radians(np.asarray(lon, dtype=np.float64))
+    a = (np.sin(np.diff(lat) / 2) ** 2
+        + np.cos(lat[:-1]) * np.cos(lat[1:]) * np.sin(np.diff(lon) / 2) ** 2)
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.minimum(a, 1.)))
+
+def get_step_lengths(lat, lon, x, y, max_rho=MAX_RHO):
+    '''Returns the distance, m, from each point to the next, one shorter
+    than lat. Steps with both ends within max_rho m of the origin of x, y
+    are taken from the projection and the others, including those to points
+    that could not be projected, from get_great_circle_steps.'''
+    steps = get_steps(x, y)
+    with np.errstate(invalid='ignore'):
+        near = np.hypot(x, y) <= max_rho
+    far = ~(near[1:] & near[:-1])
+    if np.any(far):
+        index = np.flatnonzero(far)
+        lat = np.asarray(lat, dtype=np.float64)
+        lon = np.asarray(lon, dtype=np.float64)
+        pairs = np.stack((index, index + 1), axis=1).ravel()
+        steps[index] = get_great_circle_steps(lat[pairs], lon[pairs])[::2]
+    return steps
+
+def get_bearings(x, y):
+    '''Returns the bearing, deg clockwise from north, from each point to the
+    next, one shorter than x. Repeated points give 0.'''
+    return np.degrees(np.arctan2(np.diff(x), np.diff(y))) % 360.
+
+def get_curvature(x, y):
+    '''Returns the curvature, 1/m, at each point from the circle through it
+    and the points before and after it, positive for left turns. The end
+    points and repeated points give 0.'''
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    curvature = np.zeros(len(x))
+    if len(x) < 3:
+        return curvature
+    ax, ay = x[1:-1] - x[:-2], y[1:-1] - y[:-2]
+    bx, by = x[2:] - x[1:-1], y[2:] - y[1:-1]
+    # Twice the signed area over the product of the sides, times 2
+    cross = ax * by - ay * bx
+    sides = np.hypot(ax, ay) * np.hypot(bx, by) * np.hypot(ax + bx, ay + by)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        curvature[1:-1] = np.where(sides > 0, 2. * cross / sides, 0.)
+    return curvature
@@ -0,0 +1,132 @@
+''' Trackpoint extension extraction.
+Gets hr, and optionally cad, atemp and power, from the trackpoint extensions
+written by Garmin, Polar and others. The qualified names to look for are
+resolved once per file, from gpx.nsmap and from the first time each
+extension tag is seen, so each point only needs direct lookups instead of a
+search through all its descendants.
+'''
+
+import array
+
+import numpy as np
+
+TRACKPOINT_EXTENSION = 'TrackPointExtension'
+
+# name: (dtype, value used when missing, tags the value appears under)
+FIELDS = {
+    'hr': (np.uint16, 0, ('hr',)),
+    'cad': (np.uint16, 0xFFFF, ('cad', 'cadence')),
+    'atemp': (np.float32, np.nan, ('atemp', 'temp')),
+    'power': (np.uint16, 0xFFFF, ('power', 'PowerInWatts')),
+}
+
+def get_missing(name):
+    '''Returns the value used for a missing value of the given field.'''
+    return FIELDS[name][1]
+
+class ExtensionReader:
+    '''Reads extension values for one file.
+
+        Parameters
+        ----------
+        nsmap : dict
+            Prefix to namespace map for the file, e.g. gpx.nsmap. Used to
+            resolve the names up front. Names in other namespaces are resolved
+            the first time they are seen.
+            default: None
+        fields : tuple of str
+            The fields to extract, keys of FIELDS.
+            default: ('hr',)
+    '''
+
+    def __init__(self, nsmap=None, fields=('hr',)):
+        for name in fields:
+            if name not in FIELDS:
+                raise ValueError(f'Unknown extension field: {name}')
+        self.fields = tuple(fields)
+        self.missing = [get_missing(name) for name in self.fields]
+        self.types = [float if np.dtype(FIELDS[name][0]).kind == 'f' else int
+            for name in self.fields]
+        # Tag of a child of <extensions> -> list of (field index, path)
+        # where path is None if the child itself holds the value
+        self.lookups = {}
+        self.buffers = [array.array('d') for name in self.fields]
+        if nsmap:
+            for ns in nsmap.values():
+                for local in (TRACKPOINT_EXTENSION,) + self.names():
+                    self.register(f'{{{ns}}}{local}')
+
+    def names(self):
+        '''Returns all tags the fields appear under.'''
+        return tuple(tag for name in self.fields for tag in FIELDS[name][2])
+
+    def register(self, tag):
+        '''Works out the lookups for a child of <extensions> with this tag.'''
+        ns = tag[:tag.index('}') + 1] if tag[0] == '{' else ''
+        local = tag[len(ns):]
+        lookups = []
+        for i, name in enumerate(self.fields):
+            tags = FIELDS[name][2]
+            if local == TRACKPOINT_EXTENSION:
+                for child in tags:
+                    lookups.append((i, ns + child))
+            elif local in tags:
+                lookups.append((i, None))
+        self.lookups[tag] = lookups
+        return lookups
+
+    def read(self, children):
+        '''Returns the values of the fields for one point. children are the
+        children of the <extensions> element, e.g. point.extensions in
+        gpxpy.'''
+        values = self.missing[:]
+        found = [False] * len(values)
+        for child in children:
+            lookups = self.lookups.get(child.tag)
+            if lookups is None:
+                lookups = self.register(child.tag)
+            for i, path in lookups:
+                if found[i]:
+                    continue
+                elem = child if path is None else child.find(path)
+                if elem is not None and elem.text:
+                    values[i] = self.types[i](float(elem.text))
+                    found[i] = True
+        return values
+
+    def read_texts(self, children):
+        '''Returns the values of the fields for one point, as for read, from
+        the text of the elements instead of the elements. children is a list
+        of (tag, text, texts) for the children of the <extensions> element,
+        where texts is a dict of the text of the first child with each tag,
+        as a parser that does not build elements gets them.'''
+        values = self.missing[:]
+        found = [False] * len(values)
+        for tag, text, texts in children:
+            lookups = self.lookups.get(tag)
+            if lookups is None:
+                lookups = self.register(tag)
+            for i, path in lookups:
+                if found[i]:
+                    continue
+                value = text if path is None else texts.get(path)
+                if value:
+                    values[i] = self.types[i](float(value))
+                    found[i] = True
+        return values
+
+    def append(self, children):
+        '''Reads the values for one point and stores them.'''
+        self.append_values(self.read(children))
+
+    def append_values(self, values):
+        '''Stores the values from read or read_texts for one point.'''
+        for buffer, value in zip(self.buffers, values):
+            buffer.append(value)
+
+    def arrays(self):
+        '''Returns a dict of typed arrays of the stored values.'''
+        result = {}
+        for name, buffer in zip(self.fields, self.buffers):
+            result[name] = np.frombuffer(buffer, dtype=np.float64).astype(FIELDS[name][0])
+        return result
@@ -0,0 +1,158 @@
+''' Butterworth lowpass filter engine.
+Filter designs are cached by (order, cutoff, fs), so each is only computed
+once per process, and are kept as second-order sections (SOS), which are
+numerically sound at any order, unlike the transfer-function (b, a) form.
+Filtering is causal (sosfilt), which lags the data, or zero-phase
+(sosfiltfilt), which runs the filter forwards and backwards so there is no
+lag.
+
+Many series, e.g. the segments of a track or the tracks of a batch that
+were resampled to the same rate, are filtered together as the rows of
+padded 2-D arrays, so a batch is a few vectorized calls. The series are
+grouped by length, each group within a factor of two, so one long series
+does not make every row as long as it. The results are the same as
+filtering each series on its own.
+'''
+
+import functools
+
+import numpy as np
+
+@functools.lru_cache(maxsize=64)
+def get_sos(order, cutoff, fs):
+    '''Returns the second-order sections of a Butterworth lowpass filter with
+    cutoff and fs in Hz. The array is shared and should not be changed.'''
+    from scipy.signal import butter
+    return butter(order, cutoff, btype='low', output='sos', fs=fs)
+
+@functools.lru_cache(maxsize=64)
+def get_sos_zi(order, cutoff, fs):
+    '''Returns the steady-state initial conditions of the get_sos filter for
+    a step of 1. The array is shared and should not be changed.'''
+    from scipy.signal import sosfilt_zi
+    return sosfilt_zi(get_sos(order, cutoff, fs))
+
+def get_padlen(sos):
+    '''Returns the padding sosfiltfilt uses by default for sos.'''
+    ntaps = 2 * len(sos) + 1
+    ntaps -= min((sos[:, 2] == 0).sum(), (sos[:, 5] == 0).sum())
+    return 3 * ntaps
+
+def pad_rows(series, width=None, fill=0.):
+    '''Returns the series as the rows of a 2-D float64 array, padded on the
+    right with fill, and their lengths.'''
+    lengths = np.array([len(values) for values in series], dtype=np.int64)
+    if width is None:
+        width = int(lengths.max()) if len(lengths) else 0
+    rows = np.full((len(series), width), fill)
+    for i, values in enumerate(series):
+        rows[i, :lengths[i]] = values
+    return rows, lengths
+
+def get_length_groups(lengths):
+    '''Returns arrays of the indices of the lengths, grouped so the lengths
+    in each group are within a factor of two. Padding a group to its longest
+    then at most doubles its size.'''
+    lengths = np.asarray(lengths, dtype=np.int64)
+    # The number of bits of each length
+    keys = np.frexp(np.maximum(lengths, 1).astype(np.float64))[1]
+    order = np.argsort(keys, kind='stable')
+    bounds = np.flatnonzero(np.diff(keys[order])) + 1
+    return [group for group in np.split(order, bounds) if len(group)]
+
+def reverse_rows(rows, lengths):
+    '''Returns rows with the first lengths[i] values of each row reversed,
+    and the rest left as padding.'''
+    k = np.arange(rows.shape[1])
+    index = lengths[:, None] - 1 - k
+    valid = index >= 0
+    return np.where(valid, np.take_along_axis(rows, np.maximum(index, 0), axis=1), 0.)
+
+def odd_extend_rows(rows, lengths, padlen):
+    '''Returns rows extended by padlen at each end with the odd extension
+    used by sosfiltfilt, padded on the right.'''
+    n_rows = rows.shape[0]
+    width = int(lengths.max()) + 2 * padlen if n_rows else 0
+    k = np.arange(width)[None, :] - padlen
+    length = lengths[:, None]
+    first = rows[:, :1]
+    last = np.take_along_axis(rows, np.maximum(lengths - 1, 0)[:, None], axis=1)
+    # Reflect about the end points: x[-k] before, x[2L - 2 - k] after
+    before = k < 0
+    after = k >= length
+    index = np.where(before, -k, np.where(after, 2 * length - 2 - k, k))
+    index = np.clip(index, 0, np.maximum(length - 1, 0))
+    values = np.take_along_axis(rows, index, axis=1)
+    ext = np.where(before, 2 * first - values, np.where(after, 2 * last - values, values))
+    return np.where(k < length + padlen, ext, 0.)
+
+def filter_batch(series, cutoff, fs, order=5, zero_phase=False):
+    '''Filters each series with the lowpass filter, as padded 2-D arrays of
+    series of similar length, and returns a list of the filtered arrays.
+
+        Parameters
+        ----------
+        series : list of array_like
+            The series, e.g. resampled speed for many tracks.
+        cutoff : float
+            Cutoff frequency, Hz.
+        fs : float
+            Sample rate of all the series, Hz.
+        order : int
+            Filter order.
+            default: 5
+        zero_phase : boolean
+            Whether to filter forwards and backwards, as sosfiltfilt.
+            Series shorter than the sosfiltfilt padding are filtered with
+            less padding on their own.
+            default: False
+
+        Returns
+        ------
+        return : list of numpy.ndarray
+            The filtered series, the same as sosfilt or sosfiltfilt for each
+            series on its own.
+    '''
+    from scipy.signal import sosfilt, sosfiltfilt
+    sos = get_sos(order, cutoff, fs)
+    result = [None] * len(series)
+    if not zero_phase:
+        for group in get_length_groups([len(values) for values in series]):
+            rows, lengths = pad_rows([series[i] for i in group])
+            if rows.size:
+                # Trailing padding does not change the outputs before it
+                rows = sosfilt(sos, rows, axis=1)
+            for row, (i, length) in enumerate(zip(group, lengths)):
+                result[i] = rows[row, :length].copy()
+        return result
+    padlen = get_padlen(sos)
+    long = [i for i, values in enumerate(series) if len(values) > padlen]
+    for i, values in enumerate(series):
+        if len(values) <= padlen:
+            values = np.asarray(values, dtype=np.float64)
+            result[i] = sosfiltfilt(sos, values, padlen=len(values) - 1) \
+                if len(values) > 1 else values.copy()
+    zi = get_sos_zi(order, cutoff, fs)
+    for group in get_length_groups([len(series[i]) for i in long]):
+        group = [long[j] for j in group]
+        rows, lengths = pad_rows([series[i] for i in group])
+        ext = odd_extend_rows(rows, lengths, padlen)
+        ext_lengths = lengths + 2 * padlen
+        # Forwards, then backwards on the reversed rows
+        y = sosfilt(sos, ext, axis=1, zi=zi[:, None, :] * ext[:, 0][None, :, None])[0]
+        y = reverse_rows(y, ext_lengths)
+        y = sosfilt(sos, y, axis=1, zi=zi[:, None, :] * y[:, 0][None, :, None])[0]
+        y = reverse_rows(y, ext_lengths)
+        for row, (i, length) in enumerate(zip(group, lengths)):
+            result[i] = y[row, padlen:padlen + length].copy()
+    return result
+
+def filter_runs(values, offsets, cutoff, fs, order=5, zero_phase=False):
+    '''Filters each run of values given by offsets (the start of each run
+    plus the length, as Track.seg_offsets) separately, as one batch, and
+    returns the filtered values.'''
+    values = np.asarray(values, dtype=np.float64)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    runs = [values[start:end] for start, end in zip(offsets[:-1], offsets[1:]) if end > start]
+    filtered = filter_batch(runs, cutoff, fs, order, zero_phase)
+    return np.concatenate(filtered) if filtered else np.empty(0)
@@ -0,0 +1,358 @@
+''' Streaming GPX reader.
+Reads the trackpoints of a GPX file in a single pass with an
+xml.etree.ElementTree parser instead of parsing the file, serializing it and
+parsing it again with gpxpy as py_gps.get_gpx(reparse=True) does. The parser
+is given a target that takes the values as they are parsed, so no elements
+are made at all. The default namespace is taken from the root element, so
+files where it is not GPX/1/1 are handled directly. The file is memory
+mapped and fed to the parser a block at a time, so memory use does not grow
+with the size of the file.
+
+For very large files, e.g. merged yearly exports, iter_batches yields the
+points as Tracks of a fixed number of points, so the arrays do not grow
+either. speed.SpeedStream gets the distance, speed, and filtered speed from
+the batches, e.g.
+
+    stream = speed.SpeedStream(fs)
+    for batch in gpx_stream.iter_batches(file_name):
+        speed, filtered = stream.update_track(batch.track, batch.continues)
+    print(stream.total_dist, stream.total_time)
+
+The stream uses haversine for the distances, so the totals agree with
+speed.get_speed of the whole Track to within the projection error of enu.py
+rather than exactly.
+'''
+
+import array
+import collections
+import datetime
+import gzip
+import mmap
+import os
+
+import xml.etree.ElementTree as ET
+
+import numpy as np
+
+from extensions import ExtensionReader
+import instrument
+from track import Track, NAT, datetime_to_ns, get_tz_name, get_tz_names, join_tz_names
+import timezones
+# Number of time strings held before they are converted in one call
+TIME_CHUNK = 65536
+# Points in each iter_batches batch
+BATCH_SIZE = 65536
+# Bytes fed to the parser at a time
+BLOCK_SIZE = 1024 * 1024
+
+Batch = collections.namedtuple('Batch', ('track', 'start', 'continues', 'continues_trk'))
+
+def get_namespace(tag):
+    '''Returns the namespace part of an ElementTree tag, or '' if none.'''
+    if tag[0] == '{':
+        return tag[1:tag.index('}')]
+    return ''
+
+@instrument.timed()
+def parse_times(texts):
+    '''Converts a list of GPX (ISO 8601) time strings to an int64 array of
+    nanoseconds since the epoch (UTC). Times ending in Z are converted in one
+    vectorized call. Times with an explicit UTC offset are handled
+    individually.'''
+    n = len(texts)
+    time_ns = np.empty(n, dtype=np.int64)
+    utc = []
+    utc_index = []
+    for i, text in enumerate(texts):
+        if text is None:
+            time_ns[i] = NAT
+        elif text[-1] == 'Z':
+            utc.append(text[:-1])
+            utc_index.append(i)
+        elif len(text) > 19 and text[-6] in '+-' and text[-3] == ':':
+            # Explicit offset, e.g. 2021-12-04T12:01:33-05:00
+            time_ns[i] = datetime_to_ns(datetime.datetime.fromisoformat(text))
+        else:
+            # No zone designator, GPX says this is UTC
+            utc.append(text)
+            utc_index.append(i)
+    if utc:
+        time_ns[utc_index] = np.array(utc, dtype='datetime64[ns]').view(np.int64)
+    return time_ns
+
+def iter_blocks(file_name, block_size=BLOCK_SIZE):
+    '''Yields the bytes of the file block_size bytes at a time. The file is
+    memory mapped. Files ending in .gz are decompressed as they are read, and
+    file_name may also be an open binary file.'''
+    if hasattr(file_name, 'read'):
+        yield from iter(lambda: file_name.read(block_size), b'')
+    elif str(file_name).endswith('.gz'):
+        with gzip.open(file_name, 'rb') as f:
+            yield from iter_blocks(f, block_size)
+    else:
+        with open(file_name, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    # Let the pages already read go, where the platform can
+                    can_release = hasattr(mmap, 'MADV_DONTNEED')
+                    released = 0
+                    if hasattr(mmap, 'MADV_SEQUENTIAL'):
+                        mm.madvise(mmap.MADV_SEQUENTIAL)
+                    for offset in range(0, size, block_size):
+                        yield mm[offset:offset + block_size]
+                        done = min(offset + block_size, size) // mmap.PAGESIZE * mmap.PAGESIZE
+                        if can_release and done > released:
+                            mm.madvise(mmap.MADV_DONTNEED, released, done - released)
+                            released = done
+
+class PointTarget:
+    '''Parser target that takes the values of the trackpoints as they are
+    parsed, so no elements are made. The points are kept in compact typed
+    buffers, and each batch_size points are put in ready, as get_batch
+    returns them.'''
+
+    def __init__(self, fields=('hr',), batch_size=None):
+        self.fields = fields
+        self.batch_size = batch_size
+        self.lat = array.array('d')
+        self.lon = array.array('d')
+        self.ele = array.array('d')
+        self.time_ns = array.array('q')
+        self.times = []
+        self.seg_starts = []
+        self.trk_starts = []
+        self.reader = ExtensionReader(fields=fields)
+        self.ready = []
+        self.n_batches = 0
+        self.q_trk = None
+        # Depth below the trkpt, 0 when not in a point
+        self.depth = 0
+        # Text of the element being read, or None when not wanted
+        self.text = None
+
+    def start(self, tag, attrib):
+        depth = self.depth
+        if depth:
+            depth = self.depth = depth + 1
+            # Only the text before the first child is wanted, as for
+            # Element.text
+            self.text = None
+            if depth == 2:
+                if (tag == self.q_ele and self.point_ele is None) \
+                        or (tag == self.q_time and self.point_time is None):
+                    self.text = []
+                elif tag == self.q_ext and self.point_ext is None:
+                    self.point_ext = []
+                    self.in_ext = True
+            elif self.in_ext:
+                if depth == 3:
+                    # Child of <extensions>: tag, text, texts of its children
+                    self.ext_child = [tag, None, {}]
+                    self.point_ext.append(self.ext_child)
+                    self.text = []
+                elif depth == 4 and tag not in self.ext_child[2]:
+                    self.text = []
+            return
+        if self.q_trk is None:
+            # The default namespace is whatever the root element uses
+            ns = get_namespace(tag)
+            prefix = f'{{{ns}}}' if ns else ''
+            self.q_trk = prefix + 'trk'
+            self.q_trkseg = prefix + 'trkseg'
+            self.q_trkpt = prefix + 'trkpt'
+            self.q_ele = prefix + 'ele'
+            self.q_time = prefix + 'time'
+            self.q_ext = prefix + 'extensions'
+        elif tag == self.q_trkpt:
+            self.depth = 1
+            self.lat.append(float(attrib['lat']))
+            self.lon.append(float(attrib['lon']))
+            self.point_ele = self.point_time = self.point_ext = None
+            self.in_ext = False
+        elif tag == self.q_trkseg:
+            self.seg_starts.append(len(self.lat))
+        elif tag == self.q_trk:
+            self.trk_starts.append(len(self.seg_starts))
+
+    def data(self, data):
+        if self.text is not None:
+            self.text.append(data)
+
+    def end(self, tag):
+        depth = self.depth
+        if not depth:
+            return
+        text = self.text
+        self.text = None
+        self.depth = depth - 1
+        if depth == 1:
+            self.end_point()
+        elif depth == 2:
+            if text is None:
+                if tag == self.q_ext:
+                    self.in_ext = False
+            elif tag == self.q_ele:
+                self.point_ele = ''.join(text)
+            elif tag == self.q_time:
+                self.point_time = ''.join(text)
+        elif self.in_ext:
+            if depth == 3:
+                if text is not None:
+                    self.ext_child[1] = ''.join(text)
+            elif depth == 4 and text is not None:
+                self.ext_child[2][tag] = ''.join(text)
+
+    def end_point(self):
+        self.ele.append(float(self.point_ele) if self.point_ele is not None else np.nan)
+        time = self.point_time.strip() if self.point_time is not None else None
+        self.times.append(time if time else None)
+        if len(self.times) == TIME_CHUNK:
+            self.time_ns.extend(parse_times(self.times))
+            self.times.clear()
+        # Get HR and the other extension fields
+        self.reader.append_values(self.reader.read_texts(self.point_ext or ()))
+        if self.batch_size is not None and len(self.lat) == self.batch_size:
+            self.ready.append(self.get_batch())
+            for buffer in (self.lat, self.lon, self.ele, self.time_ns):
+                del buffer[:]
+            self.reader = ExtensionReader(fields=self.fields)
+            self.seg_starts.clear()
+            self.trk_starts.clear()
+            self.n_batches += 1
+
+    def close(self):
+        pass
+
+    def get_batch(self):
+        '''Returns the points so far as read_gpx_arrays returns them, with
+        continues and continues_trk.'''
+        self.time_ns.extend(parse_times(self.times))
+        self.times.clear()
+        n = len(self.lat)
+        # Points before the first segment start carry on the last segment of
+        # the batch before, and segments before the first track start carry
+        # on its last track
+        seg_list = self.seg_starts[:]
+        continues = bool(n) and (not seg_list or seg_list[0] > 0)
+        if continues:
+            seg_list.insert(0, 0)
+        trk_list = [i + continues for i in self.trk_starts]
+        continues_trk = bool(seg_list) and (not trk_list or trk_list[0] > 0)
+        if continues_trk:
+            trk_list.insert(0, 0)
+        instrument.add_points(n)
+        return (self.to_array(self.lat, np.float64), self.to_array(self.lon, np.float64),
+            self.to_array(self.ele, np.float64), self.reader.arrays(),
+            self.to_array(self.time_ns, np.int64),
+            np.array(seg_list + [n], dtype=np.int64),
+            np.array(trk_list + [len(seg_list)], dtype=np.int64), continues, continues_trk)
+
+    def to_array(self, buffer, dtype):
+        # The buffers are reused for the next batch, so need a copy
+        values = np.frombuffer(buffer, dtype=dtype)
+        return values.copy() if self.batch_size is not None else values
+
+def iter_gpx_arrays(file_name, fields=('hr',), batch_size=None):
+    '''Reads the trackpoints of a GPX file in one pass and yields them in
+    batches of batch_size points, or all in one batch if batch_size is None.
+    Each batch is as read_gpx_arrays returns, with continues and
+    continues_trk added: whether the first segment, and the first track, of
+    the batch carry on the last ones of the batch before. Only one batch is
+    held at a time, so memory use does not depend on the size of the file.'''
+    target = PointTarget(fields, batch_size)
+    parser = ET.XMLParser(target=target)
+    for block in iter_blocks(file_name):
+        parser.feed(block)
+        if target.ready:
+            yield from target.ready
+            target.ready.clear()
+    parser.close()
+    yield from target.ready
+    if target.n_batches == 0 or len(target.lat) or target.seg_starts:
+        yield target.get_batch()
+
+@instrument.timed()
+def read_gpx_arrays(file_name, fields=('hr',)):
+    '''Reads the trackpoints of a GPX file in one pass.
+
+        Parameters
+        ----------
+        file_name : str
+            Full path to the GPX file.
+        fields : tuple of str
+            The extension fields to extract. See extensions.FIELDS.
+            default: ('hr',)
+
+        Returns
+        ------
+        return : lat, lon, ele, ext, time_ns, seg_offsets, trk_offsets
+            lat, lon and ele are float64 arrays (ele is NaN where missing),
+            ext is a dict of typed arrays, one for each of the fields, with
+            extensions.FIELDS giving the value used where missing, time_ns is
+            an int64 array of nanoseconds since the epoch (UTC), and
+            seg_offsets and trk_offsets give the segments and tracks as
+            described in track.Track.
+    '''
+    return next(iter_gpx_arrays(file_name, fields))[:-2]
+
+def iter_batches(file_name, batch_size=BATCH_SIZE, fields=('hr',), timezone=False):
+    '''Reads a GPX file in a single streaming pass and yields Batch tuples of
+    (track, start, continues, continues_trk), where track is a Track of the
+    next batch_size points, start is the index of its first point in the
+    file, and continues and continues_trk are whether its first segment and
+    first track carry on the last ones of the batch before. If timezone is
+    True the timezone of each track is found from its first point, as for
+    read_track, otherwise it is left as None (UTC). Extension fields other
+    than hr are put in Track.extras.'''
+    if 'hr' not in fields:
+        fields = ('hr',) + tuple(fields)
+    tz_name = None
+    last_tz_name = None
+    start = 0
+    for lat, lon, ele, ext, time_ns, seg_offsets, trk_offsets, continues, continues_trk in \
+            iter_gpx_arrays(file_name, fields, batch_size):
+        if timezone:
+            names = get_tz_names(lat, lon, seg_offsets, trk_offsets)
+            # A track carried on from the last batch keeps its timezone
+            if continues_trk and start > 0:
+                names[0] = last_tz_name
+            if names and names[-1] is not None:
+                last_tz_name = names[-1]
+            tz_name = join_tz_names(names)
+        hr = ext.pop('hr')
+        yield Batch(Track(lat, lon, ele, hr, time_ns, tz_name, ext, seg_offsets, trk_offsets),
+            start, continues, continues_trk)
+        start += len(lat)
+
+def read_gpx_data(file_name):
+    '''Reads a GPX file in a single streaming pass and returns the same data as
+    py_gps.get_gpx_data(py_gps.get_gpx(file_name)) does, with lat, lon, ele and
+    hr as NumPy arrays and time as a list of timezone-aware datetimes. The
+    timezone is found from the first point of each track.'''
+    lat, lon, ele, ext, time_ns, seg_offsets, trk_offsets = read_gpx_arrays(file_name)
+    hr = ext['hr'].astype(np.int64)
+    time = []
+    trk_bounds = seg_offsets[trk_offsets]
+    for start, end in zip(trk_bounds[:-1], trk_bounds[1:]):
+        if start == end:
+            continue
+        tz_name = timezones.timezone_at(lat[start], lon[start])
+        time.extend(timezones.to_datetimes(time_ns[start:end], tz_name))
+    return lat, lon, ele, hr, time
+
+def read_track(file_name, fields=('hr',), timezone=True):
+    '''Reads a GPX file in a single streaming pass and returns a Track. The
+    timezone of each track is found from its first point, as
+    py_gps.get_gpx_data does (see track.get_tz_name), unless timezone is
+    False, when it is left as None (UTC) and timezonefinder is not loaded.
+    Extension fields other than hr are put in Track.extras.'''
+    if 'hr' not in fields:
+        fields = ('hr',) + tuple(fields)
+    lat, lon, ele, ext, time_ns, seg_offsets, trk_offsets = \
+        read_gpx_arrays(file_name, fields)
+    hr = ext.pop('hr')
+    tz_name = None
+    if timezone:
+        tz_name = get_tz_name(lat, lon, seg_offsets, trk_offsets)
+    return Track(lat, lon, ele, hr, time_ns, tz_name, ext, seg_offsets, trk_offsets)
@@ -0,0 +1,406 @@
+''' Streaming GPX writer.
+Writes GPX 1.1 from the columnar arrays of a Track, or from any arrays of
+lat, lon, ele, time, and extension values, a chunk of points at a time, so
+the memory used does not depend on the number of points. The text for each
+chunk is made in one go and written through a large buffer, and the output
+is gzip compressed if the file name ends in .gz. The file is written to a
+temporary file and renamed when it is closed, so a reader never sees a
+partly written file.
+
+The namespaces of the original file can be kept (see get_nsmap). The hr,
+cad, and atemp extension values are written in a Garmin
+TrackPointExtension, and power as a Garmin PowerInWatts, so
+extensions.ExtensionReader reads them back. Derived series, such as the
+filtered speed, are written in the extensions in the Py GPS namespace
+(PY_GPS_NAMESPACE), e.g. <pygps:speed_filtered>. Simplified geometry is
+written by passing a mask from simplify.simplify.
+
+Only the extension values that gpx_stream reads into the Track are written
+again. Other extension elements of the original file, e.g. from other
+vendors' schemas, are not kept, though their namespace declarations are.
+
+    python gpx_writer.py track.gpx processed.gpx.gz --speed --simplify 5
+'''
+
+import argparse
+import gzip
+import os
+import sys
+
+import xml.etree.ElementTree as ET
+from xml.sax.saxutils import escape, quoteattr
+
+import numpy as np
+
+import extensions
+from track import NAT
+
+GPX_11 = 'http://www.topografix.com/GPX/1/1'
+TPX = 'http://www.garmin.com/xmlschemas/TrackPointExtension/v2'
+PWR = 'http://www.garmin.com/xmlschemas/PowerExtension/v1'
+# Namespace for the derived series. This only identifies the elements as
+# written by Py GPS; there is no published schema at this URI, so validating
+# readers should skip the elements as they do other unknown extensions.
+PY_GPS_NAMESPACE = 'https://github.com/KennethEvans/VS-Py-GPS/xmlschemas/v1'
+XSI = 'http://www.w3.org/2001/XMLSchema-instance'
+# Preferred prefixes for the namespaces the writer uses
+PREFIXES = {TPX: 'gpxtpx', PWR: 'pwr', PY_GPS_NAMESPACE: 'pygps', XSI: 'xsi'}
+CREATOR = 'Py GPS'
+# Points formatted and written at a time
+CHUNK_SIZE = 10000
+BUFFER_SIZE = 1024 * 1024
+# TrackPointExtension fields, in schema order
+TPX_FIELDS = ('atemp', 'hr', 'cad')
+
+def get_nsmap(file_name):
+    '''Returns the prefix to namespace map of the root element of a GPX file,
+    reading only up to the root element. The default namespace has the
+    prefix ''. The file is read as gpx_stream reads it, so it may be gzip
+    compressed.'''
+    import gpx_stream
+    nsmap = {}
+    parser = ET.XMLPullParser(events=('start-ns', 'start'))
+    blocks = gpx_stream.iter_blocks(file_name, block_size=65536)
+    try:
+        for block in blocks:
+            parser.feed(block)
+            for event, value in parser.read_events():
+                if event == 'start':
+                    return nsmap
+                prefix, uri = value
+                nsmap[prefix] = uri
+    finally:
+        # Closes the file
+        blocks.close()
+    return nsmap
+
+def is_missing(values, name):
+    '''Returns a mask of the values that are missing for an extension field
+    or a derived series.'''
+    if name in extensions.FIELDS:
+        missing = extensions.get_missing(name)
+        if isinstance(missing, float) and np.isnan(missing):
+            return np.isnan(values)
+        return values == missing
+    return np.isnan(values)
+
+def format_times(time_ns):
+    '''Returns the times as GPX time strings, with ms only if needed. NaT
+    gives None.'''
+    time_ns = np.asarray(time_ns, dtype=np.int64)
+    missing = time_ns == NAT
+    unit = 's' if np.all((time_ns[~missing] % 1000000000) == 0) else 'ms'
+    texts = np.datetime_as_string(time_ns.view('datetime64[ns]'), unit=unit)
+    return [None if m else f'{text}Z' for m, text in zip(missing.tolist(), texts.tolist())]
+
+def get_elements(tag, values, missing, format):
+    '''Returns a list of the elements for values with format, '' where
+    missing is True.'''
+    template = f'<{tag}>{format}</{tag}>'
+    if not np.any(missing):
+        return [template.format(value) for value in values]
+    return ['' if m else template.format(value) for m, value in zip(missing.tolist(), values)]
+
+class GpxWriter:
+    '''Writes a GPX 1.1 file a chunk at a time. Use as a context manager, or
+    call close, e.g.
+
+        with GpxWriter('out.gpx.gz') as writer:
+            writer.start_track('Walk')
+            writer.start_segment()
+            writer.write_points(lat, lon, ele, time, {'hr': hr})
+            writer.end_segment()
+            writer.end_track()
+
+        Parameters
+        ----------
+        file_name : str
+            The file to write. Compressed with gzip if it ends in .gz.
+        nsmap : dict
+            Prefix to namespace map to declare, e.g. from get_nsmap for the
+            original file. The default namespace is always GPX 1.1, and the
+            namespaces the writer uses are added if missing.
+            default: None
+        creator : str
+            The creator attribute.
+            default: CREATOR
+        metadata_name : str
+            Name for the metadata element. No metadata is written if None.
+            default: None
+        compresslevel : int
+            gzip compression level.
+            default: 6
+    '''
+
+    def __init__(self, file_name, nsmap=None, creator=CREATOR, metadata_name=None,
+            compresslevel=6):
+        self.file_name = file_name
+        self.tmp = f'{file_name}.{os.getpid()}.tmp'
+        self.prefixes = self.get_prefixes(nsmap)
+        self.raw = open(self.tmp, 'wb', buffering=BUFFER_SIZE)
+        if file_name.endswith('.gz'):
+            self.out = gzip.GzipFile(filename=os.path.basename(file_name)[:-3], mode='wb',
+                fileobj=self.raw, compresslevel=compresslevel)
+        else:
+            self.out = self.raw
+        self.in_track = False
+        self.in_segment = False
+        self.n_points = 0
+        declarations = ''.join(f' xmlns{":" + prefix if prefix else ""}={quoteattr(uri)}'
+            for uri, prefix in self.prefixes.items())
+        xsi = self.prefixes[XSI]
+        self.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+            f'<gpx{declarations} {xsi}:schemaLocation="{GPX_11} {GPX_11}/gpx.xsd"'
+            f' version="1.1" creator={quoteattr(creator)}>\n')
+        if metadata_name is not None:
+            self.write(f'  <metadata><name>{escape(metadata_name)}</name></metadata>\n')
+
+    @staticmethod
+    def get_prefixes(nsmap):
+        '''Returns {namespace: prefix} for the root element.'''
+        prefixes = {GPX_11: ''}
+        for prefix, uri in (nsmap or {}).items():
+            # The default namespace and GPX 1.0 become GPX 1.1
+            if prefix and uri not in prefixes and not uri.startswith('http://www.topografix.com/GPX/'):
+                prefixes[uri] = prefix
+        used = set(prefixes.values())
+        for uri, prefix in PREFIXES.items():
+            if uri not in prefixes:
+                name = prefix
+                i = 1
+                while name in used:
+                    name = f'{prefix}{i}'
+                    i += 1
+                prefixes[uri] = name
+                used.add(name)
+        return prefixes
+
+    def write(self, text):
+        self.out.write(text.encode('utf-8'))
+
+    def start_track(self, name=None):
+        if self.in_track:
+            self.end_track()
+        self.write('  <trk>\n')
+        if name is not None:
+            self.write(f'    <name>{escape(name)}</name>\n')
+        self.in_track = True
+
+    def end_track(self):
+        if self.in_segment:
+            self.end_segment()
+        if self.in_track:
+            self.write('  </trk>\n')
+            self.in_track = False
+
+    def start_segment(self):
+        if not self.in_track:
+            self.start_track()
+        if self.in_segment:
+            self.end_segment()
+        self.write('    <trkseg>\n')
+        self.in_segment = True
+
+    def end_segment(self):
+        if self.in_segment:
+            self.write('    </trkseg>\n')
+            self.in_segment = False
+
+    def write_points(self, lat, lon, ele=None, time=None, ext=None, derived=None):
+        '''Writes trackpoints to the current segment, CHUNK_SIZE at a time.
+
+            Parameters
+            ----------
+            lat, lon : array_like
+                Latitude and longitude, deg.
+            ele : array_like
+                Elevation, m, NaN where missing.
+                default: None
+            time : array_like of int64
+                Time, ns since the epoch (UTC), NAT where missing.
+                default: None
+            ext : dict
+                Extension fields, keys of extensions.FIELDS, with the
+                missing values given there.
+                default: None
+            derived : dict
+                Other series to write in the Py GPS namespace, NaN where
+                missing.
+                default: None
+        '''
+        if not self.in_segment:
+            self.start_segment()
+        n = len(lat)
+        for start in range(0, n, CHUNK_SIZE):
+            end = min(start + CHUNK_SIZE, n)
+            self.write(self.format_points(slice(start, end), lat, lon, ele, time,
+                ext or {}, derived or {}))
+        self.n_points += n
+
+    def format_points(self, key, lat, lon, ele, time, ext, derived):
+        '''Returns the text for the points in key. Each element is made as a
+        list of strings for all the points, '' where missing, and the lists
+        are then joined point by point.'''
+        lat = np.asarray(lat[key], dtype=np.float64).tolist()
+        lon = np.asarray(lon[key], dtype=np.float64).tolist()
+        n = len(lat)
+        columns = [[f'      <trkpt lat="{la:.7f}" lon="{lo:.7f}">' for la, lo in zip(lat, lon)]]
+        if ele is not None:
+            values = np.asarray(ele[key], dtype=np.float64)
+            columns.append(get_elements('ele', values.tolist(), np.isnan(values), '{:.3f}'))
+        if time is not None:
+            texts = format_times(time[key])
+            columns.append(['' if text is None else f'<time>{text}</time>' for text in texts])
+        tpx = self.prefixes[TPX]
+        # (tag, name, values) of the extension elements, TrackPointExtension
+        # ones first
+        items = [(f'{tpx}:{name}', name, ext[name]) for name in TPX_FIELDS if name in ext]
+        n_tpx = len(items)
+        if 'power' in ext:
+            items.append((f'{self.prefixes[PWR]}:PowerInWatts', 'power', ext['power']))
+        items.extend((f'{self.prefixes[PY_GPS_NAMESPACE]}:{name}', name, values)
+            for name, values in derived.items())
+        if items:
+            has_tpx = np.zeros(n, dtype=bool)
+            has_ext = np.zeros(n, dtype=bool)
+            elements = []
+            for i, (tag, name, values) in enumerate(items):
+                values = np.asarray(values[key])
+                missing = is_missing(values, name)
+                format = '{:.6g}' if values.dtype.kind == 'f' else '{}'
+                elements.append(get_elements(tag, values.tolist(), missing, format))
+                if i < n_tpx:
+                    has_tpx |= ~missing
+                has_ext |= ~missing
+            columns.append(np.where(has_ext, '<extensions>', '').tolist())
+            if n_tpx:
+                columns.append(np.where(has_tpx, f'<{tpx}:TrackPointExtension>', '').tolist())
+                columns.extend(elements[:n_tpx])
+                columns.append(np.where(has_tpx, f'</{tpx}:TrackPointExtension>', '').tolist())
+            columns.extend(elements[n_tpx:])
+            columns.append(np.where(has_ext, '</extensions></trkpt>\n',
+                '</trkpt>\n').tolist())
+        else:
+            columns.append(['</trkpt>\n'] * n)
+        return ''.join(map(''.join, zip(*columns)))
+
+    def close(self):
+        '''Finishes the file and renames it to file_name.'''
+        if self.out is None:
+            return
+        self.end_track()
+        self.write('</gpx>\n')
+        if self.out is not self.raw:
+            self.out.close()
+        self.raw.close()
+        self.out = None
+        os.replace(self.tmp, self.file_name)
+
+    def abort(self):
+        '''Stops writing and removes the temporary file.'''
+        if self.out is None:
+            return
+        if self.out is not self.raw:
+            self.out.close()
+        self.raw.close()
+        self.out = None
+        os.remove(self.tmp)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+def write_track(file_name, track, derived=None, mask=None, nsmap=None, name=None, **kwargs):
+    '''Writes a Track as GPX, with its tracks and segments, hr, and the
+    extension fields in Track.extras.
+
+        Parameters
+        ----------
+        file_name : str
+            The file to write. Compressed with gzip if it ends in .gz.
+        track : Track
+            The track.
+        derived : dict
+            Other series to write, each with a value for each point, e.g.
+            {'speed_filtered': process_speed(track)}.
+            default: None
+        mask : array_like of bool
+            Only the points where mask is True are written, e.g. from
+            simplify.simplify.
+            default: None
+        nsmap : dict
+            As for GpxWriter, e.g. get_nsmap(original_file_name).
+            default: None
+        name : str
+            Name for each track.
+            default: None
+        kwargs
+            Passed to GpxWriter.
+
+        Returns
+        ------
+        return : int
+            The number of points written.
+    '''
+    derived = dict(derived) if derived else {}
+    if mask is not None:
+        mask = np.asarray(mask, dtype=bool)
+        derived = {key: np.asarray(values)[mask] for key, values in derived.items()}
+        track = track[mask]
+    ext = {'hr': track.hr}
+    ext.update(track.extras)
+    with GpxWriter(file_name, nsmap, **kwargs) as writer:
+        for trk in range(track.n_trk):
+            writer.start_track(name)
+            for seg in range(track.trk_offsets[trk], track.trk_offsets[trk + 1]):
+                start, end = track.seg_offsets[seg], track.seg_offsets[seg + 1]
+                key = slice(start, end)
+                writer.start_segment()
+                writer.write_points(track.lat[key], track.lon[key], track.ele[key],
+                    track.time[key], {field: values[key] for field, values in ext.items()},
+                    {field: values[key] for field, values in derived.items()})
+                writer.end_segment()
+            writer.end_track()
+        return writer.n_points
+
+def get_parser():
+    parser = argparse.ArgumentParser(description='Write a GPX file again, with derived series.')
+    parser.add_argument('input', help='GPX file to read')
+    parser.add_argument('output', help='GPX file to write, gzip compressed if it ends in .gz')
+    parser.add_argument('--speed', action='store_true',
+        help='add speed and speed_filtered (mph) extensions')
+    parser.add_argument('--simplify', type=float, metavar='TOLERANCE',
+        help='keep only the points Douglas-Peucker needs for this tolerance, m')
+    return parser
+
+def main(argv=None):
+    import gpx_stream
+    args = get_parser().parse_args(argv)
+    fields = tuple(extensions.FIELDS)
+    track = gpx_stream.read_track(args.input, fields=fields, timezone=False)
+    # Drop the fields the file does not have
+    track.extras = {name: values for name, values in track.extras.items()
+        if not np.all(is_missing(values, name))}
+    derived = {}
+    if args.speed:
+        import resampling
+        import speed as s
+        derived['speed'] = s.get_speed(track)[0]
+        derived['speed_filtered'] = s.process_speed(track, derived['speed'],
+            fs=resampling.get_fs(track), uniform=True, zero_phase=True)
+    mask = None
+    if args.simplify is not None:
+        import simplify
+        mask = simplify.simplify(track, tolerance=args.simplify)
+    n_points = write_track(args.output, track, derived, mask, get_nsmap(args.input))
+    print(f'Wrote {n_points} of {len(track)} points to {args.output}')
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,314 @@
+''' Opt-in timing and memory instrumentation of the processing stages.
+Stages are marked with the timed decorator or the stage context manager.
+When instrumentation is enabled each stage records its number of calls, the
+cumulative time, and, if memory is on, the tracemalloc peak above the memory
+in use when it started. The points read from each file are counted with
+add_points inside a file context. The results can be dumped as JSON or as a
+Chrome trace-event file, which can be opened in chrome://tracing or
+https://ui.perfetto.dev.
+
+Instrumentation is enabled by calling enable, or by setting PY_GPS_PROFILE
+to an output file before starting, e.g.
+
+    PY_GPS_PROFILE=profile.json python py_gps.py
+    PY_GPS_PROFILE=profile.trace.json python batch.py GPSLink
+
+in which case the results are written to that file at exit. A file name
+ending in .trace or .trace.json gives a Chrome trace, otherwise JSON, unless
+PY_GPS_PROFILE_FORMAT is set. PY_GPS_PROFILE_MEMORY=0 turns off tracemalloc,
+which otherwise slows the code down severalfold and inflates the times.
+
+When it is disabled a timed function costs one extra call and a flag check,
+and stage returns a shared no-op context manager.
+'''
+
+import atexit
+import contextlib
+import functools
+import json
+import multiprocessing
+import os
+import threading
+import time
+import tracemalloc
+
+ENV_VAR = 'PY_GPS_PROFILE'
+FORMATS = ('json', 'trace')
+# Trace events kept, beyond this only the totals are recorded
+MAX_EVENTS = 1000000
+
+_enabled = False
+_memory = False
+_null = contextlib.nullcontext()
+_lock = threading.Lock()
+_local = threading.local()
+_stages = {}
+_files = {}
+_events = []
+
+class _Frame:
+    '''An active stage.'''
+    __slots__ = ('name', 'start', 'start_bytes', 'child_peak', 'args')
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+        self.child_peak = 0
+        if _memory:
+            # Keep the peak so far for the enclosing stage, then reset it
+            current, peak = tracemalloc.get_traced_memory()
+            stack = _get_stack()
+            if stack:
+                stack[-1].child_peak = max(stack[-1].child_peak, peak)
+            tracemalloc.reset_peak()
+            self.start_bytes = current
+        else:
+            self.start_bytes = 0
+        self.start = time.perf_counter_ns()
+
+def _get_stack():
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+def _push(name, args=None):
+    frame = _Frame(name, args)
+    _get_stack().append(frame)
+    return frame
+
+def _pop(frame):
+    end = time.perf_counter_ns()
+    stack = _get_stack()
+    stack.pop()
+    peak_bytes = None
+    if _memory and tracemalloc.is_tracing():
+        peak = max(tracemalloc.get_traced_memory()[1], frame.child_peak)
+        peak_bytes = max(peak - frame.start_bytes, 0)
+        if stack:
+            stack[-1].child_peak = max(stack[-1].child_peak, peak)
+    elapsed = end - frame.start
+    with _lock:
+        stats = _stages.get(frame.name)
+        if stats is None:
+            stats = _stages[frame.name] = {'calls': 0, 'time': 0., 'peak_bytes': 0}
+        stats['calls'] += 1
+        stats['time'] += elapsed / 1e9
+        if peak_bytes is not None:
+            stats['peak_bytes'] = max(stats['peak_bytes'], peak_bytes)
+        if len(_events) < MAX_EVENTS:
+            event = {'name': frame.name, 'cat': 'py_gps', 'ph': 'X',
+                'ts': frame.start / 1000, 'dur': elapsed / 1000,
+                'pid': os.getpid(), 'tid': threading.get_ident()}
+            args = dict(frame.args) if frame.args else {}
+            if peak_bytes is not None:
+                args['peak_bytes'] = peak_bytes
+            if args:
+                event['args'] = args
+            _events.append(event)
+    return elapsed, peak_bytes
+
+class _Stage:
+    '''Context manager that records a stage.'''
+    __slots__ = ('name', 'args', 'frame')
+
+    def __init__(self, name, args=None):
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.frame = _push(self.name, self.args)
+        return self
+
+    def __exit__(self, *exc):
+        _pop(self.frame)
+        return False
+
+class _File(_Stage):
+    '''Context manager that records the processing of one file.'''
+
+    def __init__(self, file_name):
+        super().__init__('file', {'file_name': file_name})
+        self.file_name = file_name
+
+    def __enter__(self):
+        self.previous = getattr(_local, 'file_name', None)
+        _local.file_name = self.file_name
+        with _lock:
+            _files.setdefault(self.file_name,
+                {'points': 0, 'time': 0., 'peak_bytes': 0})
+        return super().__enter__()
+
+    def __exit__(self, *exc):
+        elapsed, peak_bytes = _pop(self.frame)
+        _local.file_name = self.previous
+        with _lock:
+            stats = _files[self.file_name]
+            stats['time'] += elapsed / 1e9
+            if peak_bytes is not None:
+                stats['peak_bytes'] = max(stats['peak_bytes'], peak_bytes)
+        return False
+
+def is_enabled():
+    return _enabled
+
+def is_memory_enabled():
+    return _enabled and _memory
+
+def enable(output=None, memory=True, format=None):
+    '''Turns on the instrumentation. If output is given the results are
+    written there at exit (by this process only, not by pool workers).
+
+        Parameters
+        ----------
+        output : str
+            File to write the results to at exit.
+            default: None
+        memory : boolean
+            Whether to record tracemalloc peaks.
+            default: True
+        format : str
+            'json' or 'trace', found from output if not given.
+            default: None
+    '''
+    global _enabled, _memory
+    _enabled = True
+    _memory = memory
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    if output:
+        pid = os.getpid()
+        def dump_at_exit():
+            if os.getpid() == pid:
+                dump(output, format)
+        atexit.register(dump_at_exit)
+
+def disable():
+    '''Turns off the instrumentation. The results so far are kept.'''
+    global _enabled, _memory
+    _enabled = False
+    if _memory and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    _memory = False
+
+def stage(name, **args):
+    '''Returns a context manager that records the enclosed code as a stage.
+    Any keyword arguments are added to the trace event.'''
+    if not _enabled:
+        return _null
+    return _Stage(name, args)
+
+def timed(name=None):
+    '''Decorator that records each call of the function as a stage, named
+    name or the function's qualified name.'''
+    def decorator(function):
+        stage_name = name or function.__qualname__
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return function(*args, **kwargs)
+            frame = _push(stage_name)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                _pop(frame)
+        return wrapper
+    return decorator
+
+def file(file_name):
+    '''Returns a context manager for processing file_name. The time and
+    points inside it are recorded for the file.'''
+    if not _enabled:
+        return _null
+    return _File(file_name)
+
+def add_points(n):
+    '''Adds n points to the count for the current file.'''
+    if not _enabled:
+        return
+    file_name = getattr(_local, 'file_name', None)
+    if file_name is None:
+        return
+    with _lock:
+        _files[file_name]['points'] += n
+
+def get_results():
+    '''Returns a copy of the results as a dict with stages, files, and
+    events.'''
+    with _lock:
+        return {
+            'stages': {name: dict(stats) for name, stats in _stages.items()},
+            'files': {name: dict(stats) for name, stats in _files.items()},
+            'events': list(_events),
+        }
+
+def reset():
+    '''Clears the results.'''
+    with _lock:
+        _stages.clear()
+        _files.clear()
+        _events.clear()
+
+def take():
+    '''Returns the results and clears them. Used to send the results of a
+    worker process back to be merged.'''
+    with _lock:
+        results = {'stages': dict(_stages), 'files': dict(_files), 'events': list(_events)}
+        _stages.clear()
+        _files.clear()
+        _events.clear()
+    return results
+
+def merge(results):
+    '''Adds results from take, e.g. from another process, to these.'''
+    with _lock:
+        for name, other in results['stages'].items():
+            stats = _stages.setdefault(name, {'calls': 0, 'time': 0., 'peak_bytes': 0})
+            stats['calls'] += other['calls']
+            stats['time'] += other['time']
+            stats['peak_bytes'] = max(stats['peak_bytes'], other['peak_bytes'])
+        for name, other in results['files'].items():
+            stats = _files.setdefault(name, {'points': 0, 'time': 0., 'peak_bytes': 0})
+            stats['points'] += other['points']
+            stats['time'] += other['time']
+            stats['peak_bytes'] = max(stats['peak_bytes'], other['peak_bytes'])
+        _events.extend(results['events'][:max(MAX_EVENTS - len(_events), 0)])
+
+def get_format(file_name):
+    '''Returns the dump format for file_name.'''
+    format = os.environ.get(ENV_VAR + '_FORMAT')
+    if format:
+        return format
+    lower = file_name.lower()
+    if lower.endswith('.trace') or lower.endswith('.trace.json'):
+        return 'trace'
+    return 'json'
+
+def dump(file_name, format=None):
+    '''Writes the results to file_name as JSON (stages and files) or as a
+    Chrome trace (events, with the totals as metadata).'''
+    if format is None:
+        format = get_format(file_name)
+    if format not in FORMATS:
+        raise ValueError(f'Unknown format: {format}')
+    results = get_results()
+    with open(file_name, 'w') as f:
+        if format == 'trace':
+            json.dump({'traceEvents': results['events'], 'displayTimeUnit': 'ms',
+                'otherData': {'stages': results['stages'], 'files': results['files']}}, f)
+        else:
+            json.dump({'stages': results['stages'], 'files': results['files']}, f, indent=2)
+
+def format_results(results=None):
+    '''Returns the stage totals as a table, slowest first.'''
+    if results is None:
+        results = get_results()
+    lines = [f'{"stage":<28} {"calls":>8} {"time, s":>10} {"peak, MB":>10}']
+    for name, stats in sorted(results['stages'].items(), key=lambda item: -item[1]['time']):
+        lines.append(f'{name:<28} {stats["calls"]:>8} {stats["time"]:>10.3f} '
+            f'{stats["peak_bytes"] / 1e6:>10.1f}')
+    return '\n'.join(lines)
+
+# Enable from the environment, but not again in spawned pool workers
+if os.environ.get(ENV_VAR) and multiprocessing.parent_process() is None:
+    enable(os.environ[ENV_VAR], memory=os.environ.get(ENV_VAR + '_MEMORY', '1') != '0')
@@ -3,12 +3,9 @@ Based on https://towardsdatascience.com/how-tracking-apps-analyse-your-gps-data-
 '''
 
 import numpy as np
-import matplotlib.pyplot as plt
 import gpxpy
 
 import datetime
-from zoneinfo import ZoneInfo
-from timezonefinder import TimezoneFinder
 
 import xml.etree.ElementTree as ET
 
@@ -16,9 +13,17 @@ import xml.etree.ElementTree as ET
 #from math import sqrt, floor
 import os
 
-import pandas as pd
-
+# matplotlib is imported by the plot functions when they are used, so the
+# rest can be used without loading it
 import speed as s
+import rolling
+import resampling
+from track_cache import TrackCache
+from extensions import ExtensionReader
+from track import Track, datetime_to_ns, get_tz_name
+import timezones
+import instrument
+import render
 
 def prompt_for_file_names():
     # Prompt for the file name
@@ -49,6 +54,7 @@ def get_files(prompt=True):
         file_names.append(default_file_name);
     return file_names
 
+@instrument.timed()
 def get_gpx(file_name, reparse=True):
     '''Parses the file and returns a gpx object. GpxPy doesn't handle the case
 where the default namespace is not GPX/1/1. This is overcome by parsing the file
@@ -74,17 +80,21 @@ is read directly if reparse=False.
     if reparse:
         # Ensure GPX/1/1 is the default namespace
         ET.register_namespace('', "http://www.topografix.com/GPX/1/1")
-        tree = ET.parse(file_name)
-        root = tree.getroot();
-        xml = ET.tostring(root, encoding='unicode');
+        with instrument.stage('reparse'):
+            tree = ET.parse(file_name)
+            root = tree.getroot();
+            xml = ET.tostring(root, encoding='unicode');
         # Parse the xml string
-        gpx = gpxpy.parse(xml)
+        with instrument.stage('gpxpy.parse'):
+            gpx = gpxpy.parse(xml)
     else:
         gpx_file = open(file_name, 'r')
-        gpx = gpxpy.parse(gpx_file)
+        with instrument.stage('gpxpy.parse'):
+            gpx = gpxpy.parse(gpx_file)
         gpx_file.close();
     return gpx
 
+@instrument.timed()
 def get_gpx_info(gpx):
     n_trk = len(gpx.tracks)
     info = ""
@@ -115,9 +125,10 @@ def get_gpx_info(gpx):
        info = info[0: -2]
     return info
 
+@instrument.timed()
 def get_gpx_data(gpx):
     '''Currently Only does the first track and first segment'''
-    tzf = TimezoneFinder()
+    reader = ExtensionReader(gpx.nsmap)
     # Use lists for the data not a DataFrame
     lat = []
     lon = []
@@ -128,85 +139,145 @@ def get_gpx_data(gpx):
     for trk in range(n_trk):
         n_seg = len(gpx.tracks[trk].segments)
         first = True  # Flag to get the timezone for this track
+        time_ns = []  # UTC times for this track
         for seg in range(n_seg):
             points = gpx.tracks[trk].segments[seg].points
             for point in points:
                 if(first):
                     # Get the time zone from the first point in first segment
-                    tz_name = tzf.timezone_at(lng=point.longitude, lat=point.latitude)
+                    tz_name = timezones.timezone_at(point.latitude, point.longitude)
                     first = False
                 lat.append(point.latitude)
                 lon.append(point.longitude)
                 ele.append(point.elevation)
-                # Get HR
-                hr_val = 0
-                extensions = point.extensions
-                found = False
-                for extension in extensions:
-                    if not found:
-                        # Find all children
-                        elems = extension.findall('.//')
-                        for elem in elems:
-                            if elem.tag.endswith('}hr'):
-                                hr_val = int(elem.text)
-                                found = True
-                                break
-                    else:
-                        break
-                hr.append(hr_val)
-                # Get time
-                try:
-                    new_time = point.time.astimezone(ZoneInfo(tz_name))
-                except:
-                    new_time = point.time.astimezone(ZoneInfo('UTC'))
-                time.append(new_time)
+                hr.append(reader.read(point.extensions)[0])
+                time_ns.append(datetime_to_ns(point.time))
+        # Convert the times for the whole track at once
+        if time_ns:
+            time.extend(timezones.to_datetimes(time_ns, tz_name))
+    instrument.add_points(len(lat))
     return lat, lon, ele, hr, time
 
-def get_track_info(lat, lon, ele, time):
-    start = (lat[0], lon[0])
-    end = (lat[-1], lon[-1])
-    start_time = time[0]
-    end_time = time[-1]
-    speed, total_dist, total_time, avg_speed = s.get_speed(lat, lon, time)
+@instrument.timed()
+def get_gpx_track(gpx, fields=('hr',)):
+    '''Returns the same data as get_gpx_data as a Track. The timezone of each
+    track is found from its first point, as get_gpx_data does. Extension
+    fields other than hr are put in Track.extras.'''
+    if 'hr' not in fields:
+        fields = ('hr',) + tuple(fields)
+    reader = ExtensionReader(gpx.nsmap, fields)
+    lat = []
+    lon = []
+    ele = []
+    time = []
+    extensions = []
+    seg_offsets = []
+    trk_offsets = []
+    for track in gpx.tracks:
+        trk_offsets.append(len(seg_offsets))
+        for segment in track.segments:
+            seg_offsets.append(len(lat))
+            for point in segment.points:
+                lat.append(point.latitude)
+                lon.append(point.longitude)
+                ele.append(point.elevation if point.elevation is not None else np.nan)
+                extensions.append(point.extensions)
+                time.append(datetime_to_ns(point.time))
+    seg_offsets.append(len(lat))
+    trk_offsets.append(len(seg_offsets) - 1)
+    instrument.add_points(len(lat))
+    # Get HR and the other extension fields
+    with instrument.stage('extensions'):
+        for children in extensions:
+            reader.append(children)
+    ext = reader.arrays()
+    hr = ext.pop('hr')
+    tz_name = get_tz_name(lat, lon, seg_offsets, trk_offsets)
+    return Track(lat, lon, ele, hr, time, tz_name, ext, seg_offsets, trk_offsets)
+
+@instrument.timed()
+def get_track_summary(lat, lon=None, ele=None, time=None):
+    '''Returns the start, end, and speed information as a dict. Takes either
+    the lat, lon, ele, and time from get_gpx_data or a Track. For a Track
+    the gaps between segments are not counted.'''
+    if isinstance(lat, Track):
+        track = lat
+        # Only the end points are needed as datetimes
+        start_time, end_time = track[[0, -1]].datetimes()
+        speed, total_dist, total_time, avg_speed = s.get_speed(track)
+        lat, lon = track.lat, track.lon
+    else:
+        start_time = time[0]
+        end_time = time[-1]
+        speed, total_dist, total_time, avg_speed = s.get_speed(lat, lon, time)
+    return {
+        'start_lat': float(lat[0]),
+        'start_lon': float(lon[0]),
+        'start_time': start_time,
+        'end_lat': float(lat[-1]),
+        'end_lon': float(lon[-1]),
+        'end_time': end_time,
+        'total_dist': total_dist,
+        'total_time': total_time,
+        'avg_speed': avg_speed,
+    }
+
+def get_track_info(lat, lon=None, ele=None, time=None):
+    '''Returns the start, end, and speed information. Takes either the lat,
+    lon, ele, and time from get_gpx_data or a Track.'''
+    summary = get_track_summary(lat, lon, ele, time)
+    total_dist = summary['total_dist']
+    total_time = summary['total_time']
+    avg_speed = summary['avg_speed']
     info = ""
-    info += f'start: lat={start[0]} lon={start[1]} time={start_time}\n'
-    info += f'end  : lat={end[0]} lon={end[1]} time={end_time}\n'
+    info += f'start: lat={summary["start_lat"]} lon={summary["start_lon"]} time={summary["start_time"]}\n'
+    info += f'end  : lat={summary["end_lat"]} lon={summary["end_lon"]} time={summary["end_time"]}\n'
     info += f'{total_dist=:.2f} mi, {total_time=:.1f} min, avg_speed={avg_speed:.2f} mph'
     return info
 
-def plot_track(lat, lon, title='GPX Track'):
+def plot_track(lat, lon=None, title='GPX Track', file_name=None, decimation='lttb'):
+    '''Plots the track. Takes either lat and lon or a Track. If file_name is
+    given the plot is saved there instead of shown. decimation is as for
+    render.plot, LTTB is used as the path doubles back.'''
+    import matplotlib.pyplot as plt
+    if isinstance(lat, Track):
+        lat, lon = lat.lat, lat.lon
     #print('Plotting track')
-    plt.figure(figsize=(10,6))
+    fig = plt.figure(figsize=(10,6))
     # Is necessary to not have scientific notation and offset
     #plt.ticklabel_format(useOffset=False, style='plain')
     plt.ticklabel_format(useOffset=False)
-    plt.plot(lon, lat)
+    render.plot(plt.gca(), lon, lat, decimation=decimation)
     plt.title(title)
     plt.xlabel('longitude, deg')
     plt.ylabel('latitude, deg')
-    plt.show()
+    render.show_or_save(fig, file_name)
 
-def plot_speed_hr(time, speed, hr, avg_speed=None, max_speed=5.0, title='Speed and Heart Rate vs Time'):
-    '''Plots speed and HR. Also plots avg_speed if given.'''
-    if(avg_speed):
-        avg_speed_array = []
-        lenSpeed = len(speed)
-        for i in range(lenSpeed):
-            avg_speed_array.append(avg_speed)
+def plot_speed_hr(time, speed, hr=None, avg_speed=None, max_speed=5.0, title='Speed and Heart Rate vs Time',
+        file_name=None, decimation=render.DEFAULT_DECIMATION):
+    '''Plots speed and HR. Also plots avg_speed if given. time may be a Track,
+    in which case hr is taken from it and its local time is plotted. If
+    file_name is given the plot is saved there instead of shown. decimation
+    is as for render.plot.'''
+    import matplotlib.pyplot as plt
+    if isinstance(time, Track):
+        if hr is None:
+            hr = time.hr
+        time = time.local_time()
     fig = plt.figure(figsize=(10,6))
     plt.ticklabel_format(useOffset=False)
-    plt.plot(time, speed, 'dodgerblue', label='speed')
+    render.plot(plt.gca(), time, speed, 'dodgerblue', label='speed', decimation=decimation)
     if avg_speed:
-        plt.plot(time, avg_speed_array, 'mediumblue', label=f'avg speed ({avg_speed:.1f} mph)')
+        plt.axhline(avg_speed, color='mediumblue', label=f'avg speed ({avg_speed:.1f} mph)')
     plt.title(title)
     plt.xlabel('Time (dd hh:mm)')
     plt.ylabel('Speed, mph')
     plt.ylim(0, max_speed)
     # HR
-    max_hr = max(hr)
+    max_hr = max(hr) if len(hr) else 0
     if max_hr != 0:
         ax2 = plt.gca().twinx()
-        ax2.plot(time, hr, 'red', label='hr')
+        render.plot(ax2, time, hr, 'red', label='hr', decimation=decimation)
         ax2.set_ylabel('HR, bpm');
         ax2.set_ylim(0, round(max_hr + 10))
     # Manually set figure legend (owing to two axes)
@@ -214,64 +285,45 @@ def plot_speed_hr(time, speed, hr, avg_speed=None, max_speed=5.0, title='Speed a
     fig.legend(loc='lower left', framealpha=0.6, bbox_to_anchor=(0,0),
               bbox_transform=ax.transAxes)
     plt.tight_layout()
-    plt.show()
+    render.show_or_save(fig, file_name)
 
-def plot_speed_hr_1(time, speed, hr, avg_speed=None, max_speed=5.0, title='Speed vs Time'):
+def plot_speed_hr_1(time, speed, hr=None, avg_speed=None, max_speed=5.0, title='Speed vs Time',
+        file_name=None, decimation=render.DEFAULT_DECIMATION):
     '''Plots speed and HR. Calculates moving averages for speed.
-    Also plots avg_speed if given.'''
-    if(avg_speed):
-        avg_speed_array = []
-        lenSpeed = len(speed)
-        for i in range(lenSpeed):
-            avg_speed_array.append(avg_speed)
-    # Moving average 1
-    moving_avg = []
+    Also plots avg_speed if given. time may be a Track, in which case hr is
+    taken from it and its local time is plotted. If file_name is given the
+    plot is saved there instead of shown. decimation is as for render.plot.'''
+    import matplotlib.pyplot as plt
+    if isinstance(time, Track):
+        if hr is None:
+            hr = time.hr
+        time = time.local_time()
+    # Moving averages, both found in one pass
     window_size = 5
-    for i in range(lenSpeed):
-        if i == 0:
-             window_average = 0
-        elif i == 1:
-            window_average = speed[0]
-        elif i < window_size:
-            this_window = speed[0 : i]
-            window_average = sum(this_window) / (i + 1)
-        else:
-            this_window = speed[i - window_size: i]
-            window_average = sum(this_window) / window_size
-        moving_avg.append(window_average)
-
-    # Moving average 2
-    moving_avg2 = []
     window_size2 = 60
-    for i in range(lenSpeed):
-        if i == 0:
-             window_average = 0
-        elif i == 1:
-            window_average = speed[0]
-        elif i < window_size2:
-            this_window = speed[0 : i]
-            window_average = sum(this_window) / (i + 1)
-        else:
-            this_window = speed[i - window_size2: i]
-            window_average = sum(this_window) / window_size2
-        moving_avg2.append(window_average)
+    averages = rolling.rolling_stats(speed, [window_size, window_size2])
+    moving_avg = averages[window_size]['mean']
+    moving_avg2 = averages[window_size2]['mean']
 
     fig = plt.figure(figsize=(10,6))
     plt.ticklabel_format(useOffset=False)
-    plt.plot(time, speed, 'lightskyblue', label='speed')
-    plt.plot(time, moving_avg, 'dodgerblue', label=f'moving_average({window_size})')
-    #plt.plot(time, moving_avg2, 'yellow', label=f'moving_average({window_size2})')
+    ax = plt.gca()
+    render.plot(ax, time, speed, 'lightskyblue', label='speed', decimation=decimation)
+    render.plot(ax, time, moving_avg, 'dodgerblue', label=f'moving_average({window_size})',
+        decimation=decimation)
+    #render.plot(ax, time, moving_avg2, 'yellow', label=f'moving_average({window_size2})',
+    #    decimation=decimation)
     if avg_speed:
-        plt.plot(time, avg_speed_array, 'mediumblue', label=f'avg speed ({avg_speed:.1f} mph)')
+        plt.axhline(avg_speed, color='mediumblue', label=f'avg speed ({avg_speed:.1f} mph)')
     plt.title(title)
     plt.xlabel('Time (dd hh:mm)')
     plt.ylabel('Speed, mph')
     plt.ylim(0, max_speed)
     # HR
-    max_hr = max(hr)
+    max_hr = max(hr) if len(hr) else 0
     if max_hr != 0:
         ax2 = plt.gca().twinx()
-        ax2.plot(time, hr, 'red', label='hr')
+        render.plot(ax2, time, hr, 'red', label='hr', decimation=decimation)
         ax2.set_ylabel('HR, bpm');
         ax2.set_ylim(0, round(max_hr + 10))
     # Manually set figure legend (owing to two axes)
@@ -279,40 +331,53 @@ def plot_speed_hr_1(time, speed, hr, avg_speed=None, max_speed=5.0, title='Speed
     fig.legend(loc='lower left', framealpha=0.6, bbox_to_anchor=(0,0),
               bbox_transform=ax.transAxes)
     plt.tight_layout()
-    plt.show()
+    render.show_or_save(fig, file_name)
 
 def main():
     # Set prompt to use default filename or prompt with a FileDialog
     prompt = True
+    # Set use_cache to keep the parsed tracks in the on-disk cache
+    use_cache = True
+    cache = TrackCache() if use_cache else None
+    # Set plot_dir to write the plots there instead of showing them
+    plot_dir = None
+    if plot_dir:
+        render.use_agg()
+        os.makedirs(plot_dir, exist_ok=True)
     file_names = get_files(prompt=prompt)
     nFiles = len(file_names)
     for file_name in file_names:
         short_name = os.path.basename(file_name)
         print(f'{file_name=}')
-        gpx = get_gpx(file_name)
-        # Print gpx info
-        gpx_info = get_gpx_info(gpx);
-        print(f'GPX Information\n{gpx_info}')
-        lat, lon, ele, hr, time = get_gpx_data(gpx)
-        if len(lat) == 0:
-            print('No trackpoints found\n')
-            continue
-        # Print track info
-        track_info = get_track_info(lat, lon, ele, time)
-        print(f'Track Information\n{track_info}')
-        print()
-        #for i in range(10):
-        #    print(f'{i} {time[i]=} tz={time[i].tzinfo}')
-        #plot_track(lat, lon, title=file_name)
-        speed, total_dist, total_time, avg_speed = s.get_speed(lat, lon, time)
-        fs = len(time) / total_time
-        speed_proc = s.process_speed(time, speed)
-        info = f'{total_dist=:.2f} mi, {total_time=:.1f} min, avg_speed={avg_speed:.2f} mph'
-        if False:
-            s.plot_speed(time, speed, speed_proc, avg_speed,
-                title=f'Speed\n{file_name}\n{info}')
-        plot_speed_hr(time, speed_proc, hr, avg_speed,
-                title=f'Speed and Heart Rate\n{file_name}\n{info}')
+        with instrument.file(file_name):
+            if cache:
+                track, gpx_info = cache.load(file_name)
+            else:
+                gpx = get_gpx(file_name)
+                gpx_info = get_gpx_info(gpx);
+                track = get_gpx_track(gpx)
+            # Print gpx info
+            print(f'GPX Information\n{gpx_info}')
+            if len(track) == 0:
+                print('No trackpoints found\n')
+                continue
+            # Print track info
+            track_info = get_track_info(track)
+            print(f'Track Information\n{track_info}')
+            print()
+            #plot_track(track, title=file_name)
+            speed, total_dist, total_time, avg_speed = s.get_speed(track)
+            # Filter on a uniform grid at the recorded rate
+            fs = resampling.get_fs(track)
+            speed_proc = s.process_speed(track, speed, fs=fs, uniform=True, zero_phase=True)
+            info = f'{total_dist=:.2f} mi, {total_time=:.1f} min, avg_speed={avg_speed:.2f} mph'
+            if False:
+                s.plot_speed(track, speed, speed_proc, avg_speed,
+                    title=f'Speed\n{file_name}\n{info}')
+            plot_file_name = render.get_plot_file_name(plot_dir, file_name) if plot_dir else None
+            plot_speed_hr(track, speed_proc, avg_speed=avg_speed,
+                    title=f'Speed and Heart Rate\n{file_name}\n{info}',
+                    file_name=plot_file_name)
 
 if __name__ == "__main__":
     main()
@@ -1,17 +1,28 @@
 ''' GPX routines.
 Based on https://towardsdatascience.com/how-tracking-apps-analyse-your-gps-data-a-hands-on-tutorial-in-python-756d4db6715d
+
+The DataFrame is made in one step from the columns of a Track (see
+track.py), with float64 lat, lon, and ele, time as datetime64[ns, tz] in
+the track timezone, and hr as nullable Int16, NA where missing. The
+distance, time delta, and speed columns are then added with array
+operations.
 '''
 
 import numpy as np
 import matplotlib.pyplot as plt
 import gpxpy
-from geopy import distance
 
 import datetime
 from math import sqrt, floor
 
 import pandas as pd
-import haversine
+
+import enu
+import gpx_stream
+import py_gps
+
+MI_PER_M = 0.000621371
+SEC_PER_HR = 3600
 
 def prompt_for_file_name():
     # Prompt for the file name
@@ -50,15 +61,33 @@ def get_gpx_data(prompt=True):
             print(f'    Number of track points: {n_trkpt}')
     return file_name, gpx
 
+def get_dataframe(track):
+    '''Returns a DataFrame with lon, lat, ele, time, hr, and seg (the segment
+    number) columns for a Track. The arrays are used as they are where the
+    dtype allows, without going through Python objects.'''
+    # A column has one timezone, that of the first track
+    tz = track.tz_names()[0] or 'UTC'
+    time = pd.DatetimeIndex(track.datetime64).tz_localize('UTC').tz_convert(tz)
+    hr = pd.array(track.hr.astype(np.int16), dtype='Int16')
+    hr[track.hr == 0] = pd.NA
+    return pd.DataFrame({
+        'lon': track.lon,
+        'lat': track.lat,
+        'ele': track.ele.astype(np.float64),
+        'time': time,
+        'hr': hr,
+        'seg': track.segment_ids(),
+    }, copy=False)
+
+def read_dataframe(file_name):
+    '''Returns the get_dataframe DataFrame for a GPX file, read with
+    gpx_stream.read_track.'''
+    return get_dataframe(gpx_stream.read_track(file_name))
+
 def get_data(gpx):
-        # Use DataFrame
-        print('Creating DataFrame')
-        data = gpx.tracks[0].segments[0].points
-        df = pd.DataFrame(columns=['lon', 'lat', 'ele', 'time'])
-        for point in data:
-            df = df.append({'lon': point.longitude, 'lat' : point.latitude,
-                'ele' : point.elevation, 'time' : point.time}, ignore_index=True)
-        return df
+    '''Returns the get_dataframe DataFrame for a parsed GPX file.'''
+    print('Creating DataFrame')
+    return get_dataframe(py_gps.get_gpx_track(gpx))
 
 def plot_track(df, title='GPX Track'):
     print('Plotting track')
@@ -84,34 +113,45 @@ def plot_speed(speed, time, title='Speed vs Time'):
     plt.ylabel('speed, mph')
     plt.show()
 
-def get_speed(data, df):
-    KM_PER_M = .001
-    MI_PER_M = 0.000621371
+def get_speed(data, df=None):
+    '''Adds the dist (m), time_dif (s), and speed (mph) columns for the step
+    from the previous point to the DataFrame passed as data. They are 0 for
+    the first point and for the first point of each segment. The distances
+    are found in the local projection of enu.py, each segment about its own
+    centroid, as for Track.xy.
+
+    The original get_speed(data, df) form, with data the gpxpy points, is
+    still taken. The points are not used, as df has them, and dist is also
+    added as dist_hav_2d, its original name.'''
     print('Getting speed')
-    time_dif = [0]
-    dist_hav_no_alt = [0]
-    speed = [0]
-    for index in range(len(data)):
-        if index == 0:
-            pass
-        else:
-            start = data[index - 1]
-            stop = data[index]
-            distance_hav_2d = haversine.haversine((start.latitude, start.longitude),
-                (stop.latitude, stop.longitude)) / MI_PER_M
-            dist_hav_no_alt.append(distance_hav_2d)
-            time_delta = (stop.time - start.time).total_seconds()
-            time_dif.append(time_delta)
-            if time_delta == 0:
-                cur_speed = 0
-            else:
-                cur_speed = distance_hav_2d / time_delta
-            speed.append(cur_speed)
-    df['dist_hav_2d'] = dist_hav_no_alt
+    original = df is not None
+    if not original:
+        df = data
+    lat = df['lat'].to_numpy()
+    lon = df['lon'].to_numpy()
+    n = len(df)
+    # Not across the gaps between segments
+    gap = np.flatnonzero(np.diff(df['seg'].to_numpy()) != 0) + 1 \
+        if 'seg' in df else np.empty(0, dtype=np.int64)
+    x, y = enu.get_xy(lat, lon, np.concatenate(([0], gap, [n])))
+    dist = np.zeros(n)
+    time_dif = np.zeros(n)
+    if n > 1:
+        dist[1:] = enu.get_step_lengths(lat, lon, x, y)
+        time_dif[1:] = df['time'].diff().dt.total_seconds().to_numpy()[1:]
+        dist[gap] = 0.
+        time_dif[gap] = 0.
+    speed = np.zeros(n)
+    moving = time_dif != 0
+    speed[moving] = dist[moving] * MI_PER_M / time_dif[moving] * SEC_PER_HR
+    df['dist'] = dist
+    if original:
+        df['dist_hav_2d'] = dist
     df['time_dif'] = time_dif
     df['speed'] = speed
-    print('Haversine 2D : ', dist_hav_no_alt[-1])
-    print('Total Time : ', floor(sum(time_dif) / 60),' min ', int(sum(time_dif) % 60),' sec ')
+    total_time = time_dif.sum()
+    print('Distance : ', dist.sum() * MI_PER_M, ' mi')
+    print('Total Time : ', floor(total_time / 60),' min ', int(total_time % 60),' sec ')
 
 def plot_speed(df, title='Speed'):
         print('Plotting speed')
@@ -123,10 +163,9 @@ def plot_speed(df, title='Speed'):
 
 def main():
     file_name, gpx = get_gpx_data(prompt=False)
-    data = gpx.tracks[0].segments[0].points
     df = get_data(gpx)
     #plot_track(df, title=file_name)
-    speed = get_speed(data, df)
+    get_speed(df)
     plot_speed(df, title=file_name)
     #print(f'{len(speed)=} {len(time)=}')
     #for i in range(10):
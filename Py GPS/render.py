@@ -0,0 +1,49 @@
+''' Plot rendering helpers.
+Series are decimated to the width of the figure in pixels before they are
+handed to matplotlib (see decimate.py), so the time to draw a plot does not
+grow with the length of the track. Plots can be written to PNG or SVG files
+instead of being shown, using the non-interactive Agg backend, so they can
+be made in batch on a machine without a display.
+'''
+
+import os
+
+import numpy as np
+
+import decimate
+
+FORMATS = ('png', 'svg')
+DEFAULT_DECIMATION = 'minmax'
+
+def use_agg():
+    '''Selects the Agg backend, which draws to files and needs no display.'''
+    import matplotlib
+    matplotlib.use('Agg')
+
+def get_pixel_width(fig):
+    '''Returns the width of the figure in pixels.'''
+    return max(int(fig.get_size_inches()[0] * fig.dpi), 1)
+
+def plot(ax, x, y, *args, decimation=DEFAULT_DECIMATION, **kwargs):
+    '''Plots y vs x on ax, like ax.plot, after decimating to the pixel width
+    of the figure. decimation is a decimate.METHODS name, or None to plot
+    all the points.'''
+    x = np.asarray(x)
+    y = np.asarray(y)
+    index = decimate.decimate_indices(x, y, get_pixel_width(ax.figure), decimation)
+    return ax.plot(x[index], y[index], *args, **kwargs)
+
+def get_plot_file_name(plot_dir, file_name, suffix='', format='png'):
+    '''Returns the plot file name in plot_dir for the GPX file file_name.'''
+    base = os.path.splitext(os.path.basename(file_name))[0]
+    return os.path.join(plot_dir, f'{base}{suffix}.{format}')
+
+def show_or_save(fig, file_name=None):
+    '''Shows the figure, or if file_name is given saves it there and closes
+    it. The format is taken from the extension of file_name.'''
+    import matplotlib.pyplot as plt
+    if file_name:
+        fig.savefig(file_name)
+        plt.close(fig)
+    else:
+        plt.show()
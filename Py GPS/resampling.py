@@ -0,0 +1,198 @@
+''' Resampling to a uniform time grid.
+GPX points are not evenly spaced: the recording interval varies and there
+are dropouts and pauses. Filters and FFTs assume evenly spaced samples at a
+known rate, so series such as speed, hr, and ele are put on a uniform grid
+first, processed there, and the results mapped back to the original times.
+
+The grid is made separately for each run of points: a run ends at a segment
+boundary or where the time between points is more than max_gap, so the grid
+never fills in a pause or a dropout. Each run starts the filters again, so
+max_gap is long enough, DEFAULT_MAX_GAP, that short dropouts are filled in
+instead. Points without a time (NaT) are left out of the grid and get NaN
+when the values are mapped back. Within a run the values are found with
+linear interpolation, or with hold (the last value), which suits values that
+are only updated now and then, such as hr.
+'''
+
+import numpy as np
+
+from track import Track, NAT
+import rolling
+
+NS_PER_SEC = 1000000000
+METHODS = ('linear', 'hold')
+# Default max_gap, s
+DEFAULT_MAX_GAP = 30.
+# Default max_gap for slow rates, in sample intervals
+DEFAULT_GAP_FACTOR = 5.
+
+def get_time_ns(time):
+    '''Returns the times as an int64 array of ns. An integer array is taken
+    to be ns already, otherwise see rolling.get_time_ns.'''
+    if isinstance(time, np.ndarray) and time.dtype.kind in 'iu':
+        return time.astype(np.int64, copy=False)
+    return rolling.get_time_ns(time)
+
+def get_fs(time, seg_offsets=None):
+    '''Returns the sample rate, Hz, from the median interval between points
+    within the segments, ignoring repeated times. time may be a Track.'''
+    if isinstance(time, Track):
+        if seg_offsets is None:
+            seg_offsets = time.seg_offsets
+    time_ns = get_time_ns(time)
+    if len(time_ns) < 2:
+        return 1.
+    dt = np.diff(time_ns).astype(np.float64)
+    if seg_offsets is not None:
+        # Not the steps into a new segment
+        starts = np.asarray(seg_offsets)[1:-1]
+        dt[starts[(starts > 0) & (starts < len(time_ns))] - 1] = 0.
+    dt = dt[dt > 0]
+    if len(dt) == 0:
+        return 1.
+    return NS_PER_SEC / float(np.median(dt))
+
+def get_runs(time_ns, seg_offsets=None, max_gap=None):
+    '''Returns the run offsets: the start of each run plus the number of
+    points. Runs end at segment boundaries and at gaps of more than max_gap
+    s.'''
+    n = len(time_ns)
+    bounds = [np.array([0, n])]
+    if seg_offsets is not None:
+        bounds.append(np.asarray(seg_offsets, dtype=np.int64))
+    if max_gap is not None and n > 1:
+        gaps = np.flatnonzero(np.diff(time_ns) > max_gap * NS_PER_SEC) + 1
+        bounds.append(gaps)
+    return np.unique(np.concatenate(bounds))
+
+class Resampler:
+    '''Maps series between the original times and a uniform grid.
+
+        Parameters
+        ----------
+        time : datetime64 array, Track, or sequence of datetimes
+            The original times, which should increase within each segment.
+        fs : float
+            Sample rate of the grid, Hz.
+            default: get_fs(time)
+        max_gap : float
+            Longest time between points that is interpolated across, s.
+            default: the larger of DEFAULT_MAX_GAP and DEFAULT_GAP_FACTOR / fs
+        seg_offsets : array_like
+            Segment offsets as for Track. Taken from time if it is a Track.
+            default: None
+
+        Attributes
+        ----------
+        grid : numpy.ndarray of int64
+            The grid times, ns since the epoch.
+        grid_offsets : numpy.ndarray of int64
+            Start of each run in grid plus its length.
+        valid : numpy.ndarray of int64
+            Indices of the original points that have a time.
+        run_offsets : numpy.ndarray of int64
+            Start of each run in the valid points plus the number of valid
+            points.
+    '''
+
+    def __init__(self, time, fs=None, max_gap=None, seg_offsets=None):
+        if isinstance(time, Track) and seg_offsets is None:
+            seg_offsets = time.seg_offsets
+        time_ns = get_time_ns(time)
+        self.n = len(time_ns)
+        self.valid = np.flatnonzero(time_ns != NAT)
+        if len(self.valid) < self.n:
+            # Leave out the points without a time
+            if seg_offsets is not None:
+                seg_offsets = np.searchsorted(self.valid, seg_offsets)
+            time_ns = time_ns[self.valid]
+        self.time_ns = time_ns
+        self.fs = fs if fs else get_fs(self.time_ns, seg_offsets)
+        self.max_gap = max_gap if max_gap is not None \
+            else max(DEFAULT_MAX_GAP, DEFAULT_GAP_FACTOR / self.fs)
+        self.run_offsets = get_runs(self.time_ns, seg_offsets, self.max_gap)
+        step = NS_PER_SEC / self.fs
+        grids = []
+        sizes = []
+        for start, end in zip(self.run_offsets[:-1], self.run_offsets[1:]):
+            t0 = self.time_ns[start]
+            n = int((self.time_ns[end - 1] - t0) // step) + 1
+            grids.append(t0 + np.round(np.arange(n) * step).astype(np.int64))
+            sizes.append(n)
+        self.grid = np.concatenate(grids) if grids else np.empty(0, dtype=np.int64)
+        self.grid_offsets = np.concatenate(([0], np.cumsum(sizes))).astype(np.int64)
+        self._forward = self.get_weights(self.time_ns, self.run_offsets,
+            self.grid, self.grid_offsets)
+        self._backward = self.get_weights(self.grid, self.grid_offsets,
+            self.time_ns, self.run_offsets)
+
+    @staticmethod
+    def get_weights(src, src_offsets, dst, dst_offsets):
+        '''Returns, for each dst time, the index of the src point at or
+        before it in the same run and the linear weight of the next point.'''
+        left = np.empty(len(dst), dtype=np.int64)
+        weight = np.zeros(len(dst))
+        for s0, s1, d0, d1 in zip(src_offsets[:-1], src_offsets[1:],
+                dst_offsets[:-1], dst_offsets[1:]):
+            t = src[s0:s1]
+            i = np.searchsorted(t, dst[d0:d1], side='right') - 1
+            i = np.clip(i, 0, len(t) - 1)
+            j = np.minimum(i + 1, len(t) - 1)
+            span = (t[j] - t[i]).astype(np.float64)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                w = np.where(span > 0, (dst[d0:d1] - t[i]) / span, 0.)
+            left[d0:d1] = i + s0
+            weight[d0:d1] = np.clip(w, 0., 1.)
+        return left, weight
+
+    @staticmethod
+    def interpolate(values, left, weight, method):
+        values = np.asarray(values, dtype=np.float64)
+        if method == 'hold':
+            return values[left]
+        if method != 'linear':
+            raise ValueError(f'Unknown resampling method: {method}')
+        right = np.minimum(left + 1, len(values) - 1)
+        # Where the weight is 0 the next value is not used, even if NaN
+        return np.where(weight > 0, values[left] + weight * (values[right] - values[left]),
+            values[left])
+
+    def resample(self, values, method='linear'):
+        '''Returns the values at the original times put on the grid. NaN
+        values, e.g. the speed next to a point without a time, are first
+        filled in linearly from the values on either side, so they do not
+        spread through a filter.'''
+        if len(self.grid) == 0:
+            return np.empty(0)
+        values = np.asarray(values, dtype=np.float64)
+        if len(self.valid) < self.n:
+            values = values[self.valid]
+        missing = np.isnan(values)
+        if missing.any() and not missing.all():
+            values = values.copy()
+            values[missing] = np.interp(self.time_ns[missing], self.time_ns[~missing],
+                values[~missing])
+        return self.interpolate(values, *self._forward, method)
+
+    def to_original(self, values, method='linear'):
+        '''Returns values on the grid mapped back to the original times,
+        NaN for the points without a time.'''
+        if len(self.time_ns) == 0:
+            return np.full(self.n, np.nan)
+        result = self.interpolate(values, *self._backward, method)
+        if len(self.valid) < self.n:
+            full = np.full(self.n, np.nan)
+            full[self.valid] = result
+            result = full
+        return result
+
+    def apply(self, function, values, method='linear'):
+        '''Resamples values, calls function(run values) for each run of the
+        grid, and returns the results mapped back to the original times. Use
+        this for filters, so each run is filtered separately.'''
+        grid_values = self.resample(values, method)
+        result = np.empty_like(grid_values)
+        for start, end in zip(self.grid_offsets[:-1], self.grid_offsets[1:]):
+            if end > start:
+                result[start:end] = function(grid_values[start:end])
+        return self.to_original(result)
@@ -0,0 +1,189 @@
+''' Rolling statistics.
+Moving mean, std, min, and max without a Python loop over the points. The
+mean and std use cumulative sums. The min and max of sample windows use
+scipy.ndimage.minimum_filter1d and maximum_filter1d, and those of duration
+windows the min and max of each power-of-two run of points, so any window
+is the min or max of two overlapping runs. The runs of each length are made
+from those half as long, one length at a time, so this takes O(n log w)
+time, for windows of at most w points, but only O(n) memory. Windows can be
+a number of samples or a time duration. GPX points are not evenly spaced,
+so a duration window (e.g. 30 s or 5 min) is usually what is wanted.
+
+Duration windows do not reach back past a point whose time is earlier than
+the one before it, e.g. where tracks were merged out of order, or past a
+point without a time, whose window is just itself.
+
+Each window ends at, and includes, the current point. This is not what the
+moving averages in plot_speed_hr_1 and process_speed did before, which used
+speed[i - w:i], without the current point, and divided by i + 1 near the
+start, so the averages are now one sample earlier and are right near the
+start. Near the start the window holds the points there are, and the
+statistics are over those points.
+
+Several windows can be computed at once. The cumulative sums and the runs
+are then only made once.
+'''
+
+import datetime
+
+import numpy as np
+
+from track import Track, NAT, datetime_to_ns
+
+STATS = ('mean', 'std', 'min', 'max')
+
+def is_duration(window):
+    '''Returns whether window is a time duration rather than a sample count.'''
+    return isinstance(window, (datetime.timedelta, np.timedelta64))
+
+def get_time_ns(time):
+    '''Returns the times as an int64 array of nanoseconds. time may be a
+    datetime64 array, a Track, or a sequence of datetimes.'''
+    if isinstance(time, Track):
+        return time.time
+    if isinstance(time, np.ndarray) and time.dtype.kind == 'M':
+        return time.astype('datetime64[ns]').view(np.int64)
+    return np.array([datetime_to_ns(t) for t in time], dtype=np.int64)
+
+def get_time_runs(time_ns):
+    '''Returns the offsets of the runs of non-decreasing times, as for
+    Track.seg_offsets. Points without a time are runs of their own.'''
+    n = len(time_ns)
+    nat = time_ns == NAT
+    breaks = np.flatnonzero((np.diff(time_ns) < 0) | nat[1:] | nat[:-1]) + 1
+    return np.concatenate(([0], breaks, [n])).astype(np.int64)
+
+def get_starts(n, window, time_ns=None):
+    '''Returns the index of the first point in the window ending at each
+    point.'''
+    if is_duration(window):
+        if time_ns is None:
+            raise ValueError('time is needed for a duration window')
+        duration = int(np.timedelta64(window, 'ns').astype(np.int64))
+        if duration <= 0:
+            raise ValueError(f'Invalid window: {window}')
+        time_ns = np.asarray(time_ns, dtype=np.int64)
+        starts = np.arange(n)
+        runs = get_time_runs(time_ns)
+        for start, end in zip(runs[:-1], runs[1:]):
+            if time_ns[start] == NAT:
+                continue
+            # Points with t > t_i - duration
+            t = time_ns[start:end]
+            starts[start:end] = start + np.searchsorted(t, t - duration, side='right')
+        return starts
+    if window < 1:
+        raise ValueError(f'Invalid window: {window}')
+    return np.maximum(np.arange(n) - window + 1, 0)
+
+def get_levels(starts):
+    '''Returns the run level, floor(log2(length)), of each window.'''
+    lengths = np.arange(len(starts)) - starts + 1
+    # frexp gives length = m * 2**e with m in [0.5, 1)
+    return np.frexp(lengths)[1] - 1
+
+def rolling_minmax(values, starts_list):
+    '''Returns lists of the rolling min and max arrays for each array of
+    window starts. The runs are made once for all the windows.'''
+    n = len(values)
+    if n == 0 or not starts_list:
+        return ([np.empty(0) for starts in starts_list],
+            [np.empty(0) for starts in starts_list])
+    levels_list = [get_levels(starts) for starts in starts_list]
+    n_levels = max(int(levels.max()) for levels in levels_list) + 1
+    result = []
+    for reduce in (np.minimum, np.maximum):
+        outputs = [np.empty(n) for starts in starts_list]
+        # runs[i] is reduce over values[i:i + 2**k] where the run fits
+        runs = np.array(values, dtype=np.float64)
+        for k in range(n_levels):
+            if k > 0:
+                span = 1 << (k - 1)
+                reduce(runs[:n - span], runs[span:], out=runs[:n - span])
+            for output, starts, levels in zip(outputs, starts_list, levels_list):
+                # Two runs of length 2**k, one from the start and one to the end
+                ends = np.flatnonzero(levels == k)
+                output[ends] = reduce(runs[starts[ends]], runs[ends - (1 << k) + 1])
+        result.append(outputs)
+    return result[0], result[1]
+
+def rolling_filter_minmax(values, window):
+    '''Returns the rolling min and max for a sample window. The origin
+    puts the filter window at [i - window + 1, i], and the nearest mode
+    repeats the first value, which does not change the min or max.'''
+    from scipy.ndimage import maximum_filter1d, minimum_filter1d
+    origin = (window - 1) // 2
+    return (minimum_filter1d(values, window, mode='nearest', origin=origin),
+        maximum_filter1d(values, window, mode='nearest', origin=origin))
+
+def rolling_stats(values, windows, time=None, stats=('mean',)):
+    '''Returns rolling statistics of values for one or more windows.
+
+        Parameters
+        ----------
+        values : array_like
+            The values, e.g. speed.
+        windows : int, timedelta, or list of them
+            Window sizes. An int is a number of samples, a datetime.timedelta
+            or numpy.timedelta64 is a time duration.
+        time : datetime64 array, Track, or sequence of datetimes
+            The times of the values. Needed for duration windows.
+            default: None
+        stats : tuple of str
+            The statistics to compute, from STATS.
+            default: ('mean',)
+
+        Returns
+        ------
+        return : dict
+            {window: {stat: array}} for each window.
+    '''
+    for stat in stats:
+        if stat not in STATS:
+            raise ValueError(f'Unknown statistic: {stat}')
+    if not isinstance(windows, (list, tuple)):
+        windows = [windows]
+    values = np.asarray(values, dtype=np.float64)
+    n = len(values)
+    time_ns = None
+    if time is not None and any(is_duration(window) for window in windows):
+        time_ns = get_time_ns(time)
+    index = np.arange(n)
+    starts_list = [get_starts(n, window, time_ns) for window in windows]
+    result = {window: {} for window in windows}
+    if 'mean' in stats or 'std' in stats:
+        # Shift by the mean to keep the sums of squares accurate
+        offset = values.mean() if n else 0.
+        shifted = values - offset
+        csum = np.concatenate(([0.], np.cumsum(shifted)))
+        csum2 = np.concatenate(([0.], np.cumsum(shifted * shifted)))
+        for window, starts in zip(windows, starts_list):
+            count = index + 1 - starts
+            total = csum[index + 1] - csum[starts]
+            mean = total / count
+            if 'mean' in stats:
+                result[window]['mean'] = mean + offset
+            if 'std' in stats:
+                var = (csum2[index + 1] - csum2[starts]) / count - mean * mean
+                # Rounding leaves a little variance for a single point
+                var[count == 1] = 0.
+                result[window]['std'] = np.sqrt(np.maximum(var, 0.))
+    if 'min' in stats or 'max' in stats:
+        durations = [(window, starts) for window, starts in zip(windows, starts_list)
+            if is_duration(window)]
+        mins, maxs = rolling_minmax(values, [starts for window, starts in durations])
+        minmax = {window: (min_vals, max_vals)
+            for (window, starts), min_vals, max_vals in zip(durations, mins, maxs)}
+        for window in windows:
+            if not is_duration(window):
+                minmax[window] = rolling_filter_minmax(values, window) if n \
+                    else (np.empty(0), np.empty(0))
+            if 'min' in stats:
+                result[window]['min'] = minmax[window][0]
+            if 'max' in stats:
+                result[window]['max'] = minmax[window][1]
+    return result
+
+def rolling_mean(values, window, time=None):
+    '''Returns the moving average of values over window. See rolling_stats.'''
+    return rolling_stats(values, window, time)[window]['mean']
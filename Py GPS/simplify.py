@@ -0,0 +1,208 @@
+''' Track simplification.
+Reduces a track to the points needed for its shape, for plotting and for
+storing routes. Two methods are available:
+
+    dp  Douglas-Peucker. Keeps the points needed so that no removed point is
+        farther than tolerance meters from the simplified line.
+    vw  Visvalingam-Whyatt. Repeatedly removes the point that makes the
+        smallest triangle with its neighbors until every triangle is at least
+        tolerance**2 square meters. This gives smoother shapes.
+
+Both work on lat/lon arrays, e.g. from get_gpx_data, or a Track, and return
+a boolean mask of the points to keep, so the time, ele, and hr arrays can be
+reduced the same way (for a Track, track[mask] does this and keeps the
+segments). The first and last point of each segment are always kept. The
+work is done in meters in the local projection of enu.py, each segment about
+its own centroid, which a Track keeps, so simplifying a Track again does no
+trigonometry. Points too far from their segment to be projected, e.g.
+glitches on the other side of the earth, are kept, and the points between
+them are simplified separately.
+
+Neither method recurses. Douglas-Peucker uses an explicit stack of ranges,
+with each step done with NumPy over the points. Visvalingam-Whyatt keeps the
+triangle areas in a heap and the points left in a linked list, so removing
+a point only updates the areas of its two neighbors, and a segment of n
+points takes O(n log n).
+'''
+
+import heapq
+
+import numpy as np
+
+from track import Track
+import enu
+
+METHODS = ('dp', 'vw')
+
+def to_xy(lat, lon=None, seg_offsets=None):
+    '''Returns x (east) and y (north) in meters with each segment projected
+    about its centroid, as for enu.get_xy. lat may be a Track, in which case
+    its cached Track.xy is returned.'''
+    if isinstance(lat, Track):
+        return lat.xy
+    return enu.get_xy(lat, lon, seg_offsets)
+
+def segment_distance(x, y, x0, y0, x1, y1):
+    '''Returns the distances of the points x, y from the line segments from
+    x0, y0 to x1, y1. The arguments may be arrays or scalars.'''
+    dx = x1 - x0
+    dy = y1 - y0
+    length2 = dx * dx + dy * dy
+    with np.errstate(invalid='ignore', divide='ignore'):
+        t = np.where(length2 > 0, ((x - x0) * dx + (y - y0) * dy) / length2, 0.)
+    t = np.clip(t, 0., 1.)
+    return np.hypot(x - (x0 + t * dx), y - (y0 + t * dy))
+
+def douglas_peucker_xy(x, y, tolerance, mask=None, start=0, end=None):
+    '''Marks in mask the points between start and end (inclusive) that
+    Douglas-Peucker keeps for x, y in meters. Returns mask.'''
+    n = len(x)
+    if mask is None:
+        mask = np.zeros(n, dtype=bool)
+    if end is None:
+        end = n - 1
+    if end < start:
+        return mask
+    mask[start] = True
+    mask[end] = True
+    stack = [(start, end)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        dist = segment_distance(x[first + 1:last], y[first + 1:last],
+            x[first], y[first], x[last], y[last])
+        i = int(np.argmax(dist))
+        if dist[i] > tolerance:
+            i += first + 1
+            mask[i] = True
+            stack.append((first, i))
+            stack.append((i, last))
+    return mask
+
+def triangle_areas(x, y, index):
+    '''Returns the areas of the triangles each point of index makes with the
+    points before and after it in index. The end points get inf.'''
+    areas = np.full(len(index), np.inf)
+    if len(index) > 2:
+        xa, ya = x[index[:-2]], y[index[:-2]]
+        xb, yb = x[index[1:-1]], y[index[1:-1]]
+        xc, yc = x[index[2:]], y[index[2:]]
+        areas[1:-1] = .5 * np.abs((xb - xa) * (yc - ya) - (xc - xa) * (yb - ya))
+    return areas
+
+def visvalingam_whyatt_xy(x, y, min_area, mask=None, start=0, end=None):
+    '''Marks in mask the points between start and end (inclusive) that
+    Visvalingam-Whyatt keeps for x, y in meters with min_area in square
+    meters. Returns mask.'''
+    n = len(x)
+    if mask is None:
+        mask = np.zeros(n, dtype=bool)
+    if end is None:
+        end = n - 1
+    if end < start:
+        return mask
+    # Points are numbered from start
+    x = np.asarray(x[start:end + 1], dtype=np.float64)
+    y = np.asarray(y[start:end + 1], dtype=np.float64)
+    m = len(x)
+    area = triangle_areas(x, y, np.arange(m)).tolist()
+    xs, ys = x.tolist(), y.tolist()
+    # Heap of (area, point) for the points that may be removed. Entries
+    # whose area has changed since they were pushed are skipped. Ties go to
+    # the first point.
+    heap = [(value, i) for i, value in enumerate(area) if value < min_area]
+    heapq.heapify(heap)
+    # The points before and after each point still in the track
+    prev = list(range(-1, m - 1))
+    next = list(range(1, m + 1))
+    keep = [True] * m
+    while heap:
+        value, i = heapq.heappop(heap)
+        if not keep[i] or value != area[i]:
+            continue
+        keep[i] = False
+        a, c = prev[i], next[i]
+        next[a] = c
+        prev[c] = a
+        # The neighbors now make triangles with each other. The end points
+        # keep inf.
+        for b in (a, c):
+            if 0 < b < m - 1:
+                p, q = prev[b], next[b]
+                value = .5 * abs((xs[b] - xs[p]) * (ys[q] - ys[p])
+                    - (xs[q] - xs[p]) * (ys[b] - ys[p]))
+                area[b] = value
+                if value < min_area:
+                    heapq.heappush(heap, (value, b))
+    mask[start:end + 1] |= np.array(keep, dtype=bool)
+    return mask
+
+def simplify(lat, lon=None, tolerance=5., method='dp', seg_offsets=None):
+    '''Returns a boolean mask of the points to keep.
+
+        Parameters
+        ----------
+        lat, lon : array_like
+            The points, deg. lat may be a Track, in which case lon is not
+            used and the segments are taken from it.
+        tolerance : float
+            For dp, the largest distance of a removed point from the
+            simplified track, m. For vw, points are removed while their
+            triangle is smaller than tolerance**2, m^2.
+            default: 5
+        method : str
+            'dp' or 'vw'.
+            default: 'dp'
+        seg_offsets : array_like
+            Segment offsets as for Track. Each segment is simplified
+            separately and keeps its end points.
+            default: None
+
+        Returns
+        ------
+        return : ndarray of bool
+            True for the points to keep.
+    '''
+    if isinstance(lat, Track) and seg_offsets is None:
+        seg_offsets = lat.seg_offsets
+    if method == 'dp':
+        function = douglas_peucker_xy
+        threshold = tolerance
+    elif method == 'vw':
+        function = visvalingam_whyatt_xy
+        threshold = tolerance * tolerance
+    else:
+        raise ValueError(f'Unknown simplification method: {method}')
+    x, y = to_xy(lat, lon, seg_offsets)
+    n = len(x)
+    if seg_offsets is None:
+        seg_offsets = [0, n]
+    # Points that could not be projected are kept and split the segments
+    mask = ~np.isfinite(x)
+    for start, end in zip(seg_offsets[:-1], seg_offsets[1:]):
+        cuts = np.flatnonzero(mask[start:end]) + start
+        for run_start, run_end in zip(np.concatenate(([start], cuts + 1)),
+                np.concatenate((cuts, [end]))):
+            if run_end > run_start:
+                function(x, y, threshold, mask, int(run_start), int(run_end) - 1)
+    return mask
+
+def get_max_error(lat, lon, mask):
+    '''Returns the largest distance, m, of the points from the track of the
+    points kept by mask. Each point is measured against the kept points
+    before and after it. lat may be a Track, with lon None.'''
+    x, y = to_xy(lat, lon)
+    kept = np.flatnonzero(mask)
+    if len(x) == 0 or len(kept) == 0:
+        return 0.
+    index = np.arange(len(x))
+    # The kept points on either side of each point
+    after = np.minimum(np.searchsorted(kept, index, side='left'), len(kept) - 1)
+    before = np.maximum(np.searchsorted(kept, index, side='right') - 1, 0)
+    k0 = kept[before]
+    k1 = kept[after]
+    dist = segment_distance(x, y, x[k0], y[k0], x[k1], y[k1])
+    # Points that could not be projected are kept, and not measured
+    dist = dist[np.isfinite(dist)]
+    return float(dist.max()) if len(dist) else 0.
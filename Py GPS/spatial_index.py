@@ -0,0 +1,449 @@
+''' Spatial index over a library of GPX files.
+Answers "which activities passed through this area" without reading the
+files. For each file the index keeps the bounding box of each track and the
+pieces of the track simplified with Douglas-Peucker (see simplify.py), each
+with its segment, point indices, and times. The pieces are put in a grid of
+cells so a query only looks at the pieces near it, then each piece is tested
+exactly against the box or circle. Results are the matching time ranges of
+each file and segment, accurate to the simplification tolerance.
+
+The index is kept in a directory as a manifest (index.json), with the key
+of each file as for TrackCache, and the pieces as columns (index.npz).
+update only reads the files that are new or have changed, e.g.
+
+    python spatial_index.py update GPSLink/Polar
+    python spatial_index.py bbox 42.50 -83.70 42.55 -83.60
+    python spatial_index.py near 42.5329 -83.6386 200
+'''
+
+import argparse
+import datetime
+import json
+import os
+import sys
+
+import numpy as np
+
+import enu
+import simplify
+
+DEFAULT_INDEX_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'py_gps', 'index')
+# Version of the index format, an index with another version is rebuilt
+FORMAT_VERSION = 1
+# Simplification tolerance, m
+DEFAULT_TOLERANCE = 10.
+# Grid cell size, deg
+DEFAULT_CELL_SIZE = .01
+# Piece columns and their dtypes
+PIECE_COLUMNS = (('file_id', np.int32), ('trk', np.int32), ('seg', np.int32),
+    ('i0', np.int64), ('i1', np.int64), ('lat0', np.float64), ('lon0', np.float64),
+    ('lat1', np.float64), ('lon1', np.float64), ('t0', np.int64), ('t1', np.int64))
+M_PER_DEG = np.radians(1.) * enu.EARTH_RADIUS
+# Offset that makes the grid columns positive in the cell keys
+COL_OFFSET = 1 << 31
+# Pieces whose bounding box covers more cells than this, e.g. GPS glitches
+# that jump across the map, are kept in a list checked on every query
+# instead of in every cell
+MAX_PIECE_CELLS = 256
+
+def get_index_dir():
+    '''Returns the index directory, which may be set with PY_GPS_INDEX.'''
+    return os.environ.get('PY_GPS_INDEX', DEFAULT_INDEX_DIR)
+
+def load_track(file_name):
+    '''Reads the track for the index. The times are only needed in UTC.'''
+    import gpx_stream
+    return gpx_stream.read_track(file_name, timezone=False)
+
+def get_pieces(track, tolerance=DEFAULT_TOLERANCE):
+    '''Returns the pieces of the simplified track as a dict of columns,
+    without file_id. A segment with one point gives a piece of zero length.'''
+    mask = simplify.simplify(track, tolerance=tolerance)
+    kept = np.flatnonzero(mask)
+    seg = track.segment_ids()[kept]
+    same = seg[:-1] == seg[1:]
+    i0 = kept[:-1][same]
+    i1 = kept[1:][same]
+    # Segments with only one point kept
+    counts = np.bincount(seg, minlength=track.n_seg)
+    single = kept[counts[seg] == 1]
+    i0 = np.concatenate((i0, single))
+    i1 = np.concatenate((i1, single))
+    order = np.argsort(i0, kind='stable')
+    i0 = i0[order]
+    i1 = i1[order]
+    seg_ids = track.segment_ids()[i0]
+    trk_of_seg = np.repeat(np.arange(track.n_trk), np.diff(track.trk_offsets))
+    return {
+        'trk': trk_of_seg[seg_ids], 'seg': seg_ids, 'i0': i0, 'i1': i1,
+        'lat0': track.lat[i0], 'lon0': track.lon[i0],
+        'lat1': track.lat[i1], 'lon1': track.lon[i1],
+        't0': track.time[i0], 't1': track.time[i1],
+    }
+
+def get_bboxes(track):
+    '''Returns [lat_min, lon_min, lat_max, lon_max] for each track, None for
+    an empty one.'''
+    bboxes = []
+    bounds = track.seg_offsets[track.trk_offsets]
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        if end > start:
+            lat = track.lat[start:end]
+            lon = track.lon[start:end]
+            bboxes.append([float(np.nanmin(lat)), float(np.nanmin(lon)),
+                float(np.nanmax(lat)), float(np.nanmax(lon))])
+        else:
+            bboxes.append(None)
+    return bboxes
+
+def clip_segments(x0, y0, x1, y1, xmin, ymin, xmax, ymax):
+    '''Returns a mask of the segments that cross or are inside the box,
+    using Liang-Barsky clipping on all the segments at once.'''
+    dx = x1 - x0
+    dy = y1 - y0
+    t0 = np.zeros(len(x0))
+    t1 = np.ones(len(x0))
+    inside = np.ones(len(x0), dtype=bool)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for p, q in ((-dx, x0 - xmin), (dx, xmax - x0), (-dy, y0 - ymin), (dy, ymax - y0)):
+            inside &= ~((p == 0) & (q < 0))
+            r = q / p
+            t0 = np.where(p < 0, np.maximum(t0, r), t0)
+            t1 = np.where(p > 0, np.minimum(t1, r), t1)
+    return inside & (t0 <= t1)
+
+class SpatialIndex:
+    '''Persistent spatial index of GPX files.
+
+        Parameters
+        ----------
+        index_dir : str
+            Directory for the index.
+            default: get_index_dir()
+        tolerance : float
+            Simplification tolerance for the pieces, m.
+            default: DEFAULT_TOLERANCE
+        cell_size : float
+            Grid cell size, deg.
+            default: DEFAULT_CELL_SIZE
+    '''
+
+    def __init__(self, index_dir=None, tolerance=DEFAULT_TOLERANCE, cell_size=DEFAULT_CELL_SIZE):
+        self.index_dir = index_dir if index_dir else get_index_dir()
+        self.tolerance = tolerance
+        self.cell_size = cell_size
+        self.files = {}
+        self.next_id = 0
+        self.merged = {name: np.empty(0, dtype=dtype) for name, dtype in PIECE_COLUMNS}
+        # Pieces of the files added, and ids of the files removed, since the
+        # pieces were last merged
+        self.added = []
+        self.removed_ids = set()
+        self.grid = None  # Built when first needed
+        self.load()
+
+    @property
+    def pieces(self):
+        '''The pieces of all the files as a dict of columns. The files added
+        and removed since the last time are merged in one concatenation, so
+        adding many files is not quadratic.'''
+        if self.added or self.removed_ids:
+            parts = [self.merged] + self.added
+            pieces = {name: np.concatenate([part[name] for part in parts])
+                for name, dtype in PIECE_COLUMNS}
+            if self.removed_ids:
+                keep = ~np.isin(pieces['file_id'], list(self.removed_ids))
+                pieces = {name: values[keep] for name, values in pieces.items()}
+            self.merged = pieces
+            self.added = []
+            self.removed_ids = set()
+        return self.merged
+
+    def get_paths(self):
+        '''Returns the manifest and pieces paths.'''
+        return (os.path.join(self.index_dir, 'index.json'),
+            os.path.join(self.index_dir, 'index.npz'))
+
+    def load(self):
+        '''Reads the index from index_dir, if there is a valid one.'''
+        json_path, npz_path = self.get_paths()
+        try:
+            with open(json_path, 'r') as f:
+                meta = json.load(f)
+            if meta.get('version') != FORMAT_VERSION \
+                    or meta.get('tolerance') != self.tolerance:
+                return
+            with np.load(npz_path) as data:
+                pieces = {name: data[name].astype(dtype, copy=False)
+                    for name, dtype in PIECE_COLUMNS}
+        except (OSError, ValueError, KeyError):
+            return
+        self.files = meta['files']
+        self.next_id = meta['next_id']
+        # Drop any pieces of files not in the manifest
+        ids = np.array([entry['id'] for entry in self.files.values()], dtype=np.int32)
+        keep = np.isin(pieces['file_id'], ids)
+        self.merged = {name: values[keep] for name, values in pieces.items()}
+        self.added = []
+        self.removed_ids = set()
+        self.grid = None
+
+    def save(self):
+        '''Writes the index to index_dir. The pieces are written first, and
+        each file is written to a temporary file and renamed.'''
+        os.makedirs(self.index_dir, exist_ok=True)
+        json_path, npz_path = self.get_paths()
+        tmp = f'{npz_path}.{os.getpid()}.tmp.npz'
+        np.savez(tmp, **self.pieces)
+        os.replace(tmp, npz_path)
+        meta = {'version': FORMAT_VERSION, 'tolerance': self.tolerance,
+            'next_id': self.next_id, 'files': self.files}
+        tmp = f'{json_path}.{os.getpid()}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp, json_path)
+
+    def get_key(self, file_name):
+        '''Returns the size and modification time that must match for the
+        entry of a file to be up to date.'''
+        stat = os.stat(file_name)
+        return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+    def is_current(self, file_name):
+        '''Returns whether the file is in the index and has not changed.'''
+        entry = self.files.get(os.path.abspath(file_name))
+        if entry is None:
+            return False
+        try:
+            key = self.get_key(file_name)
+        except OSError:
+            return False
+        return all(entry.get(name) == value for name, value in key.items())
+
+    def add(self, file_name, track=None, loader=load_track):
+        '''Adds or replaces the file in the index. The track is read with
+        loader if not given. Call save to keep the change.'''
+        file_name = os.path.abspath(file_name)
+        key = self.get_key(file_name)
+        if track is None:
+            track = loader(file_name)
+        self.remove(file_name)
+        file_id = self.next_id
+        self.next_id += 1
+        pieces = get_pieces(track, self.tolerance)
+        pieces['file_id'] = np.full(len(pieces['i0']), file_id, dtype=np.int32)
+        self.added.append({name: pieces[name].astype(dtype, copy=False)
+            for name, dtype in PIECE_COLUMNS})
+        entry = {'id': file_id, 'n_points': len(track), 'bboxes': get_bboxes(track)}
+        entry.update(key)
+        self.files[file_name] = entry
+        self.grid = None
+
+    def remove(self, file_name):
+        '''Removes the file from the index if it is there.'''
+        entry = self.files.pop(os.path.abspath(file_name), None)
+        if entry is None:
+            return
+        self.removed_ids.add(entry['id'])
+        self.grid = None
+
+    def update(self, file_names, loader=load_track, prune=False):
+        '''Adds the files that are new or changed, and saves the index if
+        anything changed. If prune is True, files in the index that no longer
+        exist are removed. Returns (number added, number removed, errors),
+        where errors is a list of (file_name, message).'''
+        n_added = 0
+        errors = []
+        for file_name in file_names:
+            if self.is_current(file_name):
+                continue
+            try:
+                self.add(file_name, loader=loader)
+                n_added += 1
+            except Exception as ex:
+                errors.append((file_name, f'{type(ex).__name__}: {ex}'))
+        n_removed = 0
+        if prune:
+            for file_name in list(self.files):
+                if not os.path.exists(file_name):
+                    self.remove(file_name)
+                    n_removed += 1
+        if n_added or n_removed:
+            self.save()
+        return n_added, n_removed, errors
+
+    def get_cells(self, lat, lon):
+        '''Returns the grid row and column of lat, lon.'''
+        return (np.floor(np.asarray(lat) / self.cell_size).astype(np.int64),
+            np.floor(np.asarray(lon) / self.cell_size).astype(np.int64))
+
+    def get_cell_keys(self, rows, cols):
+        '''Returns int64 keys that sort by row then column.'''
+        return (rows << 32) + (cols + COL_OFFSET)
+
+    def build_grid(self):
+        '''Builds the grid: the pieces sorted by cell key, with each piece
+        listed in every cell its bounding box covers. Pieces that cover more
+        than MAX_PIECE_CELLS cells are listed with their bounding boxes
+        instead. Also makes an array of the track bounding boxes.'''
+        p = self.pieces
+        row0, col0 = self.get_cells(np.minimum(p['lat0'], p['lat1']),
+            np.minimum(p['lon0'], p['lon1']))
+        row1, col1 = self.get_cells(np.maximum(p['lat0'], p['lat1']),
+            np.maximum(p['lon0'], p['lon1']))
+        n_rows = row1 - row0 + 1
+        n_cols = col1 - col0 + 1
+        counts = n_rows * n_cols
+        long = np.flatnonzero(counts > MAX_PIECE_CELLS)
+        long_bboxes = np.column_stack((np.minimum(p['lat0'], p['lat1']),
+            np.minimum(p['lon0'], p['lon1']), np.maximum(p['lat0'], p['lat1']),
+            np.maximum(p['lon0'], p['lon1'])))[long]
+        counts[long] = 0
+        piece = np.repeat(np.arange(len(counts)), counts)
+        # Position of each entry within its piece's block of cells
+        k = np.arange(len(piece)) - np.repeat(np.cumsum(counts) - counts, counts)
+        rows = row0[piece] + k // n_cols[piece]
+        cols = col0[piece] + k % n_cols[piece]
+        keys = self.get_cell_keys(rows, cols)
+        order = np.argsort(keys, kind='stable')
+        bboxes = [(entry['id'], b) for entry in self.files.values()
+            for b in entry['bboxes'] if b is not None]
+        self.grid = (keys[order], piece[order],
+            np.array([b for file_id, b in bboxes], dtype=np.float64).reshape(-1, 4),
+            np.array([file_id for file_id, b in bboxes], dtype=np.int32), long, long_bboxes)
+
+    def get_candidates(self, bbox):
+        '''Returns the indices of the pieces in the grid cells that the
+        [lat_min, lon_min, lat_max, lon_max] box covers, and of the long
+        pieces whose bounding box meets it.'''
+        if self.grid is None:
+            self.build_grid()
+        keys, piece, bboxes, bbox_ids, long, long_bboxes = self.grid
+        # Only the files with a track whose bounding box meets the query
+        meets = (bboxes[:, 0] <= bbox[2]) & (bbox[0] <= bboxes[:, 2]) \
+            & (bboxes[:, 1] <= bbox[3]) & (bbox[1] <= bboxes[:, 3])
+        ids = np.unique(bbox_ids[meets])
+        if len(ids) == 0:
+            return np.empty(0, dtype=np.int64)
+        row0, col0 = self.get_cells(bbox[0], bbox[1])
+        row1, col1 = self.get_cells(bbox[2], bbox[3])
+        # The keys sort by row then column, so each row of the box is one
+        # range of the grid
+        rows = np.arange(row0, row1 + 1)
+        starts = np.searchsorted(keys, self.get_cell_keys(rows, col0), side='left')
+        ends = np.searchsorted(keys, self.get_cell_keys(rows, col1), side='right')
+        meets = (long_bboxes[:, 0] <= bbox[2]) & (bbox[0] <= long_bboxes[:, 2]) \
+            & (long_bboxes[:, 1] <= bbox[3]) & (bbox[1] <= long_bboxes[:, 3])
+        found = np.unique(np.concatenate([piece[start:end]
+            for start, end in zip(starts, ends)] + [long[meets]]))
+        if len(ids) < len(self.files):
+            found = found[np.isin(self.pieces['file_id'][found], ids)]
+        return found
+
+    def query_bbox(self, lat_min, lon_min, lat_max, lon_max):
+        '''Returns the time ranges of the tracks inside the box, as for
+        get_ranges.'''
+        bbox = [lat_min, lon_min, lat_max, lon_max]
+        found = self.get_candidates(bbox)
+        p = {name: values[found] for name, values in self.pieces.items()}
+        match = clip_segments(p['lon0'], p['lat0'], p['lon1'], p['lat1'],
+            lon_min, lat_min, lon_max, lat_max)
+        return self.get_ranges(found[match])
+
+    def query_radius(self, lat, lon, radius):
+        '''Returns the time ranges of the tracks within radius meters of
+        lat, lon, as for get_ranges.'''
+        dlat = radius / M_PER_DEG
+        dlon = radius / (M_PER_DEG * max(np.cos(np.radians(lat)), 1e-6))
+        found = self.get_candidates([lat - dlat, lon - dlon, lat + dlat, lon + dlon])
+        p = {name: values[found] for name, values in self.pieces.items()}
+        # Local meters about the query point
+        projection = enu.Projection(lat, lon)
+        x0, y0 = projection.forward(p['lat0'], p['lon0'])
+        x1, y1 = projection.forward(p['lat1'], p['lon1'])
+        dist = simplify.segment_distance(0., 0., x0, y0, x1, y1)
+        return self.get_ranges(found[dist <= radius])
+
+    def get_ranges(self, found):
+        '''Returns a list of dicts for the pieces, with the pieces that
+        follow one another in the same segment merged. Each has file_name,
+        trk, seg, start_index, end_index (inclusive), start_time, and
+        end_time (UTC datetimes), sorted by file_name and start_time.'''
+        names = {entry['id']: file_name for file_name, entry in self.files.items()}
+        p = {name: values[found] for name, values in self.pieces.items()}
+        order = np.lexsort((p['i0'], p['seg'], p['file_id']))
+        p = {name: values[order] for name, values in p.items()}
+        n = len(order)
+        if n == 0:
+            return []
+        # A new range starts where the file or segment changes or there is
+        # a piece missing
+        new = np.ones(n, dtype=bool)
+        new[1:] = (p['file_id'][1:] != p['file_id'][:-1]) | (p['seg'][1:] != p['seg'][:-1]) \
+            | (p['i0'][1:] != p['i1'][:-1])
+        starts = np.flatnonzero(new)
+        ends = np.concatenate((starts[1:], [n])) - 1
+        ranges = []
+        for start, end in zip(starts.tolist(), ends.tolist()):
+            ranges.append({
+                'file_name': names[int(p['file_id'][start])],
+                'trk': int(p['trk'][start]),
+                'seg': int(p['seg'][start]),
+                'start_index': int(p['i0'][start]),
+                'end_index': int(p['i1'][end]),
+                'start_time': to_datetime(p['t0'][start]),
+                'end_time': to_datetime(p['t1'][end]),
+            })
+        ranges.sort(key=lambda r: (r['file_name'], r['start_index']))
+        return ranges
+
+def to_datetime(ns):
+    '''Returns int ns since the epoch as a UTC datetime, None for NaT.'''
+    import timezones
+    if ns == timezones.NAT:
+        return None
+    return datetime.datetime.fromtimestamp(int(ns) // 1000 / 1e6, datetime.timezone.utc)
+
+def get_parser():
+    parser = argparse.ArgumentParser(description='Spatial index of GPX files.')
+    parser.add_argument('--index', dest='index_dir',
+        help='index directory (default: PY_GPS_INDEX or ~/.cache/py_gps/index)')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    update = subparsers.add_parser('update', help='add new and changed files')
+    update.add_argument('paths', nargs='+',
+        help='GPX files, glob patterns, or directories to search')
+    update.add_argument('--prune', action='store_true',
+        help='remove files that no longer exist')
+    bbox = subparsers.add_parser('bbox', help='find the tracks inside a box')
+    for name in ('lat_min', 'lon_min', 'lat_max', 'lon_max'):
+        bbox.add_argument(name, type=float)
+    near = subparsers.add_parser('near', help='find the tracks near a point')
+    near.add_argument('lat', type=float)
+    near.add_argument('lon', type=float)
+    near.add_argument('radius', type=float, help='m')
+    return parser
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    index = SpatialIndex(args.index_dir)
+    if args.command == 'update':
+        from batch import find_files
+        n_added, n_removed, errors = index.update(find_files(args.paths), prune=args.prune)
+        for file_name, error in errors:
+            print(f'{file_name}: ERROR {error}')
+        print(f'Added {n_added} files, removed {n_removed}, '
+            f'{len(index.files)} files in the index')
+        return 1 if errors else 0
+    if args.command == 'bbox':
+        ranges = index.query_bbox(args.lat_min, args.lon_min, args.lat_max, args.lon_max)
+    else:
+        ranges = index.query_radius(args.lat, args.lon, args.radius)
+    for r in ranges:
+        print(f'{r["file_name"]}: trk {r["trk"]} seg {r["seg"]} '
+            f'points {r["start_index"]}-{r["end_index"]} '
+            f'{r["start_time"]} - {r["end_time"]}')
+    print(f'{len(ranges)} ranges')
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,22 +1,74 @@
+''' Speed routines.
+scipy, haversine, and matplotlib are imported by the functions that use
+them, so getting the speed does not load the filtering or plotting
+libraries.
+
+py_gps.main, batch, gpx_writer, track_dataset, and aggregates filter the
+speed with process_speed(track, speed, fs=resampling.get_fs(track),
+uniform=True, zero_phase=True), on a uniform grid at the rate the track
+was recorded at and without lag. Originally process_speed(time, speed) was
+used, which takes the samples to be 1 s apart whatever the recording rate
+and filters causally, so the filtered speed trails the speed. The filtered
+speed, and the max_speed batch reports from it, therefore differ from
+before, even for tracks recorded every second. The cutoff is still
+FILTER_CUTOFF, .04 Hz, which is what .04 * fs gave for the fs=1 that was
+always used. The original result is process_speed(track, speed) with the
+defaults.
+'''
+
 import numpy as np
-import matplotlib.pyplot as plt
-from scipy.fft import fft, fftfreq
-from scipy.signal import butter, lfilter, freqz
-import haversine
+
+from track import Track
+import enu
+import filters
+import instrument
+import render
 
 def butter_lowpass(cutoff, fs, order=5):
+    '''Returns the (b, a) transfer-function coefficients of a Butterworth
+    lowpass filter with cutoff and fs in Hz. Kept for callers that use them
+    directly; the filtering here uses the second-order sections of
+    filters.get_sos, which stay accurate at higher orders.'''
+    from scipy.signal import butter
     nyq = 0.5 * fs
     normal_cutoff = cutoff / nyq
     b, a = butter(order, normal_cutoff, btype='low', analog=False)
     return b, a
 
-def filter_butter_lowpass(data, cutoff, fs, order=5):
-    b, a = butter_lowpass(cutoff, fs, order=order)
-    y = lfilter(b, a, data)
-    return y
+def filter_butter_lowpass(data, cutoff, fs, order=5, zero_phase=False):
+    '''Returns the data passed through a Butterworth lowpass filter. The
+    filter is run as second-order sections with filters.filter_batch, which
+    gives the same result, to rounding, as lfilter with the butter_lowpass
+    coefficients, or sosfiltfilt if zero_phase is True.'''
+    return filters.filter_batch([data], cutoff, fs, order, zero_phase)[0]
+
+class LowpassStream:
+    '''Butterworth lowpass filter for data that arrives in chunks, e.g. live
+    GPS data. The filter is the cached second-order sections design from
+    filters.get_sos and its state is kept between chunks, so each update
+    only costs the length of the chunk and the concatenated output is the
+    same, to rounding, as filtering all the data at once with
+    filters.filter_batch.'''
+
+    def __init__(self, cutoff, fs, order=5):
+        self.sos = filters.get_sos(order, cutoff, fs)
+        self.zi = np.zeros((len(self.sos), 2))
+
+    def update(self, chunk):
+        '''Filters the next chunk and returns the filtered values.'''
+        from scipy.signal import sosfilt
+        y, self.zi = sosfilt(self.sos, chunk, zi=self.zi)
+        return y
+
+    def reset(self):
+        '''Starts again as if no data had been seen.'''
+        self.zi[:] = 0
 
 def plot_fft(data, fs, title = 'FFT', filename=None):
-    '''Plots the FFT of the given data.'''
+    '''Plots the FFT of the given data, which must be evenly spaced at fs Hz.
+    Use resampling.Resampler to put GPX data on a uniform grid first.'''
+    import matplotlib.pyplot as plt
+    from scipy.fft import fft, fftfreq
     if filename:
       title = f"{title}\n{filename}"
     n = len(data)
@@ -31,16 +83,115 @@ def plot_fft(data, fs, title = 'FFT', filename=None):
     plt.ylabel('fft')
     plt.show()
 
-def get_speed(lat, lon, time):
-    '''Gets the speed, total distance, and total time from the lat, lon, and time.'''
-    MI_PER_M = 0.000621371
-    SEC_PER_HR = 3600
-    SEC_PER_MIN = 60
+MI_PER_M = 0.000621371
+M_PER_MI = 1609.344
+SEC_PER_HR = 3600
+SEC_PER_MIN = 60
+# Butterworth filter used by process_speed
+FILTER_ORDER = 5
+# Cutoff frequency, Hz. Originally given as .04 * fs, always with fs=1
+FILTER_CUTOFF = .04
+
+@instrument.timed()
+def get_time_deltas(time):
+    '''Returns the time differences between consecutive points, s, as a
+    float64 array one shorter than time. Each difference is taken from the
+    two times directly so it does not depend on the rest of the array.'''
+    if len(time) < 2:
+        return np.empty(0)
+    if isinstance(time, np.ndarray):
+        if time.dtype.kind == 'M':
+            return np.diff(time) / np.timedelta64(1, 's')
+        return np.diff(time.astype(np.float64))
+    return np.array([(time[i] - time[i - 1]).total_seconds()
+        for i in range(1, len(time))])
+
+@instrument.timed()
+def get_speed_array(lat, lon, time, seg_starts=None, xy=None):
+    '''Vectorized version of get_speed. lat and lon are float64 arrays and
+    time is a datetime64 array, an array of epoch seconds, or a sequence of
+    datetimes. seg_starts are the indices of points that start a new segment
+    (see Track.segment_starts). The step into such a point is a gap, and is
+    given 0 distance, time, and speed. If xy, the points projected as for
+    Track.xy, is given, the distances are found with enu.get_step_lengths,
+    from xy near the origin and the great circle distance elsewhere, instead
+    of with haversine (see enu.py for how close they are).
+
+        Returns
+        ------
+        return : speed, dist, time_delta, total_dist, total_time, avg_speed
+            speed (mph), segment distance dist (mi) and segment time_delta (s)
+            are NumPy arrays with a leading 0 for the first point. total_dist
+            is in mi, total_time in min, and avg_speed in mph.
+    '''
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    n = len(lat)
+    dist = np.zeros(n)
+    time_delta = np.zeros(n)
+    if n > 1:
+        if xy is not None:
+            dist[1:] = enu.get_step_lengths(lat, lon, *xy) / M_PER_MI
+        else:
+            import haversine
+            with instrument.stage('haversine'):
+                dist[1:] = haversine.haversine_vector(np.column_stack((lat[1:], lon[1:])),
+                    np.column_stack((lat[:-1], lon[:-1])), unit=haversine.Unit.MILES)
+        time_delta[1:] = get_time_deltas(time)
+    if seg_starts is not None and len(seg_starts):
+        dist[seg_starts] = 0.
+        time_delta[seg_starts] = 0.
+    # Speed is 0 where the time does not change
+    speed = np.zeros(n)
+    moving = time_delta != 0
+    speed[moving] = dist[moving] / time_delta[moving] * SEC_PER_HR
+    total_dist = float(dist.sum())
+    total_time = float(time_delta.sum()) / SEC_PER_MIN
+    avg_speed = total_dist / total_time * 60 if total_time else 0.
+    return speed, dist, time_delta, total_dist, total_time, avg_speed
+
+def get_speed(lat, lon=None, time=None):
+    '''Gets the speed, total distance, and total time from the lat, lon, and
+    time, or from a Track passed as lat. For a Track the gaps between
+    segments are not counted, and the distances are found from Track.xy.'''
+    seg_starts = None
+    xy = None
+    if isinstance(lat, Track):
+        seg_starts = lat.segment_starts()
+        xy = lat.xy
+        lat, lon, time = lat.lat, lat.lon, lat.datetime64
+    speed, dist, time_delta, total_dist, total_time, avg_speed = \
+        get_speed_array(lat, lon, time, seg_starts, xy)
+    return speed, total_dist, total_time, avg_speed
+
+def get_segment_stats(track):
+    '''Returns the distance (mi), duration (min), and average speed (mph) of
+    each segment of a Track as a dict of arrays.'''
+    speed, dist, time_delta, total_dist, total_time, avg_speed = \
+        get_speed_array(track.lat, track.lon, track.datetime64, track.segment_starts(),
+            track.xy)
+    starts = track.seg_offsets[:-1]
+    ends = track.seg_offsets[1:]
+    # Sums over each segment from the cumulative sums, empty segments give 0
+    dist_sum = np.concatenate(([0.], np.cumsum(dist)))
+    time_sum = np.concatenate(([0.], np.cumsum(time_delta)))
+    seg_dist = dist_sum[ends] - dist_sum[starts]
+    seg_time = (time_sum[ends] - time_sum[starts]) / SEC_PER_MIN
+    seg_speed = np.zeros(len(starts))
+    moving = seg_time != 0
+    seg_speed[moving] = seg_dist[moving] / seg_time[moving] * 60
+    return {'dist': seg_dist, 'time': seg_time, 'avg_speed': seg_speed}
+
+def get_speed_scalar(lat, lon, time):
+    '''Point by point version of get_speed. Kept as the reference the
+    vectorized version is checked against.'''
+    import haversine
     lenData = len(lat)
     dist = []
     speed = []
     total_dist = 0
     total_time = 0
+    avg_speed = 0
     for i in range(lenData):
         if i == 0:
             speed.append(0)
@@ -54,8 +205,7 @@ def get_speed(lat, lon, time):
             speed.append(0.)
         else:
             speed.append(dist_hav / time_delta * SEC_PER_HR)
-        #if i < 100:
-        #    print(f'{i=} {time_delta=} {speed[i]=} {time[i]=}')
+    if total_time:
         avg_speed = total_dist / total_time * 60
     return speed, total_dist, total_time, avg_speed
 
@@ -65,48 +215,172 @@ def write_speed_file(speed, file):
             f.write(f'{float(val):.6}')
             f.write('\n')
 
-def process_speed(time, speed, fs=1):
-    lenSpeed = len(speed)
-    if False:
-        # Moving average 1
-        moving_avg = []
-        window_size = 5
-        for i in range(lenSpeed):
-            if i == 0:
-                 window_average = 0
-            elif i == 1:
-                window_average = speed[0]
-            elif i < window_size:
-                this_window = speed[0 : i]
-                window_average = sum(this_window) / (i + 1)
+def get_cutoff(fs):
+    '''Returns the process_speed cutoff for sample rate fs, Hz. This is
+    FILTER_CUTOFF whatever the rate, rather than the original .04 * fs, so
+    the smoothing in time does not depend on how often the points were
+    recorded. For rates below .1 Hz it is kept at .4 * fs, below the
+    Nyquist frequency. For the default fs=1 it is .04 Hz, as before.'''
+    return min(FILTER_CUTOFF, .4 * fs)
+
+@instrument.timed()
+def process_speed(time, speed=None, fs=1, seg_offsets=None, uniform=False,
+        zero_phase=False):
+    '''Returns the speed passed through a Butterworth lowpass filter. time may
+    be a Track, in which case speed is calculated from it if not given, and
+    each segment is filtered separately. seg_offsets may also be given
+    directly.
+
+    The filter assumes the samples are fs Hz apart. If uniform is True the
+    speed is instead resampled to a uniform grid (see resampling.py),
+    filtered there, and mapped back to the original times. fs is then the
+    grid rate, found from the times if it is None.
+
+    The filter is causal, so the filtered speed lags the speed, unless
+    zero_phase is True, in which case it is run forwards and backwards and
+    does not lag. See filters.py.'''
+    if isinstance(time, Track):
+        if speed is None:
+            speed = get_speed(time)[0]
+        if seg_offsets is None:
+            seg_offsets = time.seg_offsets
+    if uniform:
+        import resampling
+        resampler = resampling.Resampler(time, fs, seg_offsets=seg_offsets)
+        fs = resampler.fs
+    elif fs is None:
+        fs = 1
+    cutoff = get_cutoff(fs)
+    if uniform:
+        return resampler.to_original(filters.filter_runs(resampler.resample(speed),
+            resampler.grid_offsets, cutoff, fs, FILTER_ORDER, zero_phase))
+    if seg_offsets is None:
+        seg_offsets = [0, len(speed)]
+    return filters.filter_runs(speed, seg_offsets, cutoff, fs, FILTER_ORDER, zero_phase)
+
+@instrument.timed()
+def process_speeds(tracks, speeds=None, fs=None, zero_phase=False):
+    '''Returns a list of the process_speed(uniform=True) filtered speed for
+    each Track in tracks. All the tracks are resampled to the same rate, fs,
+    or the median get_fs of the tracks if it is None, and all their runs are
+    filtered together as one batch with filters.filter_batch.'''
+    import resampling
+    if speeds is None:
+        speeds = [get_speed(track)[0] for track in tracks]
+    if fs is None:
+        fs = float(np.median([resampling.get_fs(track) for track in tracks])) \
+            if len(tracks) else 1.
+    cutoff = get_cutoff(fs)
+    resamplers = [resampling.Resampler(track, fs) for track in tracks]
+    runs = []
+    counts = []
+    for resampler, speed in zip(resamplers, speeds):
+        grid_speed = resampler.resample(speed)
+        offsets = resampler.grid_offsets
+        track_runs = [grid_speed[start:end] for start, end in zip(offsets[:-1], offsets[1:])
+            if end > start]
+        runs.extend(track_runs)
+        counts.append(len(track_runs))
+    filtered = filters.filter_batch(runs, cutoff, fs, FILTER_ORDER, zero_phase)
+    result = []
+    start = 0
+    for resampler, count in zip(resamplers, counts):
+        track_runs = filtered[start:start + count]
+        start += count
+        grid_val = np.concatenate(track_runs) if track_runs else np.empty(0)
+        result.append(resampler.to_original(grid_val))
+    return result
+
+class SpeedStream:
+    '''Gets the speed and the process_speed filtered speed for points that
+    arrive in chunks. The last point of each chunk is kept so the first speed
+    of the next chunk is right, and the filter state is kept in a
+    LowpassStream. The distances are found with haversine, so the results
+    match get_speed_array and process_speed for all the points, to rounding.
+    get_speed of a Track uses Track.xy, and differs from them by the error of
+    the projection in enu.py, about 1e-8 relative for points within 1 km of
+    their segment's centroid. total_dist (mi) and total_time (min) are kept
+    as for get_speed_array. Use update_track for the Tracks of
+    gpx_stream.iter_batches, which starts again at each new segment.'''
+
+    def __init__(self, fs=1):
+        self.filter = LowpassStream(get_cutoff(fs), fs, FILTER_ORDER)
+        self.last = None
+        self.total_dist = 0.
+        self.total_time = 0.
+
+    @property
+    def avg_speed(self):
+        '''Average speed so far, mph.'''
+        return self.total_dist / self.total_time * 60 if self.total_time else 0.
+
+    def reset(self):
+        '''Starts a new segment: the step from the last point and the filter
+        state are not carried over. The totals are kept.'''
+        self.filter.reset()
+        self.last = None
+
+    def update(self, lat, lon, time):
+        '''Returns speed, filtered speed for the next chunk of points. time
+        is as for get_speed_array.'''
+        lat = np.asarray(lat, dtype=np.float64)
+        lon = np.asarray(lon, dtype=np.float64)
+        if len(lat) == 0:
+            return np.empty(0), np.empty(0)
+        if self.last is None:
+            speed, dist, time_delta = get_speed_array(lat, lon, time)[:3]
+        else:
+            # Put the last point of the previous chunk in front
+            last_lat, last_lon, last_time = self.last
+            if isinstance(time, np.ndarray):
+                time_all = np.concatenate(([last_time], time))
             else:
-                this_window = speed[i - window_size: i]
-                window_average = sum(this_window) / window_size
-            moving_avg.append(window_average)
-    if True:
-        # Butterworth
-        order = 5
-        cutoff = .04 * fs
-        b, a = butter_lowpass(cutoff, fs, order)
-        val = filter_butter_lowpass(speed, cutoff, fs, order)
-    return val
-
-def plot_speed(time, speed, processed_speed, avg_speed=None, max_speed=5.0, title='Speed vs Time'):
-    lenSpeed = len(speed)
-    plt.figure(figsize=(10,6))
-    plt.plot(time, speed, 'lightskyblue', label='Original')
-    plt.plot(time, processed_speed, 'dodgerblue', linewidth=2, label='Filtered')
+                time_all = [last_time] + list(time)
+            speed, dist, time_delta = get_speed_array(np.concatenate(([last_lat], lat)),
+                np.concatenate(([last_lon], lon)), time_all)[:3]
+            speed = speed[1:]
+        self.total_dist += float(dist.sum())
+        self.total_time += float(time_delta.sum()) / SEC_PER_MIN
+        self.last = (lat[-1], lon[-1], time[-1])
+        return speed, self.filter.update(speed)
+
+    def update_track(self, track, continues=False):
+        '''Returns speed, filtered speed for the points of a Track, each
+        segment starting again as for process_speed with the track's
+        seg_offsets. If continues is False the first segment does too,
+        otherwise it carries on from the last update, as for the continues
+        of a gpx_stream.iter_batches Batch.'''
+        time = track.datetime64
+        speed = np.empty(len(track))
+        filtered = np.empty(len(track))
+        for i, (start, end) in enumerate(zip(track.seg_offsets[:-1], track.seg_offsets[1:])):
+            if i > 0 or not continues:
+                self.reset()
+            speed[start:end], filtered[start:end] = \
+                self.update(track.lat[start:end], track.lon[start:end], time[start:end])
+        return speed, filtered
+
+def plot_speed(time, speed, processed_speed, avg_speed=None, max_speed=5.0, title='Speed vs Time',
+        file_name=None, decimation=render.DEFAULT_DECIMATION):
+    '''Plots the original and processed speed. time may be a Track, whose
+    local time is plotted. If file_name is given the plot is saved there instead of shown. decimation
+    is as for render.plot.'''
+    import matplotlib.pyplot as plt
+    if isinstance(time, Track):
+        time = time.local_time()
+    fig = plt.figure(figsize=(10,6))
+    ax = plt.gca()
+    render.plot(ax, time, speed, 'lightskyblue', label='Original', decimation=decimation)
+    render.plot(ax, time, processed_speed, 'dodgerblue', linewidth=2, label='Filtered',
+        decimation=decimation)
     if avg_speed:
-        avg_speed_array = []
-        for i in range(lenSpeed):
-            avg_speed_array.append(avg_speed)
-        plt.plot(time, avg_speed_array, 'mediumblue', label=f'avg speed ({avg_speed:.1f} mph)')
+        plt.axhline(avg_speed, color='mediumblue', label=f'avg speed ({avg_speed:.1f} mph)')
     plt.xlabel('Time (dd hh:mm)')
     plt.ylabel('Speed, mph')
     plt.title(title)
     plt.legend()
     plt.tight_layout()
-    plt.show()
+    render.show_or_save(fig, file_name)
 
 
 
@@ -0,0 +1,72 @@
+''' Quick track summaries.
+Prints the start, end, distance, time, and average speed of GPX files, the
+same values as get_track_info, for scripts and cron jobs that need nothing
+else. The files are read with the streaming reader and matplotlib, scipy,
+and pandas are never imported, so it starts quickly. With --utc the times
+are left in UTC and timezonefinder is not loaded either, e.g.
+
+    python summary.py --json GPSLink/Polar
+'''
+
+import argparse
+import json
+import sys
+
+from batch import find_files
+import gpx_stream
+import py_gps
+
+def get_summary(file_name, utc=False):
+    '''Returns the summary dict for the file. Errors are returned in the
+    dict instead of being raised.'''
+    summary = {'file_name': file_name, 'n_points': 0}
+    try:
+        track = gpx_stream.read_track(file_name, timezone=not utc)
+        summary['n_points'] = len(track)
+        summary['n_trk'] = track.n_trk
+        summary['n_seg'] = track.n_seg
+        if len(track) == 0:
+            summary['error'] = 'No trackpoints found'
+            return summary
+        summary.update(py_gps.get_track_summary(track))
+        for key in ('start_time', 'end_time'):
+            summary[key] = summary[key].isoformat()
+    except Exception as ex:
+        summary['error'] = f'{type(ex).__name__}: {ex}'
+    return summary
+
+def get_parser():
+    parser = argparse.ArgumentParser(description='Print summaries of GPX files.')
+    parser.add_argument('paths', nargs='+',
+        help='GPX files, glob patterns, or directories to search')
+    parser.add_argument('--json', action='store_true',
+        help='print one JSON object per file')
+    parser.add_argument('--utc', action='store_true',
+        help='give the times in UTC, which skips the timezone lookup')
+    return parser
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    file_names = find_files(args.paths)
+    if not file_names:
+        print('No GPX files found', file=sys.stderr)
+        return 1
+    n_errors = 0
+    for file_name in file_names:
+        summary = get_summary(file_name, args.utc)
+        error = summary.get('error')
+        if error:
+            n_errors += 1
+        if args.json:
+            print(json.dumps(summary), flush=True)
+        elif error:
+            print(f'{file_name}: ERROR {error}')
+        else:
+            print(f'{file_name}: {summary["n_points"]} points, '
+                f'start={summary["start_time"]} end={summary["end_time"]}, '
+                f'{summary["total_dist"]:.2f} mi, {summary["total_time"]:.1f} min, '
+                f'avg_speed={summary["avg_speed"]:.2f} mph')
+    return 1 if n_errors else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,126 @@
+''' Synthetic GPX files for testing and benchmarks.
+Writes a walking-like track of a given number of points, optionally with
+Garmin TrackPointExtension hr and cad, split into several tracks and
+segments, and with the GPX elements in one of several namespace layouts:
+
+    default   GPX/1/1 as the default namespace, as Polar writes it
+    gpx10     GPX/1/0 as the default namespace
+    prefixed  GPX/1/1 with a gpx: prefix and no default namespace
+'''
+
+import datetime
+import math
+import os
+import random
+
+GPX_11 = 'http://www.topografix.com/GPX/1/1'
+GPX_10 = 'http://www.topografix.com/GPX/1/0'
+TPX = 'http://www.garmin.com/xmlschemas/TrackPointExtension/v2'
+NAMESPACES = ('default', 'gpx10', 'prefixed')
+# Start at Kensington Metropark
+START_LAT = 42.5329
+START_LON = -83.6386
+START_TIME = datetime.datetime(2021, 12, 4, 17, 1, 33, tzinfo=datetime.timezone.utc)
+M_PER_DEG = 111320.
+
+def get_file_name(directory, n_points, n_trk=1, n_seg=1, hr=True, namespace='default'):
+    '''Returns a file name in directory that describes the parameters.'''
+    return os.path.join(directory,
+        f'synthetic_{n_points}_{n_trk}x{n_seg}_{"hr" if hr else "nohr"}_{namespace}.gpx')
+
+def write_gpx(file_name, n_points, n_trk=1, n_seg=1, hr=True, namespace='default',
+        seed=0, gap=600):
+    '''Writes a synthetic GPX file.
+
+        Parameters
+        ----------
+        file_name : str
+            The file to write.
+        n_points : int
+            Total number of trackpoints, split evenly over the segments.
+        n_trk : int
+            Number of tracks.
+            default: 1
+        n_seg : int
+            Number of segments in each track.
+            default: 1
+        hr : boolean
+            Whether to write TrackPointExtension hr and cad.
+            default: True
+        namespace : str
+            One of NAMESPACES.
+            default: 'default'
+        seed : int
+            Seed for the random walk.
+            default: 0
+        gap : float
+            Pause between segments, s.
+            default: 600
+    '''
+    if namespace not in NAMESPACES:
+        raise ValueError(f'Unknown namespace layout: {namespace}')
+    rng = random.Random(seed)
+    if namespace == 'prefixed':
+        p = 'gpx:'
+        xmlns = f'xmlns:gpx="{GPX_11}"'
+    else:
+        p = ''
+        xmlns = f'xmlns="{GPX_10 if namespace == "gpx10" else GPX_11}"'
+    n_segs = n_trk * n_seg
+    lat = START_LAT
+    lon = START_LON
+    heading = rng.uniform(0, 2 * math.pi)
+    time = START_TIME
+    with open(file_name, 'w', encoding='utf-8', buffering=1024 * 1024) as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        f.write(f'<{p}gpx {xmlns} xmlns:gpxtpx="{TPX}" '
+            'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+            f'xsi:schemaLocation="{GPX_11} {GPX_11}/gpx.xsd" '
+            'version="1.1" creator="Py GPS synthetic_gpx">\n')
+        f.write(f'  <{p}metadata><{p}author><{p}name>Py GPS</{p}name></{p}author></{p}metadata>\n')
+        point = 0
+        for trk in range(n_trk):
+            f.write(f'  <{p}trk>\n    <{p}name>Track {trk}</{p}name>\n')
+            for seg in range(n_seg):
+                f.write(f'    <{p}trkseg>\n')
+                seg_index = trk * n_seg + seg
+                end = (seg_index + 1) * n_points // n_segs
+                lines = []
+                while point < end:
+                    # Walk at about 1.4 m/s with a slowly changing heading
+                    heading += rng.gauss(0, .1)
+                    step = max(rng.gauss(1.4, .3), 0.)
+                    lat += step * math.cos(heading) / M_PER_DEG
+                    lon += step * math.sin(heading) / (M_PER_DEG * math.cos(math.radians(lat)))
+                    ele = 250. + 10. * math.sin(point / 500.)
+                    time_str = time.strftime('%Y-%m-%dT%H:%M:%S') + 'Z'
+                    line = (f'      <{p}trkpt lat="{lat:.7f}" lon="{lon:.7f}">'
+                        f'<{p}ele>{ele:.1f}</{p}ele><{p}time>{time_str}</{p}time>')
+                    if hr:
+                        line += (f'<{p}extensions><gpxtpx:TrackPointExtension>'
+                            f'<gpxtpx:hr>{100 + point % 50}</gpxtpx:hr>'
+                            f'<gpxtpx:cad>{50 + point % 10}</gpxtpx:cad>'
+                            f'</gpxtpx:TrackPointExtension></{p}extensions>')
+                    lines.append(line + f'</{p}trkpt>\n')
+                    if len(lines) == 10000:
+                        f.write(''.join(lines))
+                        lines = []
+                    time += datetime.timedelta(seconds=1)
+                    point += 1
+                f.write(''.join(lines))
+                f.write(f'    </{p}trkseg>\n')
+                time += datetime.timedelta(seconds=gap)
+            f.write(f'  </{p}trk>\n')
+        f.write(f'</{p}gpx>\n')
+    return file_name
+
+def get_gpx_file(directory, n_points, n_trk=1, n_seg=1, hr=True, namespace='default'):
+    '''Returns the name of a synthetic file with these parameters in
+    directory, writing it if it does not exist.'''
+    os.makedirs(directory, exist_ok=True)
+    file_name = get_file_name(directory, n_points, n_trk, n_seg, hr, namespace)
+    if not os.path.exists(file_name):
+        tmp = file_name + '.tmp'
+        write_gpx(tmp, n_points, n_trk, n_seg, hr, namespace)
+        os.replace(tmp, file_name)
+    return file_name
@@ -0,0 +1,26 @@
+''' Shared fixtures for the tests.
+The modules are imported flat, as the scripts import each other, so the
+project directory is put on the path. GPX files are made with
+synthetic_gpx once per session.
+'''
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import synthetic_gpx
+
+@pytest.fixture(scope='session')
+def gpx_dir(tmp_path_factory):
+    return str(tmp_path_factory.mktemp('gpx'))
+
+@pytest.fixture(scope='session')
+def make_gpx(gpx_dir):
+    '''Returns a function that returns a synthetic GPX file, as for
+    synthetic_gpx.get_gpx_file.'''
+    def make(n_points=1000, n_trk=1, n_seg=1, hr=True, namespace='default'):
+        return synthetic_gpx.get_gpx_file(gpx_dir, n_points, n_trk, n_seg, hr, namespace)
+    return make
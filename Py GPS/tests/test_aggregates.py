@@ -0,0 +1,87 @@
+import os
+import shutil
+
+import numpy as np
+import pytest
+
+import aggregates as ag
+import synthetic_gpx
+
+NAME = 'Kenneth_Evans_2021-12-{day:02d}_12-01-33_{activity}_Kensington.gpx'
+
+@pytest.fixture
+def library(tmp_path):
+    '''Returns three files, two in one week.'''
+    files = []
+    for i, (day, activity) in enumerate([(4, 'Walking'), (5, 'Walking'), (20, 'Cycling')]):
+        file_name = str(tmp_path / NAME.format(day=day, activity=activity))
+        synthetic_gpx.write_gpx(file_name, 300 + 100 * i, seed=i)
+        files.append(file_name)
+    return files
+
+def test_activity_and_periods():
+    assert ag.get_activity(NAME.format(day=4, activity='Walking')) == 'Walking'
+    assert ag.get_activity('track.gpx') == ag.DEFAULT_ACTIVITY
+    periods = ag.get_periods('2021-12-04')
+    assert periods == {'day': '2021-12-04', 'week': '2021-W48', 'month': '2021-12'}
+
+def test_ele_gain():
+    ele = np.array([0., 2., 1., 5., 4., 10., 9.])
+    assert ag.get_ele_gain(ele, threshold=3.) == pytest.approx(10.)
+    assert ag.get_ele_gain(np.array([0., 1., 0., 1.]), threshold=3.) == 0.
+
+def test_incremental_matches_rebuild(library, tmp_path):
+    aggregates = ag.Aggregates(str(tmp_path / 'aggregates.json'))
+    assert aggregates.update(library) == (3, 0, [])
+    month = aggregates.query('month')
+    assert month['period'].tolist() == ['2021-12']
+    assert month['count'].tolist() == [3]
+    assert aggregates.query('week', activity='Walking')['count'].tolist() == [2]
+    # Remove one and compare with adding the other two again
+    aggregates.remove(library[1])
+    rebuilt = ag.Aggregates()
+    rebuilt.update([library[0], library[2]])
+    for level in ag.LEVELS:
+        result = aggregates.query(level, by_activity=True)
+        expected = rebuilt.query(level, by_activity=True)
+        for name in expected:
+            if expected[name].dtype.kind == 'f':
+                np.testing.assert_allclose(result[name], expected[name], rtol=1e-9, atol=1e-9)
+            else:
+                np.testing.assert_array_equal(result[name], expected[name])
+    aggregates.save()
+    loaded = ag.Aggregates(aggregates.file_name)
+    assert loaded.buckets == aggregates.buckets
+
+def test_changed_file_is_replaced(library):
+    aggregates = ag.Aggregates()
+    aggregates.update(library)
+    count = aggregates.query('month')['distance'][0]
+    shutil.copyfile(library[2], library[0])
+    os.utime(library[0], ns=(1, 1))
+    assert aggregates.update(library)[0] == 1
+    assert aggregates.query('month')['count'].tolist() == [3]
+    assert aggregates.query('month')['distance'][0] != pytest.approx(count)
+
+def test_error_summary_keeps_entry(library):
+    aggregates = ag.Aggregates()
+    aggregates.update(library)
+    aggregates(library[0], {'file_name': library[0], 'error': 'OSError: busy'})
+    assert aggregates.query('month')['count'].tolist() == [3]
+    aggregates(library[0], None)
+    assert aggregates.query('month')['count'].tolist() == [2]
+
+def test_moving_time_ignores_jitter():
+    from track import Track
+    # 5 min at 5 mph, then 5 min standing with about 0.3 m of GPS jitter
+    rng = np.random.default_rng(3)
+    step = 5 * 1609.344 / 3600 / 111195.
+    lat = np.concatenate((42.5 + step * np.arange(300),
+        42.5 + step * 300 + rng.normal(0, .3 / 111195., 300)))
+    lon = np.full(600, -83.6)
+    time = np.datetime64('2021-12-04T12:00:00') + np.arange(600).astype('timedelta64[s]')
+    track = Track(lat, lon, np.zeros(600), np.zeros(600), time)
+    stats = ag.get_stats(track)
+    assert stats[ag.STATS.index('elapsed_time')] == pytest.approx(599 / 60.)
+    # The raw speed counts about 6.5 min, the filter only smears the stop
+    assert 5. <= stats[ag.STATS.index('moving_time')] < 6.
@@ -0,0 +1,77 @@
+import json
+
+import batch
+
+def test_process_file(make_gpx):
+    summary = batch.process_file(make_gpx(500))
+    assert 'error' not in summary
+    assert summary['n_points'] == 500
+    assert summary['max_speed'] > 0
+    json.dumps(summary)
+
+def test_cache_gives_the_same_summary(make_gpx, tmp_path):
+    file_name = make_gpx(500, 1, 2)
+    expected = batch.process_file(file_name)
+    for i in range(2):
+        assert batch.process_file(file_name, cache_dir=str(tmp_path)) == expected
+
+def test_run_batch_keeps_going(make_gpx, tmp_path):
+    bad = tmp_path / 'bad.gpx'
+    bad.write_text('<gpx')
+    files = [make_gpx(300), str(bad), make_gpx(400)]
+    summaries = list(batch.run_batch(files, jobs=2))
+    assert [summary['file_name'] for summary in summaries] == files
+    assert 'error' in summaries[1]
+    assert [summary['n_points'] for summary in summaries] == [300, 0, 400]
+
+def test_find_files(make_gpx, gpx_dir):
+    file_name = make_gpx(300)
+    found = batch.find_files([gpx_dir, file_name])
+    assert found.count(file_name) == 1
+
+def test_failed_step_still_serializes(make_gpx, tmp_path, monkeypatch):
+    import py_gps
+
+    def fail(*args, **kwargs):
+        raise RuntimeError('no plot')
+    monkeypatch.setattr(py_gps, 'plot_speed_hr', fail)
+    summary = batch.process_file(make_gpx(500), plot_dir=str(tmp_path))
+    assert summary['error'] == 'RuntimeError: no plot'
+    assert json.loads(json.dumps(summary))['start_time'] == summary['start_time']
+    assert isinstance(summary['end_time'], str)
+
+def test_max_speed_matches_main(make_gpx):
+    import gpx_stream
+    import resampling
+    import speed as s
+    file_name = make_gpx(800, 1, 2)
+    track = gpx_stream.read_track(file_name)
+    speed = s.get_speed(track)[0]
+    expected = s.process_speed(track, speed, fs=resampling.get_fs(track), uniform=True,
+        zero_phase=True)
+    assert batch.process_file(file_name)['max_speed'] == float(max(expected))
+
+def remove_times(source, file_name, indices):
+    '''Copies the GPX file source to file_name without the time of the
+    trackpoints at indices.'''
+    with open(source) as f:
+        lines = f.read().split('<trkpt ')
+    for i in indices:
+        start = lines[i + 1].index('<time>')
+        end = lines[i + 1].index('</time>') + len('</time>')
+        lines[i + 1] = lines[i + 1][:start] + lines[i + 1][end:]
+    with open(file_name, 'w') as f:
+        f.write('<trkpt '.join(lines))
+    return str(file_name)
+
+def test_missing_times_give_valid_json(make_gpx, tmp_path):
+    first = remove_times(make_gpx(300), tmp_path / 'first.gpx', [0])
+    middle = remove_times(make_gpx(300), tmp_path / 'middle.gpx', [150])
+    json_name = str(tmp_path / 'out.json')
+    batch.main(['-j', '1', '--json', json_name, first, middle, make_gpx(400)])
+    with open(json_name) as f:
+        # Fails on NaN
+        summaries = json.load(f, parse_constant=lambda name: 1 / 0)
+    assert [summary['n_points'] for summary in summaries] == [300, 300, 400]
+    assert summaries[0]['start_time'] is None
+    assert summaries[1]['max_speed'] > 0
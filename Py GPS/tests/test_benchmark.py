@@ -0,0 +1,12 @@
+import benchmark
+
+def test_gpx10_skips_the_gpxpy_stages(make_gpx):
+    results = benchmark.run_case(make_gpx(300, namespace='gpx10'), 300, repeat=1, memory=False)
+    for stage in ('get_gpx(reparse=True)', 'get_gpx_info', 'get_gpx_data', 'get_speed',
+            'process_speed'):
+        assert 'skipped' in results[stage]
+    assert 'time' in results['read_track']
+
+def test_default_runs_every_stage(make_gpx):
+    results = benchmark.run_case(make_gpx(300), 300, repeat=1, memory=False)
+    assert all('time' in result for result in results.values())
@@ -0,0 +1,38 @@
+import datetime
+from zoneinfo import ZoneInfo
+
+import numpy as np
+
+import decimate
+
+def test_minmax_keeps_extremes():
+    rng = np.random.default_rng(2)
+    y = rng.normal(size=100000)
+    index = decimate.minmax_indices(y, 500)
+    assert len(index) <= 4 * 500
+    assert np.all(np.diff(index) > 0)
+    assert y[index].max() == y.max() and y[index].min() == y.min()
+    assert index[0] == 0 and index[-1] == len(y) - 1
+
+def test_short_series_is_kept():
+    assert decimate.minmax_indices(np.arange(10.), 100).tolist() == list(range(10))
+
+def test_lttb():
+    x = np.arange(10000.)
+    y = np.sin(x / 100.)
+    index = decimate.lttb_indices(x, y, 200)
+    assert len(index) == 200
+    assert index[0] == 0 and index[-1] == 9999
+
+def test_datetime64_x():
+    x = np.arange(20000).astype('datetime64[s]')
+    x_out, y_out = decimate.decimate(x, np.arange(20000.), 100)
+    assert x_out.dtype.kind == 'M'
+    assert len(x_out) <= 400
+
+def test_datetimes_x():
+    start = datetime.datetime(2021, 12, 4, 12, tzinfo=ZoneInfo('America/Detroit'))
+    x = [start + datetime.timedelta(seconds=i) for i in range(20000)]
+    index = decimate.decimate_indices(x, np.sin(np.arange(20000.) / 50), 100)
+    assert 0 < len(index) <= 400
+    assert decimate.to_float(x[:2]).tolist() == [x[0].timestamp() * 1e9, x[1].timestamp() * 1e9]
@@ -0,0 +1,62 @@
+import haversine
+import numpy as np
+
+import enu
+
+def test_round_trip():
+    projection = enu.Projection(42.5, -83.6)
+    lat = 42.5 + np.linspace(-.2, .2, 11)
+    lon = -83.6 + np.linspace(-.3, .3, 11)
+    x, y = projection.forward(lat, lon)
+    lat2, lon2 = projection.inverse(x, y)
+    np.testing.assert_allclose(lat2, lat, atol=1e-9)
+    np.testing.assert_allclose(lon2, lon, atol=1e-9)
+
+def test_steps_match_haversine_within_bound():
+    rng = np.random.default_rng(1)
+    lat = 42.5 + rng.normal(0, .05, 1000).cumsum() / 100
+    lon = -83.6 + rng.normal(0, .05, 1000).cumsum() / 100
+    projection = enu.Projection.from_points(lat, lon)
+    x, y = projection.forward(lat, lon)
+    steps = enu.get_steps(x, y)
+    expected = haversine.haversine_vector(np.column_stack((lat[1:], lon[1:])),
+        np.column_stack((lat[:-1], lon[:-1])), unit=haversine.Unit.METERS)
+    rho = np.hypot(x, y).max()
+    np.testing.assert_allclose(steps, expected, rtol=2 * enu.get_error_bound(rho) + 1e-9)
+
+def test_far_side_is_nan():
+    x, y = enu.Projection(0., 0.).forward([0., 0.], [10., 170.])
+    assert np.isfinite(x[0]) and np.isnan(x[1])
+
+def test_bearings_and_curvature():
+    assert enu.get_bearings([0., 0., 1.], [0., 1., 1.]).tolist() == [0., 90.]
+    # A circle of radius 100 m turning left
+    angle = np.linspace(0, np.pi, 50)
+    curvature = enu.get_curvature(100 * np.cos(angle), 100 * np.sin(angle))
+    np.testing.assert_allclose(curvature[1:-1], .01, rtol=1e-6)
+
+def test_step_lengths_far_apart():
+    # Detroit, Miami, and Sydney runs, each about 1 km, with the far points
+    # falling back to the great circle distance
+    rng = np.random.default_rng(2)
+    runs = []
+    for lat0, lon0 in ((42.5, -83.6), (25.8, -80.2), (-33.9, 151.2)):
+        runs.append((lat0 + rng.normal(0, 1e-4, 100).cumsum(),
+            lon0 + rng.normal(0, 1e-4, 100).cumsum()))
+    lat = np.concatenate([run[0] for run in runs])
+    lon = np.concatenate([run[1] for run in runs])
+    expected = haversine.haversine_vector(np.column_stack((lat[1:], lon[1:])),
+        np.column_stack((lat[:-1], lon[:-1])), unit=haversine.Unit.METERS)
+    np.testing.assert_allclose(enu.get_great_circle_steps(lat, lon), expected, rtol=1e-9)
+    # One plane for all of them: Sydney cannot be projected
+    x, y = enu.get_xy(lat, lon)
+    assert np.isnan(x).any()
+    steps = enu.get_step_lengths(lat, lon, x, y)
+    np.testing.assert_allclose(steps, expected, rtol=1e-6)
+    # A plane for each run
+    x, y = enu.get_xy(lat, lon, [0, 100, 200, 300])
+    assert np.hypot(x, y).max() < enu.MAX_RHO
+    steps = enu.get_step_lengths(lat, lon, x, y)
+    within = np.ones(len(steps), dtype=bool)
+    within[[99, 199]] = False
+    np.testing.assert_allclose(steps[within], expected[within], rtol=1e-8)
@@ -0,0 +1,38 @@
+import xml.etree.ElementTree as ET
+
+import numpy as np
+import pytest
+
+from extensions import ExtensionReader, get_missing
+
+TPX = 'http://www.garmin.com/xmlschemas/TrackPointExtension/v2'
+
+def get_children(text):
+    return list(ET.fromstring(f'<extensions xmlns:t="{TPX}">{text}</extensions>'))
+
+def test_trackpoint_extension():
+    reader = ExtensionReader({'t': TPX}, fields=('hr', 'cad', 'atemp'))
+    values = reader.read(get_children(
+        '<t:TrackPointExtension><t:hr>123</t:hr><t:cad>80</t:cad></t:TrackPointExtension>'))
+    assert values[0] == 123
+    assert values[1] == 80
+    assert np.isnan(values[2])
+
+def test_unregistered_namespace():
+    # Namespaces not in nsmap are resolved when first seen
+    reader = ExtensionReader(fields=('hr',))
+    children = get_children('<t:TrackPointExtension><t:hr>99</t:hr></t:TrackPointExtension>')
+    assert reader.read(children) == [99]
+
+def test_missing_values():
+    reader = ExtensionReader(fields=('hr', 'power'))
+    reader.append([])
+    reader.append(get_children('<power>250</power>'))
+    arrays = reader.arrays()
+    assert arrays['hr'].tolist() == [get_missing('hr'), get_missing('hr')]
+    assert arrays['power'].tolist() == [get_missing('power'), 250]
+    assert arrays['power'].dtype == np.uint16
+
+def test_unknown_field():
+    with pytest.raises(ValueError):
+        ExtensionReader(fields=('speed',))
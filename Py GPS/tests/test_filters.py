@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+from scipy.signal import sosfilt, sosfiltfilt
+
+import filters
+
+@pytest.fixture
+def series():
+    rng = np.random.default_rng(0)
+    return [rng.normal(size=n).cumsum() for n in (5, 20, 31, 32, 100, 1000)]
+
+@pytest.mark.parametrize('zero_phase', [False, True])
+def test_filter_batch_matches_scipy(series, zero_phase):
+    sos = filters.get_sos(5, .04, 1.)
+    padlen = filters.get_padlen(sos)
+    result = filters.filter_batch(series, .04, 1., zero_phase=zero_phase)
+    for values, filtered in zip(series, result):
+        if not zero_phase:
+            expected = sosfilt(sos, values)
+        elif len(values) > padlen:
+            expected = sosfiltfilt(sos, values)
+        else:
+            expected = sosfiltfilt(sos, values, padlen=len(values) - 1)
+        np.testing.assert_allclose(filtered, expected, rtol=1e-10, atol=1e-10)
+
+def test_filter_runs(series):
+    values = np.concatenate(series)
+    offsets = np.concatenate(([0], np.cumsum([len(s) for s in series])))
+    result = filters.filter_runs(values, offsets, .04, 1., zero_phase=True)
+    expected = np.concatenate(filters.filter_batch(series, .04, 1., zero_phase=True))
+    np.testing.assert_array_equal(result, expected)
+
+def test_designs_are_cached():
+    assert filters.get_sos(5, .04, 1.) is filters.get_sos(5, .04, 1.)
+
+def test_empty():
+    assert filters.filter_batch([], .04, 1.) == []
+    assert filters.filter_runs([], [0], .04, 1.).size == 0
+
+def test_length_groups():
+    groups = filters.get_length_groups([1000, 3, 5, 600, 0, 4, 1])
+    assert sorted(sorted(group.tolist()) for group in groups) == [[0, 3], [1], [2, 5], [4, 6]]
+    for group in groups:
+        lengths = np.maximum(np.array([1000, 3, 5, 600, 0, 4, 1])[group], 1)
+        assert lengths.max() < 2 * lengths.min()
+
+def test_one_long_series_does_not_pad_the_rest(monkeypatch):
+    series = [np.ones(100000)] + [np.ones(50)] * 200
+    widths = []
+    pad_rows = filters.pad_rows
+
+    def record(rows, *args):
+        result = pad_rows(rows, *args)
+        widths.append(result[0].shape)
+        return result
+    monkeypatch.setattr(filters, 'pad_rows', record)
+    result = filters.filter_batch(series, .04, 1., zero_phase=True)
+    assert sum(rows * width for rows, width in widths) < 2 * sum(len(s) for s in series)
+    np.testing.assert_allclose(result[0], 1.)
+    np.testing.assert_allclose(result[1], 1.)
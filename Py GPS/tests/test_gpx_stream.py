@@ -0,0 +1,131 @@
+import gzip
+import shutil
+
+import numpy as np
+import pytest
+
+import gpx_stream
+import py_gps
+
+@pytest.mark.parametrize('namespace', ['default', 'prefixed'])
+def test_read_gpx_data_matches_get_gpx_data(make_gpx, namespace):
+    file_name = make_gpx(2000, 2, 3, namespace=namespace)
+    expected = py_gps.get_gpx_data(py_gps.get_gpx(file_name))
+    lat, lon, ele, hr, time = gpx_stream.read_gpx_data(file_name)
+    np.testing.assert_array_equal(lat, expected[0])
+    np.testing.assert_array_equal(lon, expected[1])
+    np.testing.assert_array_equal(ele, expected[2])
+    np.testing.assert_array_equal(hr, expected[3])
+    assert time == expected[4]
+
+def test_read_track_matches_get_gpx_track(make_gpx):
+    file_name = make_gpx(2000, 2, 3)
+    expected = py_gps.get_gpx_track(py_gps.get_gpx(file_name), fields=('hr', 'cad'))
+    track = gpx_stream.read_track(file_name, fields=('hr', 'cad'))
+    for name in ('lat', 'lon', 'ele', 'hr', 'time', 'seg_offsets', 'trk_offsets'):
+        np.testing.assert_array_equal(getattr(track, name), getattr(expected, name))
+    np.testing.assert_array_equal(track.extras['cad'], expected.extras['cad'])
+    assert track.tz_name == expected.tz_name
+
+MIXED = '''<?xml version="1.0" encoding="UTF-8"?>
+<gpx xmlns="http://www.topografix.com/GPX/1/1"
+    xmlns:tpx="http://www.garmin.com/xmlschemas/TrackPointExtension/v1"
+    xmlns:pwr="http://www.garmin.com/xmlschemas/PowerExtension/v1" version="1.1">
+  <metadata><time>2021-12-04T17:00:00Z</time></metadata>
+  <trk><trkseg>
+    <trkpt lat="42.5" lon="-83.6"><ele>250.5</ele><time>2021-12-04T17:01:33Z</time>
+      <extensions><tpx:TrackPointExtension><tpx:atemp>21.5</tpx:atemp>
+        <tpx:hr>101</tpx:hr><tpx:cad>60</tpx:cad></tpx:TrackPointExtension>
+        <pwr:PowerInWatts>250</pwr:PowerInWatts></extensions></trkpt>
+    <trkpt lat="42.6" lon="-83.7"><time>2021-12-04T12:01:34-05:00</time>
+      <extensions><hr>102</hr><other><hr>1</hr></other></extensions></trkpt>
+    <trkpt lat="42.7" lon="-83.8"><ele>251</ele><time>2021-12-04T17:01:35Z</time>
+      <extensions><tpx:TrackPointExtension><tpx:hr></tpx:hr>
+        <tpx:hr>99</tpx:hr></tpx:TrackPointExtension></extensions></trkpt>
+  </trkseg><trkseg/></trk>
+  <trk><name>Empty</name></trk>
+</gpx>
+'''
+
+def test_mixed_extensions_match_get_gpx_track(tmp_path):
+    file_name = str(tmp_path / 'mixed.gpx')
+    with open(file_name, 'w') as f:
+        f.write(MIXED)
+    fields = ('hr', 'cad', 'atemp', 'power')
+    expected = py_gps.get_gpx_track(py_gps.get_gpx(file_name), fields=fields)
+    track = gpx_stream.read_track(file_name, fields=fields)
+    for name in ('lat', 'lon', 'ele', 'hr', 'time', 'seg_offsets', 'trk_offsets'):
+        np.testing.assert_array_equal(getattr(track, name), getattr(expected, name))
+    for name in fields[1:]:
+        np.testing.assert_array_equal(track.extras[name], expected.extras[name])
+    assert track.hr.tolist() == [101, 102, 0]
+    assert track.extras['power'][0] == 250
+
+TWO_ZONES = '''<?xml version="1.0" encoding="UTF-8"?>
+<gpx xmlns="http://www.topografix.com/GPX/1/1" version="1.1">
+  <trk><trkseg>
+    <trkpt lat="42.5329" lon="-83.6386"><time>2021-12-04T17:01:33Z</time></trkpt>
+    <trkpt lat="42.5330" lon="-83.6387"><time>2021-12-04T17:01:34Z</time></trkpt>
+  </trkseg></trk>
+  <trk><trkseg>
+    <trkpt lat="41.8781" lon="-87.6298"><time>2021-12-05T17:01:33Z</time></trkpt>
+    <trkpt lat="41.8782" lon="-87.6299"><time>2021-12-05T17:01:34Z</time></trkpt>
+  </trkseg></trk>
+</gpx>
+'''
+
+def test_timezone_of_each_track(tmp_path):
+    file_name = str(tmp_path / 'two_zones.gpx')
+    with open(file_name, 'w') as f:
+        f.write(TWO_ZONES)
+    track = gpx_stream.read_track(file_name)
+    assert track.tz_name == ('America/Detroit', 'America/Chicago')
+    assert track.tz_name == py_gps.get_gpx_track(py_gps.get_gpx(file_name)).tz_name
+    time = py_gps.get_gpx_data(py_gps.get_gpx(file_name))[4]
+    assert track.datetimes() == time
+    assert [t.utcoffset().total_seconds() / 3600 for t in time] == [-5, -5, -6, -6]
+    assert track.local_time()[2] == np.datetime64('2021-12-05T11:01:33')
+    batches = list(gpx_stream.iter_batches(file_name, 1, timezone=True))
+    assert [batch.track.tz_name for batch in batches] == \
+        ['America/Detroit'] * 2 + ['America/Chicago'] * 2
+
+def test_gpx10_namespace(make_gpx):
+    track = gpx_stream.read_track(make_gpx(1000, namespace='gpx10'), timezone=False)
+    default = gpx_stream.read_track(make_gpx(1000), timezone=False)
+    assert len(track) == 1000
+    np.testing.assert_array_equal(track.hr, default.hr)
+
+def test_gzip(make_gpx, tmp_path):
+    file_name = make_gpx(1000, 1, 2)
+    gz_name = str(tmp_path / 'track.gpx.gz')
+    with open(file_name, 'rb') as f, gzip.open(gz_name, 'wb') as out:
+        shutil.copyfileobj(f, out)
+    track = gpx_stream.read_track(gz_name, timezone=False)
+    expected = gpx_stream.read_track(file_name, timezone=False)
+    np.testing.assert_array_equal(track.lat, expected.lat)
+    np.testing.assert_array_equal(track.seg_offsets, expected.seg_offsets)
+
+@pytest.mark.parametrize('batch_size', [7, 333, 500, 1000, 5000])
+def test_iter_batches_matches_read_track(make_gpx, batch_size):
+    file_name = make_gpx(3000, 2, 3)
+    full = gpx_stream.read_track(file_name, timezone=False)
+    batches = list(gpx_stream.iter_batches(file_name, batch_size))
+    assert all(len(batch.track) <= batch_size for batch in batches)
+    for name in ('lat', 'lon', 'ele', 'hr', 'time'):
+        np.testing.assert_array_equal(
+            np.concatenate([getattr(batch.track, name) for batch in batches]),
+            getattr(full, name))
+    # Put the segments and tracks back together
+    seg_starts = []
+    trk_starts = []
+    n_seg = 0
+    for batch in batches:
+        starts = (batch.track.seg_offsets[:-1] + batch.start).tolist()
+        skip_seg = 1 if batch.continues else 0
+        skip_trk = 1 if batch.continues_trk else 0
+        trk_starts.extend(i + n_seg - skip_seg
+            for i in batch.track.trk_offsets[:-1].tolist()[skip_trk:])
+        seg_starts.extend(starts[skip_seg:])
+        n_seg += len(starts) - skip_seg
+    assert seg_starts == full.seg_offsets[:-1].tolist()
+    assert trk_starts == full.trk_offsets[:-1].tolist()
@@ -0,0 +1,53 @@
+import gzip
+
+import numpy as np
+import pytest
+
+import gpx_stream
+import gpx_writer
+import simplify
+
+@pytest.mark.parametrize('namespace', ['default', 'prefixed'])
+def test_round_trip(make_gpx, tmp_path, namespace):
+    file_name = make_gpx(500, 2, 2, namespace=namespace)
+    fields = ('hr', 'cad')
+    track = gpx_stream.read_track(file_name, fields=fields, timezone=False)
+    out = str(tmp_path / 'out.gpx')
+    n = gpx_writer.write_track(out, track, nsmap=gpx_writer.get_nsmap(file_name))
+    assert n == len(track)
+    track2 = gpx_stream.read_track(out, fields=fields, timezone=False)
+    np.testing.assert_array_equal(track2.lat, track.lat)
+    np.testing.assert_array_equal(track2.lon, track.lon)
+    np.testing.assert_array_equal(track2.ele, track.ele)
+    np.testing.assert_array_equal(track2.time, track.time)
+    np.testing.assert_array_equal(track2.hr, track.hr)
+    np.testing.assert_array_equal(track2.extras['cad'], track.extras['cad'])
+    np.testing.assert_array_equal(track2.seg_offsets, track.seg_offsets)
+    np.testing.assert_array_equal(track2.trk_offsets, track.trk_offsets)
+
+def test_gzip_and_mask(make_gpx, tmp_path):
+    track = gpx_stream.read_track(make_gpx(2000), timezone=False)
+    mask = simplify.simplify(track, tolerance=5.)
+    out = str(tmp_path / 'out.gpx.gz')
+    speed = np.arange(len(track), dtype=np.float64)
+    n = gpx_writer.write_track(out, track, derived={'speed': speed}, mask=mask)
+    assert n == mask.sum()
+    track2 = gpx_stream.read_track(out, timezone=False)
+    np.testing.assert_array_equal(track2.time, track.time[mask])
+
+def test_abort_leaves_no_file(tmp_path):
+    out = tmp_path / 'out.gpx'
+    with pytest.raises(RuntimeError):
+        with gpx_writer.GpxWriter(str(out)) as writer:
+            writer.start_track()
+            raise RuntimeError
+    assert not out.exists()
+
+def test_nsmap_of_gzip_file(make_gpx, tmp_path):
+    file_name = make_gpx(10, namespace='prefixed')
+    out = str(tmp_path / 'in.gpx.gz')
+    with open(file_name, 'rb') as f, gzip.open(out, 'wb') as g:
+        g.write(f.read())
+    nsmap = gpx_writer.get_nsmap(file_name)
+    assert nsmap
+    assert gpx_writer.get_nsmap(out) == nsmap
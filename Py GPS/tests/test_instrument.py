@@ -0,0 +1,48 @@
+import json
+
+import pytest
+
+import instrument
+
+@pytest.fixture
+def enabled():
+    instrument.reset()
+    instrument.enable(memory=False)
+    yield
+    instrument.disable()
+    instrument.reset()
+
+def test_stages_and_files(enabled):
+    @instrument.timed('work')
+    def work():
+        return sum(range(1000))
+    with instrument.file('track.gpx'):
+        instrument.add_points(10)
+        for i in range(3):
+            work()
+    results = instrument.take()
+    assert results['stages']['work']['calls'] == 3
+    assert results['files']['track.gpx']['points'] == 10
+    assert instrument.get_results()['stages'] == {}
+    # As the results of two workers
+    instrument.merge(results)
+    instrument.merge(results)
+    assert instrument.get_results()['stages']['work']['calls'] == 6
+    assert 'work' in instrument.format_results()
+
+@pytest.mark.parametrize('format', instrument.FORMATS)
+def test_dump(enabled, tmp_path, format):
+    with instrument.stage('read'):
+        pass
+    file_name = str(tmp_path / 'profile.json')
+    instrument.dump(file_name, format)
+    with open(file_name) as f:
+        data = json.load(f)
+    stages = data['otherData']['stages'] if format == 'trace' else data['stages']
+    assert stages['read']['calls'] == 1
+
+def test_disabled_records_nothing():
+    instrument.reset()
+    with instrument.stage('read'):
+        pass
+    assert instrument.get_results()['stages'] == {}
@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+import render
+
+render.use_agg()
+
+import matplotlib.pyplot as plt
+
+import gpx_stream
+import py_gps
+import speed as s
+
+@pytest.fixture
+def saved(monkeypatch):
+    '''Keeps the figures plotted instead of closing them.'''
+    figures = []
+    monkeypatch.setattr(render, 'show_or_save', lambda fig, file_name=None: figures.append(fig))
+    yield figures
+    for fig in figures:
+        plt.close(fig)
+
+@pytest.mark.parametrize('plot', ['plot_speed_hr', 'plot_speed_hr_1', 'plot_speed'])
+def test_track_is_plotted_in_local_time(make_gpx, saved, plot):
+    track = gpx_stream.read_track(make_gpx(500))
+    assert track.tz_name == 'America/Detroit'
+    speed = s.get_speed(track)[0]
+    if plot == 'plot_speed':
+        s.plot_speed(track, speed, speed)
+    else:
+        getattr(py_gps, plot)(track, speed)
+    x = saved[0].axes[0].lines[0].get_xdata(orig=True)
+    np.testing.assert_array_equal(x, track.local_time())
+    # Detroit is UTC-5 in December
+    assert x[0] == track.datetime64[0] - np.timedelta64(5, 'h')
+
+def test_datetimes_longer_than_the_threshold(make_gpx, saved):
+    lat, lon, ele, hr, time = gpx_stream.read_gpx_data(make_gpx(5000))
+    assert len(time) > 4 * render.get_pixel_width(plt.figure(figsize=(10, 6)))
+    plt.close()
+    speed = s.get_speed(lat, lon, time)[0]
+    py_gps.plot_speed_hr(time, speed, hr)
+    py_gps.plot_speed_hr_1(time, speed, hr)
+    s.plot_speed(time, speed, speed)
+    for fig in saved:
+        line = fig.axes[0].lines[0]
+        assert len(line.get_xdata()) < len(time)
@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+
+import gpx_stream
+import py_gps_2
+
+@pytest.fixture
+def track(make_gpx):
+    return gpx_stream.read_track(make_gpx(600, 1, 3))
+
+def test_dataframe_columns(track):
+    df = py_gps_2.get_dataframe(track)
+    assert len(df) == len(track)
+    np.testing.assert_array_equal(df['lat'].to_numpy(), track.lat)
+    assert str(df['time'].dt.tz) == track.tz_name
+    assert df['hr'].dtype == 'Int16'
+    assert df['seg'].tolist() == track.segment_ids().tolist()
+
+def test_speed_has_no_steps_across_segments(track):
+    df = py_gps_2.get_dataframe(track)
+    py_gps_2.get_speed(df)
+    starts = track.seg_offsets[:-1]
+    assert (df['dist'].to_numpy()[starts] == 0).all()
+    assert (df['time_dif'].to_numpy()[starts] == 0).all()
+    # About 1.4 m/s
+    speed = df['speed'].to_numpy()
+    assert 2. < np.median(speed[speed > 0]) < 4.
+
+def test_original_speed_arguments(make_gpx):
+    import py_gps
+    gpx = py_gps.get_gpx(make_gpx(600, 1, 3))
+    df = py_gps_2.get_data(gpx)
+    expected = df.copy()
+    py_gps_2.get_speed(expected)
+    py_gps_2.get_speed(gpx.tracks[0].segments[0].points, df)
+    np.testing.assert_array_equal(df['speed'].to_numpy(), expected['speed'].to_numpy())
+    np.testing.assert_array_equal(df['dist_hav_2d'].to_numpy(), expected['dist'].to_numpy())
@@ -0,0 +1,49 @@
+import numpy as np
+
+import resampling
+
+NS = resampling.NS_PER_SEC
+
+def test_uniform_times_round_trip():
+    time_ns = np.arange(100, dtype=np.int64) * NS
+    resampler = resampling.Resampler(time_ns, fs=1.)
+    np.testing.assert_array_equal(resampler.grid, time_ns)
+    values = np.sin(np.arange(100) / 10.)
+    np.testing.assert_allclose(resampler.to_original(resampler.resample(values)), values)
+
+def test_linear_interpolation():
+    time_ns = np.array([0, 2, 4], dtype=np.int64) * NS
+    resampler = resampling.Resampler(time_ns, fs=1.)
+    np.testing.assert_allclose(resampler.resample([0., 2., 6.]), [0., 1., 2., 4., 6.])
+    np.testing.assert_allclose(resampler.resample([0., 2., 6.], method='hold'),
+        [0., 0., 2., 2., 6.])
+
+def test_runs_split_at_segments_and_gaps():
+    time_ns = np.concatenate((np.arange(10), np.arange(100, 110))).astype(np.int64) * NS
+    runs = resampling.get_runs(time_ns, seg_offsets=[0, 5, 20], max_gap=5.)
+    assert runs.tolist() == [0, 5, 10, 20]
+
+def test_get_fs():
+    time_ns = np.arange(50, dtype=np.int64) * 2 * NS
+    assert resampling.get_fs(time_ns) == .5
+
+def test_short_dropouts_are_filled():
+    # 1 Hz with a 10 s dropout and a 5 min pause
+    time_ns = np.concatenate((np.arange(100), np.arange(110, 200), np.arange(500, 600)))
+    resampler = resampling.Resampler(time_ns.astype(np.int64) * NS, fs=1.)
+    assert resampler.run_offsets.tolist() == [0, 190, 290]
+    assert resampler.max_gap == resampling.DEFAULT_MAX_GAP
+
+def test_nat_points_are_left_out():
+    time = np.arange(100).astype('datetime64[s]').astype('datetime64[ns]')
+    time[[0, 50, 99]] = np.datetime64('NaT')
+    resampler = resampling.Resampler(time, fs=1., seg_offsets=[0, 60, 100])
+    # The grid fills in the time of point 50
+    assert len(resampler.grid) == 98
+    assert resampler.run_offsets.tolist() == [0, 58, 97]
+    values = np.arange(100.)
+    result = resampler.to_original(resampler.resample(values))
+    assert np.isnan(result[[0, 50, 99]]).all()
+    keep = np.ones(100, dtype=bool)
+    keep[[0, 50, 99]] = False
+    np.testing.assert_allclose(result[keep], values[keep])
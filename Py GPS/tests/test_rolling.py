@@ -0,0 +1,68 @@
+import datetime
+
+import numpy as np
+import pytest
+
+import rolling
+
+def brute(values, starts, func):
+    return np.array([func(values[start:i + 1]) for i, start in enumerate(starts)])
+
+@pytest.fixture
+def data():
+    rng = np.random.default_rng(3)
+    values = rng.normal(size=500)
+    time = np.cumsum(rng.integers(1, 5, 500)).astype('datetime64[s]')
+    return values, time
+
+@pytest.mark.parametrize('window', [1, 5, 60, datetime.timedelta(seconds=30),
+    np.timedelta64(5, 'm')])
+def test_stats_match_brute_force(data, window):
+    values, time = data
+    result = rolling.rolling_stats(values, window, time, stats=rolling.STATS)[window]
+    time_ns = rolling.get_time_ns(time)
+    starts = rolling.get_starts(len(values), window, time_ns)
+    np.testing.assert_allclose(result['mean'], brute(values, starts, np.mean), atol=1e-12)
+    np.testing.assert_allclose(result['std'], brute(values, starts, np.std), atol=1e-6)
+    np.testing.assert_array_equal(result['min'], brute(values, starts, np.min))
+    np.testing.assert_array_equal(result['max'], brute(values, starts, np.max))
+
+def test_several_windows(data):
+    values, time = data
+    windows = [3, datetime.timedelta(seconds=20)]
+    result = rolling.rolling_stats(values, windows, time, stats=('min', 'max'))
+    for window in windows:
+        single = rolling.rolling_stats(values, window, time, stats=('min', 'max'))[window]
+        np.testing.assert_array_equal(result[window]['min'], single['min'])
+        np.testing.assert_array_equal(result[window]['max'], single['max'])
+
+def test_errors(data):
+    values, time = data
+    with pytest.raises(ValueError):
+        rolling.rolling_stats(values, 0)
+    with pytest.raises(ValueError):
+        rolling.rolling_stats(values, datetime.timedelta(seconds=5))
+    with pytest.raises(ValueError):
+        rolling.rolling_stats(values, 5, stats=('median',))
+    for window in (np.timedelta64(0, 's'), datetime.timedelta(seconds=-5)):
+        with pytest.raises(ValueError):
+            rolling.rolling_stats(values, window, time, stats=('mean', 'min'))
+
+def test_single_point_std_is_zero(data):
+    values, time = data
+    assert (rolling.rolling_stats(values + 1e4, 1, stats=('std',))[1]['std'] == 0.).all()
+
+def test_windows_stop_at_reversals_and_missing_times(data):
+    values, time = data
+    window = datetime.timedelta(seconds=30)
+    # Two tracks merged in the wrong order, and a point without a time
+    time = np.concatenate((time[250:], time[:250]))
+    time[100] = np.datetime64('NaT')
+    result = rolling.rolling_stats(values, window, time, stats=rolling.STATS)[window]
+    for start, end in ((0, 100), (101, 250), (250, 500)):
+        part = rolling.rolling_stats(values[start:end], window, time[start:end],
+            stats=rolling.STATS)[window]
+        for stat in rolling.STATS:
+            np.testing.assert_allclose(result[stat][start:end], part[stat], atol=1e-9)
+    assert result['mean'][100] == pytest.approx(values[100])
+    assert result['max'][100] == values[100]
@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+
+import gpx_stream
+import simplify
+
+@pytest.mark.parametrize('tolerance', [1., 5., 20.])
+def test_dp_error_within_tolerance(make_gpx, tolerance):
+    track = gpx_stream.read_track(make_gpx(5000), timezone=False)
+    mask = simplify.simplify(track, tolerance=tolerance)
+    assert mask[0] and mask[-1]
+    assert mask.sum() < len(track)
+    assert simplify.get_max_error(track, None, mask) <= tolerance + 1e-6
+
+def test_segments_keep_end_points(make_gpx):
+    track = gpx_stream.read_track(make_gpx(1200, 2, 3), timezone=False)
+    mask = simplify.simplify(track, tolerance=50.)
+    assert mask[track.seg_offsets[:-1]].all()
+    assert mask[track.seg_offsets[1:] - 1].all()
+
+def test_vw(make_gpx):
+    track = gpx_stream.read_track(make_gpx(2000), timezone=False)
+    mask = simplify.simplify(track, tolerance=5., method='vw')
+    assert 2 <= mask.sum() < len(track)
+    with pytest.raises(ValueError):
+        simplify.simplify(track, method='xx')
+
+def test_far_glitch_is_kept(make_gpx):
+    track = gpx_stream.read_track(make_gpx(2000), timezone=False)
+    track.lat[1000], track.lon[1000] = -33.9, 151.2
+    mask = simplify.simplify(track, tolerance=5.)
+    assert mask[1000]
+    # The rest is still simplified, not cut down to the end points
+    assert 10 < mask.sum() < len(track)
+    assert simplify.get_max_error(track, None, mask) <= 5. + 1e-6
+
+def test_vw_removes_smallest_first():
+    rng = np.random.default_rng(0)
+    x = np.cumsum(rng.normal(0., 10., 300))
+    y = np.cumsum(rng.normal(0., 10., 300))
+    min_area = 500.
+    mask = simplify.visvalingam_whyatt_xy(x, y, min_area)
+    # Remove the smallest triangle, one at a time
+    index = np.arange(len(x))
+    while True:
+        areas = simplify.triangle_areas(x, y, index)
+        i = int(np.argmin(areas))
+        if areas[i] >= min_area:
+            break
+        index = np.delete(index, i)
+    np.testing.assert_array_equal(np.flatnonzero(mask), index)
@@ -0,0 +1,70 @@
+import numpy as np
+
+import gpx_stream
+import gpx_writer
+import spatial_index
+from track import Track
+
+def test_query_finds_track(make_gpx, tmp_path):
+    file_name = make_gpx(2000, 1, 2)
+    index = spatial_index.SpatialIndex(str(tmp_path / 'index'))
+    assert index.update([file_name]) == (1, 0, [])
+    track = gpx_stream.read_track(file_name, timezone=False)
+    i = len(track) // 3
+    ranges = index.query_radius(track.lat[i], track.lon[i], 20.)
+    assert ranges and all(r['file_name'] == file_name for r in ranges)
+    assert any(r['start_index'] <= i <= r['end_index'] for r in ranges)
+    # Nowhere near
+    assert index.query_bbox(10., 10., 11., 11.) == []
+
+def test_save_load_and_remove(make_gpx, tmp_path):
+    files = [make_gpx(500), make_gpx(600)]
+    index_dir = str(tmp_path / 'index')
+    index = spatial_index.SpatialIndex(index_dir)
+    index.update(files)
+    index2 = spatial_index.SpatialIndex(index_dir)
+    assert set(index2.files) == set(files)
+    for name in index.pieces:
+        np.testing.assert_array_equal(index2.pieces[name], index.pieces[name])
+    assert index2.update(files) == (0, 0, [])
+    index2.remove(files[0])
+    track = gpx_stream.read_track(files[1], timezone=False)
+    ranges = index2.query_bbox(track.lat.min(), track.lon.min(), track.lat.max(),
+        track.lon.max())
+    assert {r['file_name'] for r in ranges} == {files[1]}
+
+def test_glitch_does_not_fill_the_grid(make_gpx, tmp_path):
+    track = gpx_stream.read_track(make_gpx(1000), timezone=False)
+    lat = track.lat.copy()
+    lon = track.lon.copy()
+    # One point jumps to Miami and back
+    lat[500], lon[500] = 25.76, -80.19
+    file_name = str(tmp_path / 'glitch.gpx')
+    gpx_writer.write_track(file_name, Track(lat, lon, track.ele, track.hr, track.time))
+    index = spatial_index.SpatialIndex(str(tmp_path / 'index'))
+    index.add(file_name)
+    index.build_grid()
+    keys, piece, bboxes, bbox_ids, long, long_bboxes = index.grid
+    assert len(keys) < 10 * len(index.pieces['i0'])
+    assert len(long) == 2
+    ranges = index.query_radius(25.76, -80.19, 100.)
+    assert len(ranges) == 1 and ranges[0]['start_index'] < 500 < ranges[0]['end_index']
+    assert index.query_radius(lat[100], lon[100], 20.)
+
+def test_many_adds_and_removes(make_gpx, tmp_path):
+    files = [make_gpx(n) for n in (300, 400, 500)]
+    index = spatial_index.SpatialIndex(str(tmp_path / 'index'))
+    for file_name in files + files[:2]:
+        index.add(file_name)
+    index.remove(files[1])
+    expected = spatial_index.SpatialIndex(str(tmp_path / 'other'))
+    for file_name in (files[2], files[0]):
+        expected.add(file_name)
+    ids = {entry['id']: name for name, entry in index.files.items()}
+    expected_ids = {entry['id']: name for name, entry in expected.files.items()}
+    assert len(index.pieces['i0']) == len(expected.pieces['i0'])
+    for name in ('i0', 'i1', 'lat0', 't1'):
+        key = [(ids[i], v) for i, v in zip(index.pieces['file_id'], index.pieces[name])]
+        expected_key = [(expected_ids[i], v)
+            for i, v in zip(expected.pieces['file_id'], expected.pieces[name])]
+        assert sorted(key) == sorted(expected_key)
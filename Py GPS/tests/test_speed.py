@@ -0,0 +1,100 @@
+import numpy as np
+import pytest
+
+import gpx_stream
+import speed as s
+
+def test_speed_array_units():
+    # 1 deg of lat is about 69.09 mi, taken in 1 hour
+    time = np.array([0, 3600], dtype='datetime64[s]')
+    speed, dist, time_delta, total_dist, total_time, avg_speed = \
+        s.get_speed_array([0., 1.], [0., 0.], time)
+    assert speed[0] == 0.
+    assert total_dist == pytest.approx(69.09, rel=1e-3)
+    assert total_time == pytest.approx(60.)
+    assert speed[1] == pytest.approx(avg_speed)
+
+@pytest.mark.parametrize('chunk', [1, 10, 333])
+def test_lowpass_stream_chunks(chunk):
+    data = np.random.default_rng(0).normal(3., 1., 1000)
+    whole = s.LowpassStream(.04, 1.).update(data)
+    stream = s.LowpassStream(.04, 1.)
+    parts = [stream.update(data[i:i + chunk]) for i in range(0, len(data), chunk)]
+    np.testing.assert_allclose(np.concatenate(parts), whole, rtol=1e-12, atol=1e-12)
+    stream.reset()
+    np.testing.assert_allclose(stream.update(data), whole, rtol=1e-12, atol=1e-12)
+
+def test_filter_matches_transfer_function():
+    from scipy.signal import lfilter
+    data = np.random.default_rng(0).normal(3., 1., 1000)
+    b, a = s.butter_lowpass(.04, 1.)
+    np.testing.assert_allclose(s.filter_butter_lowpass(data, .04, 1.), lfilter(b, a, data),
+        rtol=1e-9, atol=1e-9)
+
+def test_default_filter_matches_original(make_gpx):
+    from scipy.signal import lfilter
+    track = gpx_stream.read_track(make_gpx(500), timezone=False)
+    speed = s.get_speed(track)[0]
+    assert s.get_cutoff(1) == .04
+    np.testing.assert_allclose(s.process_speed(track, speed),
+        lfilter(*s.butter_lowpass(.04 * 1, 1, 5), speed), rtol=1e-9, atol=1e-9)
+
+def test_segment_starts_have_no_step(make_gpx):
+    track = gpx_stream.read_track(make_gpx(1000, 1, 3), timezone=False)
+    speed = s.get_speed_array(track.lat, track.lon, track.datetime64,
+        seg_starts=track.segment_starts())[0]
+    assert np.all(speed[track.seg_offsets[:-1]] == 0.)
+
+def test_merged_track_matches_haversine(make_gpx):
+    # Segments moved from Detroit to Miami and Sydney, as in a merged file
+    track = gpx_stream.read_track(make_gpx(1500, 1, 3), timezone=False)
+    for j, (dlat, dlon) in enumerate(((0., 0.), (-16.7, 3.4), (-76.4, 234.8))):
+        segment = track.segment(j)
+        segment.lat += dlat
+        segment.lon[:] = (segment.lon + dlon + 180.) % 360. - 180.
+    speed, dist, time_delta, total_dist = s.get_speed_array(track.lat, track.lon,
+        track.datetime64, track.segment_starts())[:4]
+    result = s.get_speed(track)
+    assert np.isfinite(result[0]).all()
+    np.testing.assert_allclose(result[0], speed, rtol=1e-6)
+    assert result[1] == pytest.approx(total_dist, rel=1e-7)
+    np.testing.assert_allclose(s.get_segment_stats(track)['dist'],
+        [dist[start:end].sum() for start, end in
+            zip(track.seg_offsets[:-1], track.seg_offsets[1:])], rtol=1e-7)
+
+@pytest.mark.parametrize('chunk', [1, 7, 250, 1000])
+def test_speed_stream_matches(make_gpx, chunk):
+    track = gpx_stream.read_track(make_gpx(1000), timezone=False)
+    time = track.datetime64
+    speed, dist, time_delta, total_dist, total_time, avg_speed = \
+        s.get_speed_array(track.lat, track.lon, time)
+    filtered = s.process_speed(time, speed, fs=1)
+    stream = s.SpeedStream()
+    parts = [stream.update(track.lat[i:i + chunk], track.lon[i:i + chunk], time[i:i + chunk])
+        for i in range(0, len(track), chunk)]
+    np.testing.assert_allclose(np.concatenate([p[0] for p in parts]), speed, rtol=1e-12)
+    np.testing.assert_allclose(np.concatenate([p[1] for p in parts]), filtered,
+        rtol=1e-9, atol=1e-12)
+    assert stream.total_dist == pytest.approx(total_dist, rel=1e-12)
+    assert stream.avg_speed == pytest.approx(avg_speed, rel=1e-12)
+
+def test_speed_stream_batches(make_gpx):
+    file_name = make_gpx(1000, 2, 2)
+    track = gpx_stream.read_track(file_name, timezone=False)
+    speed = s.get_speed_array(track.lat, track.lon, track.datetime64,
+        seg_starts=track.segment_starts())[0]
+    filtered = s.process_speed(track.datetime64, speed, fs=1, seg_offsets=track.seg_offsets)
+    stream = s.SpeedStream()
+    parts = [stream.update_track(batch.track, batch.continues)
+        for batch in gpx_stream.iter_batches(file_name, batch_size=300, timezone=False)]
+    np.testing.assert_allclose(np.concatenate([p[0] for p in parts]), speed, rtol=1e-12)
+    np.testing.assert_allclose(np.concatenate([p[1] for p in parts]), filtered,
+        rtol=1e-9, atol=1e-12)
+
+def test_process_speeds_matches_process_speed(make_gpx):
+    tracks = [gpx_stream.read_track(make_gpx(n), timezone=False) for n in (200, 700)]
+    speeds = [s.get_speed_array(t.lat, t.lon, t.datetime64)[0] for t in tracks]
+    result = s.process_speeds(tracks, speeds, zero_phase=True)
+    for track, speed, filtered in zip(tracks, speeds, result):
+        expected = s.process_speed(track.datetime64, speed, uniform=True, zero_phase=True)
+        np.testing.assert_allclose(filtered, expected, rtol=1e-9, atol=1e-12)
@@ -0,0 +1,27 @@
+import os
+
+import numpy as np
+import pytest
+
+import gpx_stream
+import synthetic_gpx
+
+@pytest.mark.parametrize('namespace', synthetic_gpx.NAMESPACES)
+def test_layouts_have_the_same_points(tmp_path, namespace):
+    file_name = synthetic_gpx.write_gpx(str(tmp_path / 'layout.gpx'), 500, 2, 2,
+        namespace=namespace)
+    expected = gpx_stream.read_gpx_data(synthetic_gpx.write_gpx(str(tmp_path / 'default.gpx'),
+        500, 2, 2))
+    data = gpx_stream.read_gpx_data(file_name)
+    assert len(data[0]) == 500
+    for values, expected_values in zip(data[:4], expected[:4]):
+        np.testing.assert_array_equal(values, expected_values)
+    assert data[4] == expected[4]
+
+def test_get_gpx_file_is_written_once(tmp_path):
+    file_name = synthetic_gpx.get_gpx_file(str(tmp_path), 100, hr=False)
+    mtime = os.stat(file_name).st_mtime_ns
+    assert synthetic_gpx.get_gpx_file(str(tmp_path), 100, hr=False) == file_name
+    assert os.stat(file_name).st_mtime_ns == mtime
+    with pytest.raises(ValueError):
+        synthetic_gpx.write_gpx(str(tmp_path / 'bad.gpx'), 10, namespace='gpx20')
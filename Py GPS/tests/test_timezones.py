@@ -0,0 +1,63 @@
+import datetime
+from zoneinfo import ZoneInfo
+
+import numpy as np
+
+import timezones
+
+def get_ns(*args):
+    return int(datetime.datetime(*args, tzinfo=datetime.timezone.utc).timestamp()) * 10**9
+
+def test_timezone_at():
+    assert timezones.timezone_at(42.5329, -83.6386) == 'America/Detroit'
+
+def test_to_datetimes_across_dst():
+    # Every 10 min across the end of DST in Detroit, 2021-11-07 06:00 UTC
+    start = get_ns(2021, 11, 7, 4)
+    time_ns = np.arange(start, start + 4 * 3600 * 10**9, 600 * 10**9)
+    tz = ZoneInfo('America/Detroit')
+    expected = [datetime.datetime.fromtimestamp(ns / 1e9, tz) for ns in time_ns.tolist()]
+    result = timezones.to_datetimes(time_ns, 'America/Detroit')
+    assert result == expected
+    assert [t.utcoffset() for t in result] == [t.utcoffset() for t in expected]
+    assert [t.fold for t in result] == [t.fold for t in expected]
+
+def test_to_local():
+    start = get_ns(2021, 3, 14, 5)
+    time_ns = np.arange(start, start + 4 * 3600 * 10**9, 900 * 10**9)
+    tz = ZoneInfo('America/Detroit')
+    expected = np.array([datetime.datetime.fromtimestamp(ns / 1e9, tz).replace(tzinfo=None)
+        for ns in time_ns.tolist()], dtype='datetime64[ns]')
+    np.testing.assert_array_equal(timezones.to_local(time_ns, 'America/Detroit'), expected)
+
+def test_nat_and_unknown_timezone():
+    time_ns = np.array([get_ns(2021, 1, 1), timezones.NAT])
+    result = timezones.to_datetimes(time_ns, None)
+    assert result[0].utcoffset() == datetime.timedelta(0)
+    assert result[1] is None
+
+class SplitFinder:
+    '''Two zones either side of lon -85.001.'''
+
+    def timezone_at(self, lng, lat):
+        return 'America/Chicago' if lng < -85.001 else 'America/Detroit'
+
+def test_points_near_border(monkeypatch):
+    monkeypatch.setattr(timezones, '_finder', SplitFinder())
+    timezones._timezone_at_cell.cache_clear()
+    timezones._timezone_at_point.cache_clear()
+    try:
+        # Both in the cell about lon -85.00
+        assert timezones.timezone_at(42., -85.003) == 'America/Chicago'
+        assert timezones.timezone_at(42., -84.999) == 'America/Detroit'
+        assert timezones.timezone_at(42., -84.9) == 'America/Detroit'
+    finally:
+        timezones._timezone_at_cell.cache_clear()
+        timezones._timezone_at_point.cache_clear()
+
+def test_to_datetimes_keeps_microseconds():
+    ns = get_ns(2021, 12, 4, 17, 1, 33) + 123456789
+    result = timezones.to_datetimes(np.array([ns]), 'America/Detroit')[0]
+    assert result.microsecond == 123456
+    assert result.astimezone(datetime.timezone.utc) \
+        == datetime.datetime(2021, 12, 4, 17, 1, 33, 123456, tzinfo=datetime.timezone.utc)
@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+import gpx_stream
+from track import Track
+
+@pytest.fixture
+def track(make_gpx):
+    return gpx_stream.read_track(make_gpx(1200, 2, 3))
+
+def test_offsets(track):
+    assert track.n_seg == 6
+    assert track.n_trk == 2
+    assert track.seg_offsets[-1] == len(track)
+    assert track.track_starts().tolist() == [0, 600, 1200]
+    np.testing.assert_array_equal(track.segment_starts(), track.seg_offsets[1:-1])
+    assert track.segment_ids()[-1] == 5
+
+def test_slice_is_view(track):
+    part = track[100:500]
+    assert np.shares_memory(part.lat, track.lat)
+    assert part.seg_offsets.tolist() == [0, 100, 300, 400, 400, 400, 400]
+    np.testing.assert_array_equal(part.segment(1).lat, track.lat[200:400])
+
+def test_mask(track):
+    mask = np.zeros(len(track), dtype=bool)
+    mask[::3] = True
+    part = track[mask]
+    assert len(part) == 400
+    assert part.seg_offsets[-1] == 400
+    np.testing.assert_array_equal(part.hr, track.hr[::3])
+
+def test_scalar_index(track):
+    with pytest.raises(TypeError):
+        track[0]
+
+def test_to_lists(track):
+    lat, lon, ele, hr, time = track.to_lists()
+    assert lat == track.lat.tolist()
+    assert time[0].utcoffset() is not None
+    assert time[0].timestamp() == track.time[0] / 1e9
+
+def test_local_time(track):
+    local = track.local_time()
+    # Same wall clock as the datetimes
+    expected = np.array([t.replace(tzinfo=None) for t in track.datetimes()[:10]],
+        dtype='datetime64[ns]')
+    np.testing.assert_array_equal(local[:10], expected)
+
+def test_empty():
+    track = Track([], [], [], [], [])
+    assert len(track) == 0
+    assert track.n_seg == 1
+    assert track.to_lists() == ([], [], [], [], [])
@@ -0,0 +1,67 @@
+import shutil
+
+import numpy as np
+import pytest
+
+import gpx_stream
+from track_cache import TrackCache
+
+def load_stream(file_name):
+    return gpx_stream.read_track(file_name, fields=('hr', 'cad')), 'info'
+
+def test_round_trip(make_gpx, tmp_path):
+    file_name = make_gpx(1000, 1, 2)
+    cache = TrackCache(str(tmp_path))
+    track, info = cache.load(file_name, loader=load_stream)
+    cached, cached_info = cache.get(file_name)
+    assert cached_info == 'info'
+    for name in ('lat', 'lon', 'ele', 'hr', 'time', 'seg_offsets', 'trk_offsets'):
+        np.testing.assert_array_equal(getattr(cached, name), getattr(track, name))
+    np.testing.assert_array_equal(cached.extras['cad'], track.extras['cad'])
+    assert cached.tz_name == track.tz_name
+
+def test_changed_file_is_a_miss(make_gpx, tmp_path):
+    source = make_gpx(1000)
+    file_name = str(tmp_path / 'track.gpx')
+    with open(source, 'rb') as f:
+        data = f.read()
+    with open(file_name, 'wb') as f:
+        f.write(data)
+    cache = TrackCache(str(tmp_path / 'cache'))
+    cache.load(file_name, loader=load_stream)
+    with open(file_name, 'ab') as f:
+        f.write(b'\n')
+    assert cache.get(file_name) is None
+
+def test_eviction(make_gpx, tmp_path):
+    cache = TrackCache(str(tmp_path), max_bytes=1)
+    cache.load(make_gpx(1000), loader=load_stream)
+    assert cache.list_entries() == []
+
+def test_file_changed_while_loading_is_not_stored_as_current(make_gpx, tmp_path):
+    file_name = str(tmp_path / 'track.gpx')
+    shutil.copyfile(make_gpx(500), file_name)
+    cache = TrackCache(str(tmp_path / 'cache'))
+
+    def loader(name):
+        entry = load_stream(name)
+        # The file changes after it was read
+        shutil.copyfile(make_gpx(600), name)
+        return entry
+    track, info = cache.load(file_name, loader=loader)
+    assert len(track) == 500
+    assert cache.get(file_name) is None
+    track, info = cache.load(file_name, loader=load_stream)
+    assert len(track) == 600
+
+@pytest.mark.parametrize('size', [0, 7, 4096])
+def test_truncated_bin_is_a_miss(make_gpx, tmp_path, size):
+    file_name = make_gpx(1000)
+    cache = TrackCache(str(tmp_path))
+    cache.load(file_name, loader=load_stream)
+    bin_path, json_path = cache.get_paths(file_name)
+    with open(bin_path, 'r+b') as f:
+        f.truncate(size)
+    assert cache.get(file_name) is None
+    track, info = cache.load(file_name, loader=load_stream)
+    assert len(track) == 1000
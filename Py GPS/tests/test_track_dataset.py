@@ -0,0 +1,28 @@
+import numpy as np
+
+import gpx_stream
+import track_dataset
+
+def test_add_query_remove(make_gpx, tmp_path):
+    files = [make_gpx(800), make_gpx(900, 2, 2)]
+    dataset = track_dataset.TrackDataset(str(tmp_path / 'dataset'), row_group_size=100)
+    assert dataset.update(files) == (2, 0, [])
+    table = dataset.query(columns=['time', 'lat', 'hr'], file_name=files[0])
+    track = gpx_stream.read_track(files[0], timezone=False)
+    assert table.num_rows == len(track)
+    np.testing.assert_array_equal(np.sort(table['lat'].to_numpy()), np.sort(track.lat))
+    # The pushdown skips the row groups outside the time range
+    start = track.datetimes()[100]
+    end = track.datetimes()[200]
+    n_read, n_total = dataset.get_row_groups(start=start, end=end)
+    assert n_read < n_total
+    rows = dataset.query(columns=['time'], start=start, end=end).num_rows
+    expected = sum(np.count_nonzero((t.time >= track.time[100]) & (t.time < track.time[200]))
+        for t in (gpx_stream.read_track(name, timezone=False) for name in files))
+    assert rows == expected
+    dataset2 = track_dataset.TrackDataset(str(tmp_path / 'dataset'))
+    assert set(dataset2.files) == set(files)
+    dataset2.remove(files[0])
+    dataset2.save()
+    assert dataset2.query(columns=['time']).num_rows == len(
+        gpx_stream.read_track(files[1], timezone=False))
@@ -0,0 +1,104 @@
+import asyncio
+import os
+import shutil
+
+import pytest
+
+import watcher
+
+async def watch(watcher_, done, timeout=60.):
+    '''Runs the watcher until done() or timeout.'''
+    stop = asyncio.Event()
+    task = asyncio.create_task(watcher_.run(stop))
+    loop = asyncio.get_running_loop()
+    end = loop.time() + timeout
+    while not done() and loop.time() < end:
+        await asyncio.sleep(.1)
+    stop.set()
+    await task
+
+@pytest.mark.parametrize('use_inotify', [True, False])
+def test_new_changed_and_removed(make_gpx, tmp_path, use_inotify):
+    folder = tmp_path / 'watch'
+    (folder / 'sub').mkdir(parents=True)
+    store = watcher.SummaryStore(str(tmp_path / 'summaries.json'))
+    first = str(folder / 'a.gpx')
+    shutil.copyfile(make_gpx(300), first)
+    w = watcher.FolderWatcher([str(folder)], store, jobs=1, debounce=.2, poll_interval=.2,
+        use_inotify=use_inotify)
+
+    async def run():
+        task = asyncio.create_task(watch(w, lambda: len(store.summaries) == 2
+            and store.summaries[first]['n_points'] == 500))
+        await asyncio.sleep(.5)
+        shutil.copyfile(make_gpx(400), str(folder / 'sub' / 'b.gpx'))
+        await asyncio.sleep(.5)
+        shutil.copyfile(make_gpx(500), first)
+        await task
+    asyncio.run(run())
+    assert store.summaries[first]['n_points'] == 500
+    assert store.summaries[str(folder / 'sub' / 'b.gpx')]['n_points'] == 400
+
+    # A restart only finds the removal
+    os.remove(first)
+    store2 = watcher.SummaryStore(store.file_name)
+    w2 = watcher.FolderWatcher([str(folder)], store2, jobs=1, debounce=.2, poll_interval=.2,
+        use_inotify=use_inotify)
+    asyncio.run(watch(w2, lambda: first not in store2.summaries))
+    assert list(store2.summaries) == [str(folder / 'sub' / 'b.gpx')]
+    assert w2.n_processed == 0
+
+def test_summaries_do_not_keep_aggregates(make_gpx, tmp_path):
+    import aggregates
+    folder = tmp_path / 'watch'
+    folder.mkdir()
+    file_name = str(folder / 'a.gpx')
+    shutil.copyfile(make_gpx(300), file_name)
+    store = watcher.SummaryStore(str(tmp_path / 'summaries.json'))
+    stats = aggregates.Aggregates()
+    w = watcher.FolderWatcher([str(folder)], store, jobs=1, debounce=.2, poll_interval=.2,
+        use_inotify=False, aggregates=stats)
+    asyncio.run(watch(w, lambda: file_name in store.summaries))
+    assert file_name in stats.files
+    assert 'aggregates' not in store.summaries[file_name]
+
+def test_file_summary_aggregates(make_gpx, monkeypatch):
+    import aggregates
+
+    def fail(file_name):
+        raise AssertionError('read again')
+    # The track process_file read is used
+    monkeypatch.setattr(aggregates, 'load_track', fail)
+    summary = watcher.get_file_summary(make_gpx(300), aggregates=True)
+    assert summary['size'] == os.path.getsize(make_gpx(300))
+    assert summary['aggregates']['stats'][0] == 1
+    assert '_track' not in summary
+
+def test_dataset_updater_uses_cache(make_gpx, tmp_path, monkeypatch):
+    import track_dataset
+    file_name = make_gpx(300)
+    cache_dir = str(tmp_path / 'cache')
+    summary = watcher.get_file_summary(file_name, cache_dir=cache_dir)
+
+    def fail(file_name):
+        raise AssertionError('parsed again')
+    monkeypatch.setattr(track_dataset, 'load_track', fail)
+    updater = watcher.DatasetUpdater(str(tmp_path / 'dataset'), cache_dir)
+    updater.update(file_name, summary)
+    updater.close()
+    assert updater.dataset.files[os.path.abspath(file_name)]['n_points'] == 300
+
+def test_dataset_updater_uses_pool_track(make_gpx, tmp_path, monkeypatch):
+    import track_dataset
+    file_name = make_gpx(300)
+    summary = watcher.get_file_summary(file_name, keep_track=True)
+    assert len(summary['_track']) == 300
+
+    def fail(file_name):
+        raise AssertionError('parsed again')
+    monkeypatch.setattr(track_dataset, 'load_track', fail)
+    updater = watcher.DatasetUpdater(str(tmp_path / 'dataset'))
+    updater.loader = fail
+    updater(file_name, summary)
+    updater.close()
+    assert updater.dataset.files[os.path.abspath(file_name)]['n_points'] == 300
@@ -0,0 +1,156 @@
+''' Timezone service.
+Holds one TimezoneFinder for the process, created the first time it is
+needed, and caches lookups by lat/lon cell so a batch of files in the same
+area only pays for the finder once. A cell is only used for its points if
+its corners are all in the same zone; in cells a border crosses each point
+is looked up itself. Times are converted to local time for a whole array at
+once using the UTC offsets between the DST transitions in the range of the
+times, instead of calling astimezone for every point.
+'''
+
+import datetime
+import functools
+from zoneinfo import ZoneInfo
+
+import numpy as np
+
+import instrument
+
+# Size of the lat/lon cells used as the lookup cache key, deg (about 1 km)
+CELL_SIZE = .01
+# Spacing of the samples used to find DST transitions, s
+TRANSITION_STEP = 86400
+
+NS_PER_SEC = 1000000000
+NAT = np.iinfo(np.int64).min
+
+_finder = None
+
+def get_finder():
+    '''Returns the process-wide TimezoneFinder, creating it if necessary.'''
+    global _finder
+    if _finder is None:
+        from timezonefinder import TimezoneFinder
+        _finder = TimezoneFinder()
+    return _finder
+
+# _timezone_at_cell result for a cell a border crosses
+BORDER = ''
+
+@functools.lru_cache(maxsize=4096)
+def _timezone_at_point(lat, lon):
+    return get_finder().timezone_at(lng=lon, lat=lat)
+
+@functools.lru_cache(maxsize=4096)
+def _timezone_at_cell(lat_cell, lon_cell):
+    '''Returns the timezone name of the cell if its corners all have the
+    same one, else BORDER.'''
+    names = {get_finder().timezone_at(lng=(lon_cell + j) * CELL_SIZE,
+        lat=(lat_cell + i) * CELL_SIZE) for i in (-.5, .5) for j in (-.5, .5)}
+    return names.pop() if len(names) == 1 else BORDER
+
+@instrument.timed()
+def timezone_at(lat, lon):
+    '''Returns the timezone name at lat, lon, or None if not found. Results
+    are cached for each CELL_SIZE cell, except in cells a border crosses,
+    where the point itself is looked up.'''
+    name = _timezone_at_cell(round(lat / CELL_SIZE), round(lon / CELL_SIZE))
+    if name == BORDER:
+        return _timezone_at_point(lat, lon)
+    return name
+
+def get_zoneinfo(tz_name):
+    '''Returns the ZoneInfo for tz_name, or UTC if it is None or unknown.'''
+    try:
+        return ZoneInfo(tz_name)
+    except (TypeError, ValueError, KeyError):
+        return ZoneInfo('UTC')
+
+def _offset_at(tz, sec):
+    '''Returns the UTC offset of tz at epoch second sec, s.'''
+    dt = datetime.datetime.fromtimestamp(sec, tz)
+    return int(dt.utcoffset().total_seconds())
+
+def get_transitions(tz_name, start, end):
+    '''Returns the transitions and offsets for tz_name between epoch seconds
+    start and end.
+
+        Returns
+        ------
+        return : transitions, offsets
+            transitions is an int64 array of the epoch seconds at which the
+            offset changes, starting with start. offsets is an int64 array of
+            the UTC offsets, s, that apply from each transition on.
+    '''
+    tz = get_zoneinfo(tz_name)
+    transitions = [start]
+    offsets = [_offset_at(tz, start)]
+    prev = start
+    while prev < end:
+        sec = min(prev + TRANSITION_STEP, end)
+        offset = _offset_at(tz, sec)
+        if offset != offsets[-1]:
+            # Bisect to the second the offset changes
+            lo, hi = prev, sec
+            while hi - lo > 1:
+                mid = (lo + hi) // 2
+                if _offset_at(tz, mid) == offsets[-1]:
+                    lo = mid
+                else:
+                    hi = mid
+            transitions.append(hi)
+            offsets.append(offset)
+        prev = sec
+    return np.array(transitions, dtype=np.int64), np.array(offsets, dtype=np.int64)
+
+def get_offsets(time_ns, tz_name):
+    '''Returns the UTC offsets for an int64 array of nanoseconds since the
+    epoch.
+
+        Returns
+        ------
+        return : offsets, fold
+            offsets is an int64 array of the UTC offsets, s. fold is a boolean
+            array that is True where the local time is the second occurrence
+            of a time repeated when the clocks go back.
+    '''
+    n = len(time_ns)
+    valid = time_ns != NAT
+    if not np.any(valid):
+        return np.zeros(n, dtype=np.int64), np.zeros(n, dtype=bool)
+    sec = time_ns // NS_PER_SEC
+    start = int(sec[valid].min())
+    end = int(sec[valid].max())
+    transitions, offsets = get_transitions(tz_name, start, end)
+    index = np.searchsorted(transitions, sec, side='right') - 1
+    index = np.clip(index, 0, len(offsets) - 1)
+    cur = offsets[index]
+    prev = np.where(index > 0, offsets[np.maximum(index - 1, 0)], cur)
+    fold = (prev > cur) & (sec - transitions[index] < prev - cur)
+    return cur, fold
+
+@instrument.timed()
+def to_local(time_ns, tz_name):
+    '''Converts an int64 array of nanoseconds since the epoch (UTC) to a
+    datetime64[ns] array of local (wall clock) times in tz_name.'''
+    time_ns = np.asarray(time_ns, dtype=np.int64)
+    offsets = get_offsets(time_ns, tz_name)[0]
+    local = np.where(time_ns != NAT, time_ns + offsets * NS_PER_SEC, NAT)
+    return local.view('datetime64[ns]')
+
+@instrument.timed()
+def to_datetimes(time_ns, tz_name):
+    '''Converts an int64 array of nanoseconds since the epoch (UTC) to a list
+    of timezone-aware datetimes in tz_name, None for NAT. The local times
+    are found in integer microseconds from the get_offsets offsets, so no
+    precision is lost, and fold is set for the repeated hour when the clocks
+    go back.'''
+    tz = get_zoneinfo(tz_name)
+    time_ns = np.asarray(time_ns, dtype=np.int64)
+    valid = time_ns != NAT
+    offsets, fold = get_offsets(time_ns, tz_name)
+    local_us = np.where(valid, (time_ns + offsets * NS_PER_SEC) // 1000, 0)
+    # Naive datetimes from NumPy in one call
+    local = local_us.view('datetime64[us]').astype(object).tolist()
+    return [dt.replace(tzinfo=tz, fold=f) if v else None
+        for dt, f, v in zip(local, fold.tolist(), valid.tolist())]
@@ -0,0 +1,239 @@
+''' Columnar track container.
+A Track holds the trackpoint data as typed NumPy arrays instead of parallel
+lists of Python objects: float64 lat/lon, float32 ele, uint8 or uint16 hr, and
+int64 times in nanoseconds since the epoch (UTC), plus the timezone name,
+one for the file, or one for each GPX track when they differ (see
+get_tz_name). Slicing a Track returns a Track of views on the same arrays.
+
+The GPX tracks and segments are kept CSR style: seg_offsets holds the index
+of the first point of each segment, with the number of points at the end,
+and trk_offsets holds the index of the first segment of each track, with the
+number of segments at the end. So the points of segment j are
+seg_offsets[j]:seg_offsets[j + 1] and the segments of track i are
+trk_offsets[i]:trk_offsets[i + 1], without copying anything.
+
+The local east/north projection of the points (see enu.py) is computed the
+first time Track.xy is used and kept with the arrays, so distances and
+other geometry for the track are plain arithmetic after that. Each segment
+is projected about its own centroid, so merged files of activities far
+apart are each projected near their origin.
+'''
+
+import datetime
+
+import numpy as np
+
+import enu
+import timezones
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+ONE_US = datetime.timedelta(microseconds=1)
+# Used for missing times, same value as NaT
+NAT = np.iinfo(np.int64).min
+
+def datetime_to_ns(dt):
+    '''Converts a datetime to nanoseconds since the epoch. Naive datetimes are
+    taken to be UTC, as GPX specifies.'''
+    if dt is None:
+        return NAT
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=datetime.timezone.utc)
+    return ((dt - EPOCH) // ONE_US) * 1000
+
+def get_tz_names(lat, lon, seg_offsets, trk_offsets):
+    '''Returns the timezone name of each GPX track, from its first point, as
+    py_gps.get_gpx_data finds it. Tracks with no points give None.'''
+    bounds = np.asarray(seg_offsets)[np.asarray(trk_offsets)]
+    return [timezones.timezone_at(lat[start], lon[start]) if end > start else None
+        for start, end in zip(bounds[:-1].tolist(), bounds[1:].tolist())]
+
+def join_tz_names(names):
+    '''Returns the Track tz_name for the get_tz_names of its tracks: the name
+    if the tracks with points all have the same one, else a tuple of them.'''
+    found = set(name for name in names if name is not None)
+    if len(found) <= 1:
+        return found.pop() if found else None
+    return tuple(names)
+
+def get_tz_name(lat, lon, seg_offsets, trk_offsets):
+    '''Returns the Track tz_name for the points, with the timezone of each
+    GPX track found from its first point.'''
+    return join_tz_names(get_tz_names(lat, lon, seg_offsets, trk_offsets))
+
+def hr_dtype(hr):
+    '''Returns the smallest unsigned type that holds the HR values.'''
+    if len(hr) == 0 or np.max(hr) <= np.iinfo(np.uint8).max:
+        return np.uint8
+    return np.uint16
+
+class Track:
+    '''Trackpoint data for one GPX file.
+
+        Attributes
+        ----------
+        lat, lon : numpy.ndarray of float64
+            Latitude and longitude, deg.
+        ele : numpy.ndarray of float32
+            Elevation, m. NaN where missing.
+        hr : numpy.ndarray of uint8 or uint16
+            Heart rate, bpm. 0 where missing.
+        time : numpy.ndarray of int64
+            Time in nanoseconds since the epoch (UTC).
+        tz_name : str or tuple of str
+            Timezone name for the track, e.g. America/Detroit, or a tuple with
+            the name of each GPX track if they differ. May be None, for UTC.
+        extras : dict
+            Other per-point arrays, e.g. cad, atemp, power from the
+            extensions. See extensions.FIELDS for the missing values.
+        seg_offsets : numpy.ndarray of int64
+            Start of each segment plus the number of points. Defaults to one
+            segment with all the points.
+        trk_offsets : numpy.ndarray of int64
+            First segment of each track plus the number of segments. Defaults
+            to one track with all the segments.
+        xy : tuple of numpy.ndarray of float64
+            x (east) and y (north) of the points, m, with each segment
+            projected about its own centroid (see enu.get_xy), made when
+            first used. lat and lon should not be changed after this.
+    '''
+    __slots__ = ('lat', 'lon', 'ele', 'hr', 'time', 'tz_name', 'extras',
+        'seg_offsets', 'trk_offsets', '_xy')
+
+    def __init__(self, lat, lon, ele, hr, time, tz_name=None, extras=None,
+            seg_offsets=None, trk_offsets=None):
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.lon = np.asarray(lon, dtype=np.float64)
+        self.ele = np.asarray(ele, dtype=np.float32)
+        hr = np.asarray(hr)
+        if hr.dtype != np.uint8:
+            hr = hr.astype(hr_dtype(hr), copy=False)
+        self.hr = hr
+        time = np.asarray(time)
+        if time.dtype.kind == 'M':
+            time = time.astype('datetime64[ns]').view(np.int64)
+        self.time = time.astype(np.int64, copy=False)
+        # Lists come back from JSON, e.g. from the TrackCache
+        self.tz_name = tuple(tz_name) if isinstance(tz_name, list) else tz_name
+        self.extras = extras if extras is not None else {}
+        if seg_offsets is None:
+            seg_offsets = [0, len(self.lat)]
+        self.seg_offsets = np.asarray(seg_offsets, dtype=np.int64)
+        if trk_offsets is None:
+            trk_offsets = [0, len(self.seg_offsets) - 1]
+        self.trk_offsets = np.asarray(trk_offsets, dtype=np.int64)
+        self._xy = None
+
+    def __len__(self):
+        return len(self.lat)
+
+    def __getitem__(self, key):
+        '''Slices return views on the same arrays. Index arrays and boolean
+        masks return copies.'''
+        if not isinstance(key, slice) and np.ndim(key) == 0:
+            raise TypeError('Track indices must be slices, index arrays or masks')
+        n = len(self)
+        if isinstance(key, slice) and key.step in (None, 1):
+            start, stop, step = key.indices(n)
+            seg_offsets = np.clip(self.seg_offsets - start, 0, max(stop - start, 0))
+        else:
+            # Count the kept points in each segment. Index arrays are assumed
+            # to be in increasing order.
+            kept = np.arange(n)[key]
+            seg_offsets = np.searchsorted(kept, self.seg_offsets, side='left')
+        extras = {name: values[key] for name, values in self.extras.items()}
+        track = Track(self.lat[key], self.lon[key], self.ele[key], self.hr[key],
+            self.time[key], self.tz_name, extras, seg_offsets, self.trk_offsets)
+        # Keep the projection, each point in the plane of its segment in the
+        # whole track
+        if self._xy is not None:
+            track._xy = (self._xy[0][key], self._xy[1][key])
+        return track
+
+    def __repr__(self):
+        return (f'Track(n={len(self)}, n_seg={self.n_seg}, '
+            f'tz_name={self.tz_name!r})')
+
+    @property
+    def n_seg(self):
+        '''The number of segments.'''
+        return len(self.seg_offsets) - 1
+
+    @property
+    def n_trk(self):
+        '''The number of tracks.'''
+        return len(self.trk_offsets) - 1
+
+    def segment(self, j):
+        '''Returns segment j as a Track of views.'''
+        return self[self.seg_offsets[j]:self.seg_offsets[j + 1]]
+
+    def segment_ids(self):
+        '''Returns the segment number of each point.'''
+        return np.repeat(np.arange(self.n_seg), np.diff(self.seg_offsets))
+
+    def segment_starts(self):
+        '''Returns the indices of the points that start a segment other than
+        the first point, i.e. where the data jumps across a gap.'''
+        starts = self.seg_offsets[1:-1]
+        # Skip empty segments, and segments starting at 0
+        return np.unique(starts[(starts > 0) & (starts < len(self))])
+
+    def track_starts(self):
+        '''Returns the index of the first point of each track, with the number
+        of points at the end.'''
+        return self.seg_offsets[self.trk_offsets]
+
+    @property
+    def xy(self):
+        '''x (east) and y (north) of the points, m, each segment in the
+        projection about its centroid.'''
+        if self._xy is None:
+            self._xy = enu.get_xy(self.lat, self.lon, self.seg_offsets)
+        return self._xy
+
+    @property
+    def datetime64(self):
+        '''The times as a datetime64[ns] (UTC) view.'''
+        return self.time.view('datetime64[ns]')
+
+    @property
+    def nbytes(self):
+        '''Total bytes used by the arrays.'''
+        return (self.lat.nbytes + self.lon.nbytes + self.ele.nbytes
+            + self.hr.nbytes + self.time.nbytes
+            + self.seg_offsets.nbytes + self.trk_offsets.nbytes
+            + sum(values.nbytes for values in self.extras.values()))
+
+    def tz_names(self):
+        '''Returns the timezone name of each GPX track.'''
+        if isinstance(self.tz_name, tuple):
+            return list(self.tz_name)
+        return [self.tz_name] * self.n_trk
+
+    def local_time(self):
+        '''Returns the local (wall clock) times in the track timezone as a
+        datetime64[ns] array, each GPX track in its own if they differ.'''
+        if not isinstance(self.tz_name, tuple):
+            return timezones.to_local(self.time, self.tz_name)
+        local = np.empty(len(self), dtype='datetime64[ns]')
+        bounds = self.track_starts()
+        for start, end, tz_name in zip(bounds[:-1], bounds[1:], self.tz_name):
+            local[start:end] = timezones.to_local(self.time[start:end], tz_name)
+        return local
+
+    def datetimes(self):
+        '''Returns the times as a list of datetimes in the track timezone,
+        each GPX track in its own if they differ, the form
+        py_gps.get_gpx_data returns.'''
+        if not isinstance(self.tz_name, tuple):
+            return timezones.to_datetimes(self.time, self.tz_name)
+        time = []
+        bounds = self.track_starts()
+        for start, end, tz_name in zip(bounds[:-1], bounds[1:], self.tz_name):
+            time.extend(timezones.to_datetimes(self.time[start:end], tz_name))
+        return time
+
+    def to_lists(self):
+        '''Returns lat, lon, ele, hr, time as get_gpx_data does.'''
+        return (self.lat.tolist(), self.lon.tolist(), self.ele.tolist(),
+            self.hr.tolist(), self.datetimes())
@@ -0,0 +1,224 @@
+''' Persistent cache of parsed tracks.
+Stores the Track arrays for a GPX file, along with the get_gpx_info text, so
+later runs can skip the XML parsing entirely. Each entry is a raw .bin file
+holding the columns one after the other, which is memory mapped when read,
+and a .json file with the column layout and the key: the path, size, and
+modification time of the GPX file, and optionally a hash of its content.
+An entry is invalid if any of these change. The least recently used entries
+are removed when the cache is larger than max_bytes.
+'''
+
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from track import Track
+import instrument
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'py_gps', 'tracks')
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+# Version of the entry format, entries with another version are ignored
+FORMAT_VERSION = 2
+ALIGN = 8
+# Track attributes stored as columns, the rest are Track.extras
+TRACK_COLUMNS = ('lat', 'lon', 'ele', 'hr', 'time', 'seg_offsets', 'trk_offsets')
+
+def get_cache_dir():
+    '''Returns the cache directory, which may be set with PY_GPS_CACHE.'''
+    return os.environ.get('PY_GPS_CACHE', DEFAULT_CACHE_DIR)
+
+def hash_file(file_name, block_size=1024 * 1024):
+    '''Returns the SHA-1 hex digest of the file content.'''
+    sha = hashlib.sha1()
+    with open(file_name, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+def load_gpx(file_name):
+    '''Parses the file with gpxpy and returns the Track and get_gpx_info text.
+    This is what the cache does on a miss.'''
+    import py_gps
+    gpx = py_gps.get_gpx(file_name)
+    return py_gps.get_gpx_track(gpx), py_gps.get_gpx_info(gpx)
+
+class TrackCache:
+    '''On-disk cache of parsed tracks.
+
+        Parameters
+        ----------
+        cache_dir : str
+            Directory for the cache entries.
+            default: get_cache_dir()
+        max_bytes : int
+            Size the cache is kept under by removing the least recently used
+            entries.
+            default: DEFAULT_MAX_BYTES
+        use_hash : boolean
+            Whether to also check a hash of the file content. This is safer
+            but reads every file.
+            default: False
+    '''
+
+    def __init__(self, cache_dir=None, max_bytes=DEFAULT_MAX_BYTES, use_hash=False):
+        self.cache_dir = cache_dir if cache_dir else get_cache_dir()
+        self.max_bytes = max_bytes
+        self.use_hash = use_hash
+        self.total_bytes = None  # Found when first needed
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def get_paths(self, file_name):
+        '''Returns the .bin and .json paths of the entry for the file.'''
+        key = hashlib.sha1(os.path.abspath(file_name).encode('utf-8')).hexdigest()
+        base = os.path.join(self.cache_dir, key)
+        return base + '.bin', base + '.json'
+
+    def get_key(self, file_name):
+        '''Returns the values that must match for an entry to be valid.'''
+        stat = os.stat(file_name)
+        key = {
+            'version': FORMAT_VERSION,
+            'file_name': os.path.abspath(file_name),
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+        }
+        if self.use_hash:
+            key['hash'] = hash_file(file_name)
+        return key
+
+    @instrument.timed()
+    def get(self, file_name):
+        '''Returns (track, info) from the cache, or None if there is no valid
+        entry. The track arrays are memory mapped.'''
+        bin_path, json_path = self.get_paths(file_name)
+        try:
+            with open(json_path, 'r') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        key = self.get_key(file_name)
+        if any(meta.get(name) != value for name, value in key.items()):
+            self.remove(file_name)
+            return None
+        try:
+            buffer = np.memmap(bin_path, dtype=np.uint8, mode='r') \
+                if meta['nbytes'] else np.empty(0, dtype=np.uint8)
+            # A truncated .bin would give short columns
+            if len(buffer) < meta['nbytes']:
+                raise ValueError('Truncated cache entry')
+            columns = {}
+            for name, dtype, offset, nbytes in meta['columns']:
+                columns[name] = buffer[offset:offset + nbytes].view(dtype)
+        except (OSError, ValueError):
+            self.remove(file_name)
+            return None
+        # Record the use for the LRU eviction
+        try:
+            os.utime(json_path)
+        except OSError:
+            pass
+        extras = {name: values for name, values in columns.items()
+            if name not in TRACK_COLUMNS}
+        track = Track(columns['lat'], columns['lon'], columns['ele'],
+            columns['hr'], columns['time'], meta['tz_name'], extras,
+            columns['seg_offsets'], columns['trk_offsets'])
+        instrument.add_points(len(track))
+        return track, meta['info']
+
+    @instrument.timed()
+    def put(self, file_name, track, info, key=None):
+        '''Stores the track and info for the file. key is the get_key of the
+        file taken before it was read, so a file that changes while it is
+        being read is not stored under its new key. It is taken now if not
+        given.'''
+        bin_path, json_path = self.get_paths(file_name)
+        # Drop any old entry so the size stays right
+        self.remove(file_name)
+        arrays = [(name, getattr(track, name)) for name in TRACK_COLUMNS] \
+            + list(track.extras.items())
+        columns = []
+        offset = 0
+        for name, values in arrays:
+            columns.append([name, values.dtype.str, offset, values.nbytes])
+            offset += -(-values.nbytes // ALIGN) * ALIGN
+        meta = dict(key) if key is not None else self.get_key(file_name)
+        meta.update({'tz_name': track.tz_name, 'info': info, 'n': len(track),
+            'nbytes': offset, 'columns': columns})
+        # Write to temporary files, then rename, so readers never see a
+        # partial entry. The .json is written last as it marks the entry valid.
+        tmp = f'{bin_path}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as f:
+            for (name, values), column in zip(arrays, columns):
+                f.seek(column[2])
+                f.write(np.ascontiguousarray(values).tobytes())
+            f.truncate(meta['nbytes'])
+        os.replace(tmp, bin_path)
+        tmp = f'{json_path}.{os.getpid()}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp, json_path)
+        if self.total_bytes is not None:
+            self.total_bytes += meta['nbytes'] + os.path.getsize(json_path)
+        self.evict()
+
+    def load(self, file_name, loader=load_gpx):
+        '''Returns (track, info) for the file, from the cache if possible,
+        otherwise using loader(file_name) and storing the result.'''
+        entry = self.get(file_name)
+        if entry is None:
+            key = self.get_key(file_name)
+            entry = loader(file_name)
+            self.put(file_name, *entry, key=key)
+        return entry
+
+    def remove(self, file_name):
+        '''Removes the entry for the file if there is one.'''
+        for path in self.get_paths(file_name):
+            self.remove_path(path)
+
+    def remove_path(self, path):
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except OSError:
+            return
+        if self.total_bytes is not None:
+            self.total_bytes -= size
+
+    def list_entries(self):
+        '''Returns a list of (last use, base path, bytes) for the entries.'''
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith('.json'):
+                continue
+            json_path = os.path.join(self.cache_dir, name)
+            base = json_path[:-len('.json')]
+            try:
+                stat = os.stat(json_path)
+                nbytes = stat.st_size + os.path.getsize(base + '.bin')
+            except OSError:
+                continue
+            entries.append((stat.st_mtime_ns, base, nbytes))
+        return entries
+
+    def evict(self):
+        '''Removes the least recently used entries until the cache is no
+        larger than max_bytes.'''
+        if self.total_bytes is None:
+            self.total_bytes = sum(entry[2] for entry in self.list_entries())
+        if self.total_bytes <= self.max_bytes:
+            return
+        for last_use, base, nbytes in sorted(self.list_entries()):
+            if self.total_bytes <= self.max_bytes:
+                break
+            # Remove the .json first so the entry is invalid before the data goes
+            self.remove_path(base + '.json')
+            self.remove_path(base + '.bin')
+
+    def clear(self):
+        '''Removes all entries.'''
+        for last_use, base, nbytes in self.list_entries():
+            self.remove_path(base + '.json')
+            self.remove_path(base + '.bin')
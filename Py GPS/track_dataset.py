@@ -0,0 +1,383 @@
+''' Parquet dataset of tracks and their derived columns.
+Keeps the points of a library of GPX files, with the speed, the filtered
+speed, hr, ele, and the segment of each point, as a Parquet dataset
+partitioned by the year and month (UTC) of the points, e.g.
+
+    dataset_dir/year=2021/month=3/17.parquet
+
+holds the March 2021 points of the file with id 17. Each file is sorted by
+time and written in row groups of ROW_GROUP_SIZE points with min/max
+statistics, so a query for a time range or hr range only reads the
+partitions and row groups that can match, and nothing is parsed again. The
+dataset is appended to as new files arrive: each GPX file gets its own
+Parquet files, listed in manifest.json with the size and modification time
+of the GPX file, and a changed file has its Parquet files replaced. pyarrow
+is only needed here.
+
+    python track_dataset.py add ~/GPSLink
+    python track_dataset.py query --start 2021-03-01 --end 2021-04-01 --min-hr 150
+'''
+
+import argparse
+import datetime
+import json
+import os
+import sys
+
+import numpy as np
+
+DEFAULT_DATASET_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'py_gps', 'dataset')
+# Version of the dataset format, a dataset with another version is rebuilt
+FORMAT_VERSION = 1
+# Points per row group, smaller groups can be skipped more finely
+ROW_GROUP_SIZE = 16384
+# Partition columns, not stored in the Parquet files
+PARTITION_COLUMNS = (('year', 'int16'), ('month', 'int8'))
+# Columns stored for each point
+COLUMNS = (('file_id', 'int32'), ('trk', 'int32'), ('seg', 'int32'),
+    ('index', 'int64'), ('time', 'timestamp'), ('lat', 'float64'), ('lon', 'float64'),
+    ('ele', 'float32'), ('hr', 'uint16'), ('speed', 'float64'),
+    ('speed_filtered', 'float64'))
+
+def get_dataset_dir():
+    '''Returns the dataset directory, which may be set with PY_GPS_DATASET.'''
+    return os.environ.get('PY_GPS_DATASET', DEFAULT_DATASET_DIR)
+
+def get_schema():
+    '''Returns the pyarrow schema of the stored columns.'''
+    import pyarrow as pa
+    fields = []
+    for name, type_name in COLUMNS:
+        if type_name == 'timestamp':
+            type = pa.timestamp('ns', tz='UTC')
+        else:
+            type = pa.from_numpy_dtype(np.dtype(type_name))
+        fields.append(pa.field(name, type))
+    return pa.schema(fields)
+
+def get_partitioning():
+    '''Returns the hive style year/month partitioning.'''
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    return ds.partitioning(pa.schema([pa.field(name, pa.from_numpy_dtype(np.dtype(type_name)))
+        for name, type_name in PARTITION_COLUMNS]), flavor='hive')
+
+def load_track(file_name):
+    '''Reads the track for the dataset.'''
+    import gpx_stream
+    return gpx_stream.read_track(file_name)
+
+def get_columns(track):
+    '''Returns the columns for a Track as a dict of arrays, without file_id.
+    hr is masked where missing, and speed and speed_filtered are in mph, as
+    py_gps main plots them.'''
+    import resampling
+    import speed as s
+    speed = s.get_speed(track)[0]
+    if len(track) > 1:
+        speed_filtered = s.process_speed(track, speed, fs=resampling.get_fs(track),
+            uniform=True, zero_phase=True)
+    else:
+        speed_filtered = speed.copy()
+    seg = track.segment_ids()
+    trk_of_seg = np.repeat(np.arange(track.n_trk), np.diff(track.trk_offsets))
+    return {
+        'trk': trk_of_seg[seg], 'seg': seg, 'index': np.arange(len(track)),
+        'time': track.time, 'lat': track.lat, 'lon': track.lon, 'ele': track.ele,
+        'hr': np.ma.masked_equal(track.hr.astype(np.uint16), 0),
+        'speed': speed, 'speed_filtered': speed_filtered,
+    }
+
+def get_partitions(time_ns):
+    '''Returns the year and month of each time, 0 and 0 for missing times.'''
+    months = time_ns.view('datetime64[ns]').astype('datetime64[M]')
+    missing = np.isnat(months)
+    months = months.view(np.int64)
+    year = np.where(missing, 0, months // 12 + 1970)
+    month = np.where(missing, 0, months % 12 + 1)
+    return year, month
+
+def to_expression_time(value):
+    '''Returns a datetime or ISO 8601 string as a UTC pyarrow scalar.
+    Naive times are taken to be UTC.'''
+    import pyarrow as pa
+    if isinstance(value, str):
+        value = datetime.datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=datetime.timezone.utc)
+    return pa.scalar(value, type=pa.timestamp('ns', tz='UTC'))
+
+class TrackDataset:
+    '''Appendable Parquet dataset of tracks.
+
+        Parameters
+        ----------
+        dataset_dir : str
+            Directory for the dataset.
+            default: get_dataset_dir()
+        row_group_size : int
+            Points per row group in new files.
+            default: ROW_GROUP_SIZE
+    '''
+
+    def __init__(self, dataset_dir=None, row_group_size=ROW_GROUP_SIZE):
+        self.dataset_dir = dataset_dir if dataset_dir else get_dataset_dir()
+        self.row_group_size = row_group_size
+        self.files = {}
+        self.next_id = 0
+        # Parquet files of removed entries, deleted once the manifest is saved
+        self.removed = []
+        self.load()
+
+    def get_manifest_path(self):
+        return os.path.join(self.dataset_dir, 'manifest.json')
+
+    def load(self):
+        '''Reads the manifest from dataset_dir, if there is a valid one.'''
+        try:
+            with open(self.get_manifest_path(), 'r') as f:
+                meta = json.load(f)
+            if meta.get('version') != FORMAT_VERSION:
+                return
+            self.files = meta['files']
+            self.next_id = meta['next_id']
+        except (OSError, ValueError, KeyError):
+            return
+
+    def save(self):
+        '''Writes the manifest to a temporary file and renames it.'''
+        os.makedirs(self.dataset_dir, exist_ok=True)
+        path = self.get_manifest_path()
+        meta = {'version': FORMAT_VERSION, 'next_id': self.next_id, 'files': self.files}
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp, path)
+        for part in self.removed:
+            try:
+                os.remove(os.path.join(self.dataset_dir, part))
+            except OSError:
+                pass
+        self.removed = []
+
+    def get_key(self, file_name):
+        '''Returns the size and modification time that must match for the
+        entry of a file to be up to date.'''
+        stat = os.stat(file_name)
+        return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+    def is_current(self, file_name):
+        '''Returns whether the file is in the dataset and has not changed.'''
+        entry = self.files.get(os.path.abspath(file_name))
+        if entry is None:
+            return False
+        try:
+            key = self.get_key(file_name)
+        except OSError:
+            return False
+        return all(entry.get(name) == value for name, value in key.items())
+
+    def write_parts(self, file_id, columns):
+        '''Writes the columns to one Parquet file per partition and returns
+        their paths relative to dataset_dir.'''
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        schema = get_schema()
+        n = len(columns['time'])
+        columns['file_id'] = np.full(n, file_id, dtype=np.int32)
+        # Sorted by time, so the row group statistics are narrow
+        order = np.argsort(columns['time'], kind='stable')
+        year, month = get_partitions(columns['time'][order])
+        key = year * 16 + month
+        bounds = np.flatnonzero(np.diff(key)) + 1 if n else []
+        starts = np.concatenate(([0], bounds)).astype(np.int64) if n else []
+        ends = np.concatenate((bounds, [n])).astype(np.int64) if n else []
+        parts = []
+        for start, end in zip(starts, ends):
+            index = order[start:end]
+            arrays = []
+            for field in schema:
+                values = columns[field.name][index]
+                mask = np.ma.getmaskarray(values) if np.ma.isMaskedArray(values) else None
+                arrays.append(pa.array(np.ma.getdata(values), type=field.type, mask=mask))
+            table = pa.Table.from_arrays(arrays, schema=schema)
+            part = os.path.join(f'year={year[start]}', f'month={month[start]}',
+                f'{file_id}.parquet')
+            path = os.path.join(self.dataset_dir, part)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f'{path}.{os.getpid()}.tmp'
+            pq.write_table(table, tmp, row_group_size=self.row_group_size,
+                write_statistics=True)
+            os.replace(tmp, path)
+            parts.append(part)
+        return parts
+
+    def add(self, file_name, track=None, loader=load_track):
+        '''Adds or replaces the file in the dataset. The track is read with
+        loader if not given. The Parquet files are written now, call save to
+        keep the manifest.'''
+        file_name = os.path.abspath(file_name)
+        key = self.get_key(file_name)
+        if track is None:
+            track = loader(file_name)
+        file_id = self.next_id
+        self.next_id += 1
+        parts = self.write_parts(file_id, get_columns(track))
+        self.remove(file_name)
+        entry = {'id': file_id, 'n_points': len(track), 'tz_name': track.tz_name,
+            'parts': parts}
+        entry.update(key)
+        self.files[file_name] = entry
+
+    def remove(self, file_name):
+        '''Removes the file from the dataset if it is there. Its Parquet files
+        are deleted by save.'''
+        entry = self.files.pop(os.path.abspath(file_name), None)
+        if entry is not None:
+            self.removed.extend(entry['parts'])
+
+    def update(self, file_names, loader=load_track, prune=False):
+        '''Adds the files that are new or changed, and saves the manifest if
+        anything changed. If prune is True, files in the dataset that no
+        longer exist are removed. Returns (number added, number removed,
+        errors), where errors is a list of (file_name, message).'''
+        n_added = 0
+        errors = []
+        for file_name in file_names:
+            if self.is_current(file_name):
+                continue
+            try:
+                self.add(file_name, loader=loader)
+                n_added += 1
+            except Exception as ex:
+                errors.append((file_name, f'{type(ex).__name__}: {ex}'))
+        n_removed = 0
+        if prune:
+            for file_name in [name for name in self.files if not os.path.exists(name)]:
+                self.remove(file_name)
+                n_removed += 1
+        if n_added or n_removed:
+            self.save()
+        return n_added, n_removed, errors
+
+    def get_dataset(self):
+        '''Returns the pyarrow dataset of the Parquet files in the manifest,
+        with the year and month partition columns.'''
+        import pyarrow.dataset as ds
+        paths = [os.path.join(self.dataset_dir, part)
+            for entry in self.files.values() for part in entry['parts']]
+        return ds.dataset(paths, schema=None, format='parquet',
+            partitioning=get_partitioning(), partition_base_dir=self.dataset_dir)
+
+    def get_filter(self, start=None, end=None, month=None, min_hr=None, max_hr=None,
+            file_name=None):
+        '''Returns the pyarrow expression for the points from start up to end
+        (datetimes or ISO 8601 strings, naive is UTC), in a month (1-12, UTC)
+        of any year, with hr in [min_hr, max_hr], and in file_name, or None if
+        there are no conditions. The time conditions are also given on the
+        year and month, so whole partitions are skipped.'''
+        import pyarrow.compute as pc
+        conditions = []
+        year_month = pc.field('year') * 12 + pc.field('month')
+        if start is not None:
+            start = to_expression_time(start)
+            value = start.as_py()
+            conditions.append(year_month >= value.year * 12 + value.month)
+            conditions.append(pc.field('time') >= start)
+        if end is not None:
+            end = to_expression_time(end)
+            value = end.as_py()
+            conditions.append(year_month <= value.year * 12 + value.month)
+            conditions.append(pc.field('time') < end)
+        if month is not None:
+            conditions.append(pc.field('month') == month)
+        if min_hr is not None:
+            conditions.append(pc.field('hr') >= min_hr)
+        if max_hr is not None:
+            conditions.append(pc.field('hr') <= max_hr)
+        if file_name is not None:
+            entry = self.files.get(os.path.abspath(file_name))
+            conditions.append(pc.field('file_id') == (entry['id'] if entry else -1))
+        if not conditions:
+            return None
+        expression = conditions[0]
+        for condition in conditions[1:]:
+            expression = expression & condition
+        return expression
+
+    def query(self, columns=None, filter=None, **conditions):
+        '''Returns a pyarrow Table of the points that match filter, a pyarrow
+        expression, or else the conditions of get_filter. Only the row groups
+        whose statistics can match are read. columns defaults to all the
+        columns, with year and month.'''
+        if filter is None:
+            filter = self.get_filter(**conditions)
+        return self.get_dataset().to_table(columns=columns, filter=filter)
+
+    def get_row_groups(self, filter=None, **conditions):
+        '''Returns (row groups that would be read, total row groups) for a
+        query, to see how much the statistics skip.'''
+        if filter is None:
+            filter = self.get_filter(**conditions)
+        dataset = self.get_dataset()
+        n_read = 0
+        n_total = 0
+        for fragment in dataset.get_fragments():
+            n_total += fragment.metadata.num_row_groups
+        for fragment in dataset.get_fragments(filter=filter):
+            if filter is None:
+                n_read += fragment.metadata.num_row_groups
+            else:
+                n_read += len(fragment.split_by_row_group(filter, schema=dataset.schema))
+        return n_read, n_total
+
+    def get_file_names(self):
+        '''Returns {file_id: file_name}.'''
+        return {entry['id']: file_name for file_name, entry in self.files.items()}
+
+def get_parser():
+    parser = argparse.ArgumentParser(description='Parquet dataset of GPX tracks.')
+    parser.add_argument('--dataset', dest='dataset_dir',
+        help='dataset directory (default: PY_GPS_DATASET or ~/.cache/py_gps/dataset)')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    add = subparsers.add_parser('add', help='add new and changed files')
+    add.add_argument('paths', nargs='+',
+        help='GPX files, glob patterns, or directories to search')
+    add.add_argument('--prune', action='store_true',
+        help='remove files that no longer exist')
+    query = subparsers.add_parser('query', help='find points')
+    query.add_argument('--start', help='first time, ISO 8601, naive is UTC')
+    query.add_argument('--end', help='end time (not included), ISO 8601, naive is UTC')
+    query.add_argument('--month', type=int, help='month of any year, 1-12 (UTC)')
+    query.add_argument('--min-hr', type=int, help='lowest hr')
+    query.add_argument('--max-hr', type=int, help='highest hr')
+    query.add_argument('--file', dest='file_name', help='only this GPX file')
+    return parser
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    dataset = TrackDataset(args.dataset_dir)
+    if args.command == 'add':
+        from batch import find_files
+        n_added, n_removed, errors = dataset.update(find_files(args.paths), prune=args.prune)
+        for file_name, error in errors:
+            print(f'{file_name}: ERROR {error}')
+        print(f'Added {n_added} files, removed {n_removed}, '
+            f'{len(dataset.files)} files in the dataset')
+        return 1 if errors else 0
+    conditions = dict(start=args.start, end=args.end, month=args.month,
+        min_hr=args.min_hr, max_hr=args.max_hr, file_name=args.file_name)
+    n_read, n_total = dataset.get_row_groups(**conditions)
+    table = dataset.query(columns=['file_id', 'time', 'hr', 'speed'], **conditions)
+    names = dataset.get_file_names()
+    counts = {}
+    for file_id in table.column('file_id').to_numpy():
+        counts[file_id] = counts.get(file_id, 0) + 1
+    for file_id, count in sorted(counts.items(), key=lambda item: names[item[0]]):
+        print(f'{names[file_id]}: {count} points')
+    print(f'{table.num_rows} points in {len(counts)} files, '
+        f'read {n_read} of {n_total} row groups')
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
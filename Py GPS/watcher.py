@@ -0,0 +1,551 @@
+''' Folder watcher for new and changed GPX files.
+Watches folders, e.g. the GPSLink folder Polar exports land in, and processes
+each .gpx file that is new or has changed, so the summaries, the parsed
+track cache (see track_cache.py), and optionally the Parquet dataset (see
+track_dataset.py) and the aggregate statistics (see aggregates.py) are kept
+up to date without running anything by hand, e.g.
+
+    python watcher.py ~/Documents/GPSLink --json summaries.json --cache --aggregates
+
+Changes are found with inotify on Linux and by scanning the folders every
+poll_interval s elsewhere. A file is only processed once its size and
+modification time have not changed for debounce s, so files that are still
+being written are not read. The files are processed with batch.process_file
+in a process pool, so the asyncio loop is never blocked by the parsing, and
+are passed to the pool through a queue of at most queue_size files, so a
+large export waits to be queued instead of piling up in memory.
+
+The summaries are kept in a JSON file along with the size and modification
+time of each file, so on a restart only the files that changed while the
+watcher was not running are processed again. Listeners, called as
+listener(file_name, summary), are told of each update, with summary None
+for a file that was removed. If keep_tracks is set, the Track the pool read
+is passed to the listeners in the summary as _track, so e.g. DatasetUpdater
+does not parse the file again; it is removed once the listeners have been
+called.
+'''
+
+import argparse
+import asyncio
+import concurrent.futures
+import json
+import os
+import struct
+import sys
+
+from batch import find_files, format_summary, process_file
+
+DEFAULT_WATCH_DIR = os.path.join(os.path.expanduser('~'), 'Documents', 'GPSLink')
+# Time a file must be unchanged before it is processed, s
+DEBOUNCE = 2.
+# Time between scans when inotify is not used, s
+POLL_INTERVAL = 5.
+# Files waiting for the pool at most
+QUEUE_SIZE = 16
+# Version of the summary file format
+FORMAT_VERSION = 1
+
+# inotify flags, from <sys/inotify.h>
+IN_MODIFY = 0x2
+IN_ATTRIB = 0x4
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_MOVE_SELF = 0x800
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+    | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF)
+# wd, mask, cookie, len
+EVENT_HEADER = struct.Struct('iIII')
+
+def get_watch_dir():
+    '''Returns the default folder to watch, which may be set with
+    PY_GPS_WATCH.'''
+    return os.environ.get('PY_GPS_WATCH', DEFAULT_WATCH_DIR)
+
+def is_gpx(file_name):
+    return file_name.endswith('.gpx')
+
+def get_key(file_name):
+    '''Returns (size, mtime_ns) of the file, or None if it does not exist.'''
+    try:
+        stat = os.stat(file_name)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+def get_keys(file_names):
+    '''Returns a dict of get_key for each file.'''
+    return {file_name: get_key(file_name) for file_name in file_names}
+
+def get_file_summary(file_name, cache_dir=None, aggregates=False, keep_track=False):
+    '''Returns the batch.process_file summary of the file, with the size and
+    modification time it had when it was read. If aggregates is True the
+    aggregates.get_entry of the file is added as aggregates, from the track
+    process_file read. If keep_track is True the track is returned as
+    _track. Runs in the pool.'''
+    key = get_key(file_name)
+    summary = process_file(file_name, cache_dir=cache_dir,
+        keep_track=aggregates or keep_track)
+    track = summary.pop('_track', None)
+    if keep_track and track is not None:
+        summary['_track'] = track
+    if key is not None:
+        summary['size'], summary['mtime_ns'] = key
+    if aggregates and not summary.get('error'):
+        import aggregates as ag
+        try:
+            summary['aggregates'] = ag.get_entry(file_name, track=track)
+        except Exception as ex:
+            summary['error'] = f'{type(ex).__name__}: {ex}'
+    return summary
+
+class Inotify:
+    '''inotify watches on directory trees, using libc with ctypes. Raises
+    OSError where inotify is not available.'''
+
+    def __init__(self):
+        import ctypes
+        import ctypes.util
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        if not hasattr(self.libc, 'inotify_init1'):
+            raise OSError('inotify is not available')
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        # Directory for each watch descriptor
+        self.dirs = {}
+
+    def add_tree(self, path):
+        '''Watches the directory and all the directories below it.'''
+        for dir_path, dir_names, file_names in os.walk(path):
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(dir_path), WATCH_MASK)
+            if wd >= 0:
+                self.dirs[wd] = dir_path
+
+    def read(self):
+        '''Returns a list of (path, mask) for the events waiting. path is
+        None for a queue overflow, when events were lost.'''
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(data):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                events.append((None, mask))
+                continue
+            dir_path = self.dirs.get(wd)
+            if mask & IN_IGNORED:
+                self.dirs.pop(wd, None)
+            if dir_path is None:
+                continue
+            events.append((os.path.join(dir_path, os.fsdecode(name)) if name else dir_path,
+                mask))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+class SummaryStore:
+    '''The summary of each file, kept in a JSON file if file_name is given.
+    It is a listener, so it can be added to FolderWatcher.listeners.'''
+
+    def __init__(self, file_name=None):
+        self.file_name = file_name
+        self.summaries = {}
+        self.changed = False
+        if file_name:
+            self.load()
+
+    def load(self):
+        try:
+            with open(self.file_name, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data.get('version') == FORMAT_VERSION:
+            self.summaries = data['files']
+
+    def get_text(self):
+        return json.dumps({'version': FORMAT_VERSION, 'files': self.summaries})
+
+    def save(self, text=None):
+        '''Writes the summaries, or text from get_text, to the JSON file.'''
+        if not self.file_name:
+            return
+        if text is None:
+            text = self.get_text()
+        # Write to a temporary file, then rename, so readers never see a
+        # partial file
+        tmp = f'{self.file_name}.{os.getpid()}.tmp'
+        with open(tmp, 'w') as f:
+            f.write(text)
+        os.replace(tmp, self.file_name)
+
+    def get_keys(self):
+        '''Returns the (size, mtime_ns) the files had when they were read.'''
+        return {file_name: (summary['size'], summary['mtime_ns'])
+            for file_name, summary in self.summaries.items() if 'size' in summary}
+
+    def __call__(self, file_name, summary):
+        if summary is None:
+            if self.summaries.pop(file_name, None) is None:
+                return
+        else:
+            self.summaries[file_name] = summary
+        self.changed = True
+
+class DatasetUpdater:
+    '''A listener that adds, replaces, and removes the files in a
+    track_dataset.TrackDataset. The dataset is written in its own thread,
+    one file at a time, so it does not block the loop. The track the pool
+    read is used when the summary has it as _track, see
+    FolderWatcher(keep_tracks=True). Otherwise, if cache_dir is given the
+    tracks are taken from the TrackCache there, which the pool has just
+    filled, and only without either is the file parsed again here.'''
+
+    def __init__(self, dataset_dir=None, cache_dir=None):
+        from track_dataset import TrackDataset, load_track
+        self.dataset = TrackDataset(dataset_dir)
+        self.loader = load_track
+        if cache_dir:
+            from batch import get_cache
+            self.loader = lambda file_name: get_cache(cache_dir).load(file_name)[0]
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+    def update(self, file_name, summary, track=None):
+        if summary is None:
+            self.dataset.remove(file_name)
+        elif summary.get('error'):
+            return
+        else:
+            try:
+                self.dataset.add(file_name, track, loader=self.loader)
+            except Exception as ex:
+                print(f'{file_name}: ERROR adding to the dataset: {type(ex).__name__}: {ex}',
+                    flush=True)
+                return
+        self.dataset.save()
+
+    def __call__(self, file_name, summary):
+        # The watcher removes _track once the listeners have been called
+        track = summary.get('_track') if summary is not None else None
+        self.executor.submit(self.update, file_name, summary, track)
+
+    def close(self):
+        self.executor.shutdown()
+
+class FolderWatcher:
+    '''Watches folders and processes the GPX files that are new or changed.
+
+        Parameters
+        ----------
+        paths : list of str
+            The folders to watch, including the folders below them.
+        store : SummaryStore
+            Keeps the summaries. The files it has with the same size and
+            modification time are not processed again.
+            default: SummaryStore()
+        cache_dir : str
+            Directory of the TrackCache the parsed tracks are kept in, or None
+            for no cache.
+            default: None
+        jobs : int
+            Number of worker processes.
+            default: number of cores
+        debounce : float
+            Time a file must be unchanged before it is processed, s.
+            default: DEBOUNCE
+        poll_interval : float
+            Time between scans of the folders when inotify is not used, s.
+            default: POLL_INTERVAL
+        queue_size : int
+            Files waiting for the pool at most.
+            default: QUEUE_SIZE
+        use_inotify : boolean
+            Whether to use inotify where it is available.
+            default: True
+        aggregates : aggregates.Aggregates
+            Aggregate statistics to keep up to date, or None. The files it
+            does not have are processed again.
+            default: None
+        keep_tracks : boolean
+            Whether the pool returns the Track it read, so the listeners get
+            it in the summary as _track.
+            default: False
+    '''
+
+    def __init__(self, paths, store=None, cache_dir=None, jobs=None, debounce=DEBOUNCE,
+            poll_interval=POLL_INTERVAL, queue_size=QUEUE_SIZE, use_inotify=True,
+            aggregates=None, keep_tracks=False):
+        self.paths = [os.path.abspath(path) for path in paths]
+        self.store = store if store is not None else SummaryStore()
+        self.cache_dir = cache_dir
+        self.jobs = jobs if jobs else os.cpu_count() or 1
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self.queue_size = queue_size
+        self.use_inotify = use_inotify
+        self.aggregates = aggregates
+        self.keep_tracks = keep_tracks
+        self.listeners = [self.store]
+        # (size, mtime_ns) of the files that have been queued
+        self.known = self.store.get_keys()
+        if aggregates is not None:
+            self.listeners.append(aggregates)
+            self.known = {file_name: key for file_name, key in self.known.items()
+                if file_name in aggregates.files and key == (aggregates.files[file_name]['size'],
+                    aggregates.files[file_name]['mtime_ns'])}
+        # File: (key, time first seen with that key) while being debounced
+        self.pending = {}
+        # Paths from inotify that need to be checked, and whether all do
+        self.dirty = set()
+        self.rescan = True
+        self.inotify = None
+        self.n_processed = 0
+
+    def on_events(self):
+        '''Reads the inotify events when the loop says they are ready.'''
+        for path, mask in self.inotify.read():
+            if path is None:
+                self.rescan = True
+            elif mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    # Files may be written before the watch is added, so
+                    # the new tree is scanned too
+                    self.inotify.add_tree(path)
+                self.dirty.add(path)
+            elif is_gpx(path):
+                self.dirty.add(path)
+        self.wake.set()
+
+    def get_changed(self, rescan, dirty):
+        '''Returns get_keys for the files that may have changed. Runs in a
+        thread, as it lists folders and stats files.'''
+        if rescan:
+            file_names = [os.path.abspath(file_name) for file_name in find_files(self.paths)]
+            # Known files that are not found any more give None
+            return get_keys(set(file_names) | set(self.known) | set(self.pending))
+        file_names = set()
+        for path in dirty:
+            if is_gpx(path):
+                file_names.add(path)
+                continue
+            # A folder was added, moved, or removed
+            prefix = path + os.sep
+            file_names.update(os.path.abspath(file_name) for file_name in find_files([path]))
+            file_names.update(file_name for file_name in self.known if file_name.startswith(prefix))
+            file_names.update(file_name for file_name in self.pending if file_name.startswith(prefix))
+        return get_keys(file_names)
+
+    def check(self, keys, now):
+        '''Updates the pending files from keys. Files that have gone are
+        removed.'''
+        for file_name, key in keys.items():
+            if key is None:
+                self.pending.pop(file_name, None)
+                if self.known.pop(file_name, None) is not None:
+                    self.notify(file_name, None)
+                    print(f'{file_name}: removed', flush=True)
+            elif key == self.known.get(file_name):
+                self.pending.pop(file_name, None)
+            elif file_name not in self.pending or self.pending[file_name][0] != key:
+                # New or still changing, start the debounce again
+                self.pending[file_name] = (key, now)
+
+    def get_ready(self, now):
+        '''Returns the pending files that have been unchanged for debounce s,
+        and the time until the next one is, or None.'''
+        ready = []
+        wait = None
+        for file_name, (key, since) in list(self.pending.items()):
+            left = since + self.debounce - now
+            if left <= 0:
+                ready.append(file_name)
+                self.known[file_name] = key
+                del self.pending[file_name]
+            elif wait is None or left < wait:
+                wait = left
+        return sorted(ready), wait
+
+    def notify(self, file_name, summary):
+        for listener in self.listeners:
+            listener(file_name, summary)
+
+    async def save(self):
+        '''Writes the summaries and the aggregates if they have changed.'''
+        for store in (self.store, self.aggregates):
+            if store is not None and store.changed:
+                store.changed = False
+                await asyncio.to_thread(store.save, store.get_text())
+
+    async def work(self, executor):
+        '''Processes files from the queue in the pool until cancelled.'''
+        loop = asyncio.get_running_loop()
+        while True:
+            file_name = await self.queue.get()
+            try:
+                summary = await loop.run_in_executor(executor, get_file_summary, file_name,
+                    self.cache_dir, self.aggregates is not None, self.keep_tracks)
+            except Exception as ex:
+                # The worker itself failed, e.g. it was killed
+                summary = {'file_name': file_name, 'n_points': 0,
+                    'error': f'{type(ex).__name__}: {ex}'}
+            try:
+                if summary.get('mtime_ns') is not None:
+                    # The key the file was read with, it is checked again
+                    # if it changes
+                    key = (summary['size'], summary['mtime_ns'])
+                    if self.known.get(file_name) is not None:
+                        self.known[file_name] = key
+                self.notify(file_name, summary)
+                # The listeners have taken the aggregates and the track, the
+                # summaries do not keep them
+                summary.pop('aggregates', None)
+                summary.pop('_track', None)
+                self.n_processed += 1
+                error = summary.get('error')
+                if error:
+                    print(f'{file_name}: ERROR {error}', flush=True)
+                else:
+                    print(format_summary(summary), flush=True)
+                if self.queue.empty():
+                    await self.save()
+            finally:
+                self.queue.task_done()
+
+    async def run(self, stop=None):
+        '''Watches until stop, an asyncio.Event, is set, or forever.'''
+        loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(self.queue_size)
+        self.wake = asyncio.Event()
+        if self.use_inotify:
+            try:
+                self.inotify = Inotify()
+                for path in self.paths:
+                    self.inotify.add_tree(path)
+                loop.add_reader(self.inotify.fd, self.on_events)
+            except (OSError, AttributeError, NotImplementedError):
+                self.inotify = None
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.jobs)
+        workers = [asyncio.create_task(self.work(executor)) for i in range(self.jobs)]
+        try:
+            next_scan = loop.time()
+            while stop is None or not stop.is_set():
+                now = loop.time()
+                rescan = self.rescan or (self.inotify is None and now >= next_scan)
+                if rescan or self.dirty:
+                    dirty = self.dirty
+                    self.dirty = set()
+                    self.rescan = False
+                    if rescan:
+                        next_scan = now + self.poll_interval
+                    self.check(await asyncio.to_thread(self.get_changed, rescan, dirty),
+                        loop.time())
+                ready, wait = self.get_ready(loop.time())
+                for file_name in ready:
+                    # Waits here while the queue is full
+                    await self.queue.put(file_name)
+                if self.inotify is None:
+                    scan_wait = max(next_scan - loop.time(), 0.)
+                    wait = scan_wait if wait is None else min(wait, scan_wait)
+                self.wake.clear()
+                if self.dirty or self.rescan:
+                    continue
+                waits = [asyncio.create_task(self.wake.wait())]
+                if stop is not None:
+                    waits.append(asyncio.create_task(stop.wait()))
+                await asyncio.wait(waits, timeout=wait, return_when=asyncio.FIRST_COMPLETED)
+                for task in waits:
+                    task.cancel()
+            # Finish the files that were queued
+            await self.queue.join()
+        finally:
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            if self.inotify is not None:
+                loop.remove_reader(self.inotify.fd)
+                self.inotify.close()
+                self.inotify = None
+            executor.shutdown(cancel_futures=True)
+            await self.save()
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description='Watch folders and process new and changed GPX files.')
+    parser.add_argument('paths', nargs='*',
+        help='folders to watch (default: PY_GPS_WATCH or ~/Documents/GPSLink)')
+    parser.add_argument('--json', dest='json_file',
+        help='keep the summaries in this JSON file, so a restart only processes '
+            'the files that changed')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+        help='number of worker processes (default: number of cores)')
+    parser.add_argument('--cache', dest='cache_dir', nargs='?', const='', default=None,
+        help='keep the parsed tracks in the cache, in this directory if given '
+            '(default: PY_GPS_CACHE or ~/.cache/py_gps/tracks)')
+    parser.add_argument('--dataset', dest='dataset_dir', nargs='?', const='', default=None,
+        help='keep the Parquet dataset up to date, in this directory if given '
+            '(default: PY_GPS_DATASET or ~/.cache/py_gps/dataset)')
+    parser.add_argument('--aggregates', dest='aggregates_file', nargs='?', const='',
+        default=None,
+        help='keep the aggregate statistics up to date, in this file if given '
+            '(default: PY_GPS_AGGREGATES or ~/.cache/py_gps/aggregates.json)')
+    parser.add_argument('--debounce', type=float, default=DEBOUNCE,
+        help=f'time a file must be unchanged before it is processed, s (default: {DEBOUNCE})')
+    parser.add_argument('--poll-interval', type=float, default=POLL_INTERVAL,
+        help=f'time between scans without inotify, s (default: {POLL_INTERVAL})')
+    parser.add_argument('--queue-size', type=int, default=QUEUE_SIZE,
+        help=f'files waiting for the workers at most (default: {QUEUE_SIZE})')
+    parser.add_argument('--no-inotify', dest='use_inotify', action='store_false',
+        help='scan the folders every poll interval even where inotify is available')
+    return parser
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    paths = args.paths if args.paths else [get_watch_dir()]
+    for path in paths:
+        if not os.path.isdir(path):
+            print(f'Not a folder: {path}', file=sys.stderr)
+            return 1
+    cache_dir = args.cache_dir
+    if cache_dir == '':
+        from track_cache import get_cache_dir
+        cache_dir = get_cache_dir()
+    aggregates = None
+    if args.aggregates_file is not None:
+        from aggregates import Aggregates, get_aggregates_file
+        aggregates = Aggregates(args.aggregates_file or get_aggregates_file())
+    watcher = FolderWatcher(paths, SummaryStore(args.json_file), cache_dir, args.jobs,
+        args.debounce, args.poll_interval, args.queue_size, args.use_inotify, aggregates,
+        keep_tracks=args.dataset_dir is not None)
+    updater = None
+    if args.dataset_dir is not None:
+        updater = DatasetUpdater(args.dataset_dir or None, cache_dir)
+        watcher.listeners.append(updater)
+    print(f'Watching {", ".join(paths)}, Ctrl-C to stop', flush=True)
+    try:
+        asyncio.run(watcher.run())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if updater is not None:
+            updater.close()
+    print(f'Processed {watcher.n_processed} files')
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())